@@ -0,0 +1,105 @@
+"""
+admission.py
+
+Admission control for new connections, checked by the accept loop in server.py before a
+handshake thread is started.
+
+A connection is turned away (with a "retry in N s" hint) when:
+ - the server already holds max_players live connections,
+ - too many handshakes are already in flight (bounded by a semaphore),
+ - the remote IP already has max_per_ip live connections,
+ - the remote IP is connecting faster than its token bucket allows.
+
+Trusted IPs (e.g. a cluster gateway that proxies many players) skip the per-IP checks.
+"""
+
+import socket
+import threading
+import time
+
+MAX_PLAYERS = 200
+MAX_HANDSHAKES = 32
+MAX_CONNECTIONS_PER_IP = 8
+# new connections per second allowed from one IP, and how many can come in a burst
+CONNECT_RATE = 2.0
+CONNECT_BURST = 5
+
+
+class AdmissionController:
+
+    def __init__(self, max_players=MAX_PLAYERS, max_handshakes=MAX_HANDSHAKES,
+                 max_per_ip=MAX_CONNECTIONS_PER_IP, rate=CONNECT_RATE, burst=CONNECT_BURST):
+        self.max_players = max_players
+        self.max_per_ip = max_per_ip
+        self.rate = rate
+        self.burst = burst
+        self.handshakes = threading.BoundedSemaphore(max_handshakes)
+        # ip -> list of sockets we admitted from it. Closed sockets (fileno() == -1) are
+        # pruned lazily, so nothing else in the server needs to report disconnects here.
+        self._connections = {}
+        # ip -> (tokens, last refill time)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.trusted = set()
+
+    def _prune(self, now):
+        # a bucket that has had time to refill completely is the same as no bucket
+        refill_secs = self.burst / self.rate
+        for ip, (_, last) in list(self._buckets.items()):
+            if now - last > refill_secs:
+                del self._buckets[ip]
+        for ip in list(self._connections):
+            live = [c for c in self._connections[ip] if c.fileno() != -1]
+            if live:
+                self._connections[ip] = live
+            else:
+                del self._connections[ip]
+
+    def _take_token(self, ip, now):
+        tokens, last = self._buckets.get(ip, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[ip] = (tokens, now)
+            # seconds until a whole token is available again
+            return (1 - tokens) / self.rate
+        self._buckets[ip] = (tokens - 1, now)
+        return 0
+
+    def admit(self, conn, ip):
+        """
+        Decide whether to accept a new connection from 'ip'.
+        Returns 0 if it was admitted (the caller then owns one handshake slot and must call
+        handshake_done()), otherwise the number of seconds the client should wait before retrying.
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            wait = 0 if ip in self.trusted else self._take_token(ip, now)
+            if wait:
+                self.rejected += 1
+                return max(1, int(wait + 0.999))
+            total = sum(len(conns) for conns in self._connections.values())
+            if total >= self.max_players or (ip not in self.trusted and len(self._connections.get(ip, [])) >= self.max_per_ip):
+                self.rejected += 1
+                return 5
+            if not self.handshakes.acquire(blocking=False):
+                self.rejected += 1
+                return 1
+            self._connections.setdefault(ip, []).append(conn)
+        return 0
+
+    def handshake_done(self):
+        self.handshakes.release()
+
+
+def reject(conn, retry_after):
+    # Best effort: never block the accept loop on a client that isn't reading.
+    try:
+        conn.send(f"[SERVERFULL] Server full, retry in {retry_after} s\n".encode("utf-8"), socket.MSG_DONTWAIT)
+    except OSError:
+        pass
+    try:
+        conn.close()
+    except OSError:
+        pass
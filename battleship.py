@@ -3,19 +3,23 @@ battleship.py
 
 Contains core data structures and logic for Battleship, including:
  - Board class for storing ship positions, hits, misses
+ - BoardSnapshot, a cheap immutable copy of a Board that can be turned into bytes and back
  - Utility function parse_coordinate for translating e.g. 'B5' -> (row, col)
+   (the networked game parses everything players type with commands.py)
  - A test harness run_single_player_game() to demonstrate the logic in a local, single-player mode
 
 """
 
 import random
+import struct
+from collections import namedtuple
 from shared import last_move_time, gameOverPrompt
 import socket
 import threading
 import queue
-import time
-import select
+import clock
 from collections import Counter
+from commands import CommandParser, CommandError, QUIT, FLEET, SALVO_EXAMPLE
 
 BOARD_SIZE = 10
 SHIPS = [
@@ -33,12 +37,20 @@ SHIPS = [
 ]
 """
 
+# parses what players type, with coordinate tables for this board size
+command_parser = CommandParser(BOARD_SIZE, [name for name, _ in SHIPS])
+
 
 class DisconnectError(Exception):
     "Raised exception to deal with disconnected user."
     pass
 
 
+class PlacementTimeout(Exception):
+    "Raised when a player hasn't placed all their ships by the deadline."
+    pass
+
+
 class Board:
     """
     Represents a single Battleship board with hidden ships.
@@ -51,11 +63,14 @@ class Board:
              'positions': set of (r, c),
           }
         used to determine when a specific ship has been fully sunk.
+      - self.layout: tuple of (name, row, col, size, orientation) for every ship placed
+      - self.shots: bitmask of the cells that have been fired at (bit row * size + col)
+        layout and shots are immutable and only ever replaced, so snapshot() can share them.
 
     In a full 2-player networked game:
       - Each player has their own Board instance.
       - When a player fires at their opponent, the server calls
-        opponent_board.fire_at(...) and sends back the result.
+        opponent_board.fire_at(...) (or fire_many(...) for a salvo) and sends back the result.
     """
 
     def __init__(self, size=BOARD_SIZE):
@@ -65,6 +80,8 @@ class Board:
         # display_grid is what the player or an observer sees (no 'S')
         self.display_grid = [['.' for _ in range(size)] for _ in range(size)]
         self.placed_ships = []  # e.g. [{'name': 'Destroyer', 'positions': {(r, c), ...}}, ...]
+        self.layout = ()
+        self.shots = 0
 
     def place_ships_randomly(self, ships=SHIPS):
         """
@@ -81,7 +98,7 @@ class Board:
                 col = random.randint(0, self.size - 1)
 
                 if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
+                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation, ship_name)
                     self.placed_ships.append({
                         'name': ship_name,
                         'positions': occupied_positions
@@ -119,7 +136,7 @@ class Board:
 
                 # Check if we can place the ship
                 if self.can_place_ship(row, col, ship_size, orientation):
-                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation)
+                    occupied_positions = self.do_place_ship(row, col, ship_size, orientation, ship_name)
                     self.placed_ships.append({
                         'name': ship_name,
                         'positions': occupied_positions
@@ -149,10 +166,12 @@ class Board:
                     return False
         return True
 
-    def do_place_ship(self, row, col, ship_size, orientation):
+    def do_place_ship(self, row, col, ship_size, orientation, ship_name=None):
         """
         Place the ship on hidden_grid by marking 'S', and return the set of occupied positions.
+        The placement is also recorded in self.layout, which is what to_bytes() saves.
         """
+        self.layout = self.layout + ((ship_name, row, col, ship_size, orientation),)
         occupied = set()
         if orientation == 0:  # Horizontal
             for c in range(col, col + ship_size):
@@ -176,6 +195,8 @@ class Board:
         The server can use this result to inform the firing player.
         """
         cell = self.hidden_grid[row][col]
+        if cell == 'S' or cell == '.':
+            self.shots |= 1 << (row * self.size + col)
         if cell == 'S':
             # Mark a hit
             self.hidden_grid[row][col] = 'X'
@@ -197,6 +218,58 @@ class Board:
             # In principle, this branch shouldn't happen if 'S', '.', 'X', 'o' are all possibilities
             return ('already_shot', None)
 
+    def fire_many(self, cells):
+        """
+        Fire a salvo: every (row, col) in 'cells' at once. Returns a list with the
+        (result, sunk_ship_name) tuple fire_at() would have given for each cell, in order; a
+        ship the salvo sinks is named on the last of its shots that hit it.
+
+        The salvo is worked out on the shots bitmask: each ship is checked once against all
+        the new shots, rather than every shot searching the ships.
+        """
+        fired = 0
+        bits = []
+        for row, col in cells:
+            bit = 1 << (row * self.size + col)
+            bits.append(bit if not (self.shots | fired) & bit else 0)
+            fired |= bit
+        fired &= ~self.shots
+
+        snapshot = self.snapshot()
+        hits = 0
+        # bit of the shot that finished a ship -> its name
+        sinking = {}
+        for ship, placed in zip(self.layout, self.placed_ships):
+            mask = snapshot.ship_mask(ship)
+            hit = mask & fired
+            if not hit:
+                continue
+            hits |= hit
+            placed['positions'] -= {(r, c) for r, c in cells if hit >> (r * self.size + c) & 1}
+            if not placed['positions']:
+                # the highest-numbered bit isn't necessarily the last shot, so find it in order
+                last = next(b for b in reversed(bits) if b & hit)
+                sinking[last] = ship[0]
+
+        self.shots |= fired
+        results = []
+        for (row, col), bit in zip(cells, bits):
+            if not bit:
+                results.append(('already_shot', None))
+            elif bit & hits:
+                self.hidden_grid[row][col] = 'X'
+                self.display_grid[row][col] = 'X'
+                results.append(('hit', sinking.get(bit)))
+            else:
+                self.hidden_grid[row][col] = 'o'
+                self.display_grid[row][col] = 'o'
+                results.append(('miss', None))
+        return results
+
+    def ships_afloat(self):
+        """Number of ships that still have a cell that hasn't been hit."""
+        return sum(1 for ship in self.placed_ships if ship['positions'])
+
     def _mark_hit_and_check_sunk(self, row, col):
         """
         Remove (row, col) from the relevant ship's positions.
@@ -220,6 +293,20 @@ class Board:
                 return False
         return True
 
+    def snapshot(self):
+        """
+        Return an immutable BoardSnapshot of the board as it is now. This is O(1): the
+        snapshot shares the layout tuple and shots bitmask, which firing only ever replaces.
+        """
+        return BoardSnapshot(self.size, self.layout, self.shots)
+
+    def to_bytes(self):
+        return self.snapshot().to_bytes()
+
+    @staticmethod
+    def from_bytes(data):
+        return BoardSnapshot.from_bytes(data).to_board()
+
     def print_display_grid(self, show_hidden_board=False):
         """
         Print the board as a 2D grid.
@@ -265,34 +352,127 @@ class Board:
         return result
 
 
+# to_bytes() format version, stored as the first byte
+BOARD_FORMAT_VERSION = 2
+# ship name byte for a name that isn't in SHIPS (the name follows as length + utf-8)
+CUSTOM_SHIP = 255
+
+
+class BoardSnapshot(namedtuple("BoardSnapshot", "size layout shots")):
+    """
+    Immutable picture of a Board at one moment: the ship layout plus which cells have been
+    fired at. Everything else (hits, misses, sunk ships) follows from those two.
+
+    to_bytes() encoding (version 2):
+        version, size, ship count                              3 bytes
+        per ship: name index in SHIPS, row, col,
+                  orientation << 7 | ship size                 4 bytes
+        shots bitmask, little-endian                           ceil(size * size / 8) bytes
+    so a standard 10x10 board with two ships is 24 bytes, and any board up to 255x255 fits.
+    Version 1 (the start cell as one byte, row * size + col) is still read, for checkpoints
+    written before.
+    """
+    __slots__ = ()
+
+    def to_bytes(self):
+        if self.size > 255 or any(ship_size > 127 for _, _, _, ship_size, _ in self.layout):
+            raise ValueError(f"Board of size {self.size} is too big to encode")
+        names = [name for name, _ in SHIPS]
+        out = bytearray(struct.pack("<BBB", BOARD_FORMAT_VERSION, self.size, len(self.layout)))
+        for name, row, col, ship_size, orientation in self.layout:
+            if name in names:
+                out.append(names.index(name))
+            else:
+                encoded = (name or "").encode("utf-8")
+                out += bytes([CUSTOM_SHIP, len(encoded)]) + encoded
+            out += bytes([row, col, (orientation << 7) | ship_size])
+        out += self.shots.to_bytes((self.size * self.size + 7) // 8, "little")
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, size, count = struct.unpack_from("<BBB", data, 0)
+        if version not in (1, BOARD_FORMAT_VERSION):
+            raise ValueError(f"Unsupported board format version {version}")
+        names = [name for name, _ in SHIPS]
+        offset = 3
+        layout = []
+        for _ in range(count):
+            index = data[offset]
+            offset += 1
+            if index == CUSTOM_SHIP:
+                length = data[offset]
+                name = data[offset + 1:offset + 1 + length].decode("utf-8")
+                offset += 1 + length
+            else:
+                name = names[index]
+            if version == 1:
+                row, col = divmod(data[offset], size)
+                offset += 1
+            else:
+                row, col = data[offset], data[offset + 1]
+                offset += 2
+            packed = data[offset]
+            offset += 1
+            layout.append((name, row, col, packed & 0x7f, packed >> 7))
+        shots = int.from_bytes(data[offset:offset + (size * size + 7) // 8], "little")
+        return cls(size, tuple(layout), shots)
+
+    def ship_mask(self, ship):
+        """Bitmask of the cells covered by one (name, row, col, size, orientation) layout entry."""
+        _, row, col, ship_size, orientation = ship
+        step = 1 if orientation == 0 else self.size
+        mask = 0
+        for i in range(ship_size):
+            mask |= 1 << (row * self.size + col + i * step)
+        return mask
+
+    def hits(self):
+        """Bitmask of the cells that have been shot and hit a ship."""
+        occupied = 0
+        for ship in self.layout:
+            occupied |= self.ship_mask(ship)
+        return self.shots & occupied
+
+    def sunk(self):
+        """Names of the ships that have been sunk, in placement order."""
+        return [ship[0] for ship in self.layout if self.shots & self.ship_mask(ship) == self.ship_mask(ship)]
+
+    def public(self):
+        """What an opponent or spectator may see: shots, hits and sunk ships, but no ship positions."""
+        return {"size": self.size, "shots": f"{self.shots:x}", "hits": f"{self.hits():x}", "sunk": self.sunk()}
+
+    def to_board(self):
+        """Build a new, live Board in this state."""
+        board = Board(self.size)
+        for name, row, col, ship_size, orientation in self.layout:
+            positions = board.do_place_ship(row, col, ship_size, orientation, name)
+            board.placed_ships.append({'name': name, 'positions': positions})
+        for cell in range(self.size * self.size):
+            if self.shots >> cell & 1:
+                board.fire_at(cell // self.size, cell % self.size)
+        return board
+
+
 def parse_coordinate(coord_str):
     """
     Convert something like 'B5' into zero-based (row, col).
     Example: 'A1' => (0, 0), 'C10' => (2, 9)
-    HINT: you might want to add additional input validation here...
+    Raises ValueError for anything that isn't a cell on the board.
     """
-    coord_str = coord_str.strip().upper()
-    row_letter = coord_str[0]
-    col_digits = coord_str[1:]
-
-    if row_letter > 'J': 
-        print("Row is out of the range; should be A-J")
-    elif not row_letter.isalpha():
-        print("Invalid, try enter a letter and a number as the coordinate, e.g B5.")
-        raise IndexError 
-
-    if not 0 < int(col_digits) <= 10: 
-        print("Column is out of range, should be 1-10.")
-    print("We'll proceed.")
-
-    row = ord(row_letter) - ord('A')
-    col = int(col_digits) - 1  # zero-based
-
-    return (row, col)
+    text = coord_str.strip()
+    cell = command_parser.coordinate(text)
+    if cell is None:
+        raise ValueError(f"'{text}' isn't a coordinate on the grid, e.g. B5")
+    return cell
 
 # added for multiplayer ship placement
-def network_place_ships(board, readFile, writeFile):
-    
+def network_place_ships(board, readFile, writeFile, deadline=None):
+    """
+    Ask the player to place every ship in SHIPS on 'board'. If 'deadline' (a clock.now() time)
+    is given, PlacementTimeout is raised once it passes with ships still to place.
+    """
+
     send("\nPlace your ships one-by-one. Format: PLACE A1 H Destroyer", writeFile)
     send("[SERVERINFO] Example board layout below:", writeFile)
     send("  " + " ".join(str(i+1) for i in range(BOARD_SIZE)), writeFile)
@@ -316,47 +496,43 @@ def network_place_ships(board, readFile, writeFile):
             total = ship_targets[ship]
             send(f"  - {ship}: {placed} of {total}", writeFile)
         send("Enter placement command:", writeFile)
-        msg = recv(readFile).strip()
-
-        try:
-            if not msg.startswith("PLACE"):
-                send("Invalid format. Use: PLACE A1 H DESTROYER", writeFile)
-                continue
-
-            _, coord, orient, shipname = msg.split()
-            shipname = shipname.upper()
-            row, col = parse_coordinate(coord.upper())
-            orientation = 0 if orient.upper() == 'H' else 1 if orient.upper() == 'V' else None
-
-            if shipname not in [s[0] for s in SHIPS]:
-                send(f"Unknown ship name. '{shipname}'. Available: {', '.join([s[0] for s in SHIPS])}", writeFile)
-                continue
-
-            if ship_placed[shipname] >= ship_targets[shipname]:
-                send(f"All {shipname} ships already placed.", writeFile)
-                continue
-
-            #if shipname in placed_ships:
-                #send("That ship is already placed.", writeFile)
-                #continue
-
-            
-
-            ship = next(s for s in SHIPS if s[0] == shipname)
-            if board.can_place_ship(row, col, ship[1], orientation):
-                positions = board.do_place_ship(row, col, ship[1], orientation)
-                board.placed_ships.append({"name": ship[0], "positions": positions})
-                #placed_ships.add(shipname)
-                ship_placed[shipname] += 1
-                orientation_full = "horizontally" if orientation == 0 else "vertically"
-                send(f"{shipname.capitalize()} placed at {coord.upper()} {orientation_full}.", writeFile)
-                remaining = ship_targets[shipname] - ship_placed[shipname]
-                send(f"[SERVERINFO] {ship_placed[shipname]} of {ship_targets[shipname]} {shipname}(s) placed. Remaining: {remaining}", writeFile)
+        if deadline is not None:
+            # heartbeat replies don't count, as on a turn
+            while not readFile.poll(1.0):
+                if clock.now() > deadline:
+                    raise PlacementTimeout("Client didn't place their ships in time.")
+        line = readFile.readline()
+        if not line:
+            raise DisconnectError("Client disconnected while placing ships.")
+        command = command_parser.place(line)
+        if command is FLEET:
+            # the loop shows what's been placed so far
+            continue
+        if type(command) is CommandError:
+            kind = command_parser.kind_of(line)
+            if kind:
+                # sent ahead for later, but the game isn't there yet
+                send(f"[SERVERINFO] Ignored {kind} ('{line.strip()}'), you're still placing ships.", writeFile)
             else:
-                send("Invalid position. Try again.", writeFile)
-
-        except Exception as e:
-            send(f"Error: {e}", writeFile)
+                send(command.message, writeFile)
+            continue
+
+        row, col, orientation, shipname = command
+        if ship_placed[shipname] >= ship_targets[shipname]:
+            send(f"All {shipname} ships already placed.", writeFile)
+            continue
+
+        ship = next(s for s in SHIPS if s[0] == shipname)
+        if board.can_place_ship(row, col, ship[1], orientation):
+            positions = board.do_place_ship(row, col, ship[1], orientation, ship[0])
+            board.placed_ships.append({"name": ship[0], "positions": positions})
+            ship_placed[shipname] += 1
+            orientation_full = "horizontally" if orientation == 0 else "vertically"
+            send(f"{shipname.capitalize()} placed at {chr(ord('A') + row)}{col + 1} {orientation_full}.", writeFile)
+            remaining = ship_targets[shipname] - ship_placed[shipname]
+            send(f"[SERVERINFO] {ship_placed[shipname]} of {ship_targets[shipname]} {shipname}(s) placed. Remaining: {remaining}", writeFile)
+        else:
+            send("Invalid position. Try again.", writeFile)
 
     return board
 
@@ -486,7 +662,27 @@ def run_single_player_game_online(rfile, wfile):
 
 
 
-def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne, savedTwo):
+def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne, savedTwo, gameOver=gameOverPrompt, turnTimeout=None, onTurnEnd=None, onEvent=None, salvo=False, placementTimeout=None):
+    """
+    Play one game between two connected players.
+
+    gameOver is a one-item list used as the "game has ended" flag; it defaults to the shared
+    flag watched by the server's timeout monitor, but concurrent games (e.g. tournaments) pass
+    their own. If turnTimeout is set, a player who takes longer than that many seconds on
+    their turn forfeits, without needing a separate monitor thread. Likewise with
+    placementTimeout for placing their ships.
+
+    When the game is decided, each player dict gets a "result" of 'win' or 'loss', and an
+    "endReason" of 'sunk', 'quit', 'timeout' or 'disconnect'.
+    onTurnEnd(nextPlayer, otherPlayer), if given, is called whenever it becomes someone's turn
+    (e.g. so the server can checkpoint the game).
+    onEvent(event), if given, is called with a dict for everything spectators can see: whose
+    turn it is, each shot and its result, and how the game ended (see spectate.py).
+    If salvo is set, players fire one shot per ship they have left, all on one line, and get
+    one combined reply per turn (see Board.fire_many).
+    When picking a game up (newGame False), clientOne is whoever's turn it is, and savedOne may
+    have a "turn_used": seconds of that turn already gone before the game stopped.
+    """
 
     saveBoardOne = None
     saveBoardTwo = None
@@ -502,14 +698,12 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
             print("[SERVERERROR] Could not send message to client. Client may have disconnected.")
             raise DisconnectError("Client disconnected.")
 
+    # built as one string and written once, it's sent every turn; only the cells change
+    gridHeader = "GRID\n  " + " ".join(str(i + 1).rjust(2) for i in range(BOARD_SIZE)) + "\n"
+    rowLabels = [f"{chr(ord('A') + r):2} " for r in range(BOARD_SIZE)]
+
     def send_board(board, clientWFile):
-        clientWFile.write("GRID\n")
-        clientWFile.write("  " + " ".join(str(i + 1).rjust(2) for i in range(board.size)) + '\n')
-        for r in range(board.size):
-            row_label = chr(ord('A') + r)
-            row_str = " ".join(board.display_grid[r][c] for c in range(board.size))
-            clientWFile.write(f"{row_label:2} {row_str}\n")
-        clientWFile.write('')
+        clientWFile.write(gridHeader + "".join([label + " ".join(row) + "\n" for label, row in zip(rowLabels, board.display_grid)]))
         clientWFile.flush()
 
     def send_to_spectators(msg):
@@ -517,7 +711,7 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
         for spectator in spectators:
             try:
                 send(f"[FOR_SPECTATOR:] {msg}", spectator["writeFile"])
-            except (BrokenPipeError, OSError) as e:
+            except (BrokenPipeError, OSError, DisconnectError) as e:
                 print("[SERVERERROR] Could not send message to spectator. Spectator may have disconnected.")
 
     def send_to_both(msg):
@@ -527,6 +721,43 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
     def recv(clientRFile):
         return clientRFile.readline().strip()
 
+    def publish(kind, **fields):
+        if onEvent:
+            onEvent(dict(fields, type=kind))
+
+    def win():
+        # the current player has just sunk the last of the other's ships
+        finish(currentUser, otherUser, "sunk")
+        send_board(otherUser["board"], currentUser["writeFile"])
+        send(f"Congratulations! You sank all ships in {currentUser['moves']} moves.", currentUser["writeFile"])
+        send_to_both("The game is over. Would you like to play again?")
+        send_to_spectators("A game has ended.")
+        gameOver[0] = True
+
+    def finish(winner, loser, reason):
+        winner["result"] = 'win'
+        loser["result"] = 'loss'
+        winner["endReason"] = loser["endReason"] = reason
+        publish("end", winner=winner["username"], loser=loser["username"], reason=reason)
+
+    def place(client, opponent):
+        # the new board, or None if they ran out of time and forfeited
+        board = Board(BOARD_SIZE)
+        deadline = clock.now() + placementTimeout if placementTimeout else None
+        try:
+            network_place_ships(board, client["readFile"], client["writeFile"], deadline)
+        except PlacementTimeout:
+            for msg, wfile in (("[!] Timeout! You didn't place your ships in time and have forfeited.", client["writeFile"]),
+                               ("[!] Opponent didn't place their ships in time. You win!!", opponent["writeFile"])):
+                try:
+                    send(msg, wfile)
+                except DisconnectError:
+                    pass
+            finish(opponent, client, "timeout")
+            gameOver[0] = True
+            return None
+        return board
+
     # concurrently: each client picks if they want to place randomly or manually. For now, just random. 
        
     ###clientOneBoard = BOARD_SIZE
@@ -543,8 +774,9 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
         clientTwo["writeFile"].write(f"[SERVERINFO] Please wait for {clientOne["username"]} to finish placing their ships.\n")
         clientTwo["writeFile"].flush()
 
-        boardOne = Board(BOARD_SIZE)
-        network_place_ships(boardOne, clientOne["readFile"], clientOne["writeFile"])
+        boardOne = place(clientOne, clientTwo)
+        if boardOne is None:
+            return None
 
         clientTwo["writeFile"].write("[SERVERINFO] It's your turn to place ships.\n")
         clientTwo["writeFile"].flush()
@@ -552,12 +784,15 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
         clientOne["writeFile"].write(f"[SERVERINFO] Please wait for {clientTwo["username"]} to finish placing their ships.\n")
         clientOne["writeFile"].flush()
 
-        boardTwo = Board(BOARD_SIZE)
-        network_place_ships(boardTwo, clientTwo["readFile"], clientTwo["writeFile"])
+        boardTwo = place(clientTwo, clientOne)
+        if boardTwo is None:
+            return None
 
    
         send_to_both("Welcome to battleships, both your boards have now been generated!!\n")
         send_to_both("[SERVERINFO] You have 10 seconds each turn to make a move, or you will forfeit your game.\n")
+        if salvo:
+            send_to_both("[SERVERINFO] Salvo rules: each turn, fire one shot for every ship you have left, all on one line.\n")
 
         clientOne["board"] = boardOne
         clientTwo["board"] = boardTwo
@@ -565,32 +800,46 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
         clientOne["moves"] = 0
         clientTwo["moves"] = 0
 
-        last_move_time[clientOne["connection"]] = time.time()
-        last_move_time[clientTwo["connection"]] = time.time()
+        last_move_time[clientOne["connection"]] = clock.now()
+        last_move_time[clientTwo["connection"]] = clock.now()
 
     else:
         # Assign boards based on username to ensure correct mapping after reconnect
         if savedOne and savedTwo:
             if clientOne["username"] == savedOne["owner"]:
-                clientOne["board"] = savedOne["board"]
-                clientTwo["board"] = savedTwo["board"]
+                clientOne["board"] = savedOne["board"].to_board()
+                clientTwo["board"] = savedTwo["board"].to_board()
             else:
-                clientOne["board"] = savedTwo["board"]
-                clientTwo["board"] = savedOne["board"]
-        clientOne["moves"] = 0
-        clientTwo["moves"] = 0
+                clientOne["board"] = savedTwo["board"].to_board()
+                clientTwo["board"] = savedOne["board"].to_board()
+        # players restored from a checkpoint keep their move counts
+        clientOne["moves"] = clientOne.get("moves", 0)
+        clientTwo["moves"] = clientTwo.get("moves", 0)
+        # the turn clock picks up where it was (clientOne is whoever's turn it is)
+        turnUsed = (savedOne or {}).get("turn_used", 0)
+        last_move_time[clientOne["connection"]] = clock.now() - turnUsed
+        last_move_time[clientTwo["connection"]] = clock.now()
 
+    if newGame:
+        turnUsed = 0
     currentUser = clientOne
     otherUser = clientTwo
     spectatorPlayer = 'Player 1'
 
     invalidInput = 0
+    turnStarted = clock.now()
+    # what to resume from if someone disconnects before the first turn is over
+    saveBoardOne = {"owner": clientOne["username"], "board": clientOne["board"].snapshot()}
+    saveBoardTwo = {"owner": clientTwo["username"], "board": clientTwo["board"].snapshot()}
+    if onTurnEnd:
+        onTurnEnd(currentUser, otherUser)
+    publish("turn", player=currentUser["username"])
 
 
     try:    
-        while not gameOverPrompt[0]:
+        while not gameOver[0]:
 
-            if gameOverPrompt[0]:
+            if gameOver[0]:
                 break
 
             # if invalidInput is 1, it's the current user's second+ attempt, so we've already received this message.
@@ -598,8 +847,14 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
                 send("It's your opponent's turn, hang tight!", otherUser["writeFile"])
                 sendWaitMsg = True
                 send_board(otherUser["board"], currentUser["writeFile"])
-                send("It's your turn! Enter coordinate to fire at (e.g. B5):", currentUser["writeFile"])
+                if salvo:
+                    salvoSize = currentUser["board"].ships_afloat()
+                    send(f"It's your turn! Enter {salvoSize} coordinate{'s' if salvoSize != 1 else ''} to fire at (e.g. {' '.join(SALVO_EXAMPLE[:salvoSize])}):", currentUser["writeFile"])
+                else:
+                    send("It's your turn! Enter coordinate to fire at (e.g. B5):", currentUser["writeFile"])
                 send("[SERVERINFO] Reminder: You have 10 seconds to respond or you'll forfeit your turn.", currentUser["writeFile"])
+                turnStarted = clock.now() - turnUsed
+                turnUsed = 0
 
             # set back to 1 later if we need to prompt the user again / they need another go. 
             invalidInput = 0
@@ -607,22 +862,30 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
             #send the opponent board to the current user
             try:
 
-                sock = currentUser["connection"]
                 rfile = currentUser["readFile"]
                 
 
-                # wait up to 1 second for the user to enter input
-                ready, _, _ = select.select([sock], [], [], 1.0)
-                if gameOverPrompt[0]:
+                # wait up to 1 second for the user to enter input (heartbeat replies don't count)
+                ready = rfile.poll(1.0)
+                if gameOver[0]:
                     break
                 if not ready:
+                    if turnTimeout and clock.now() - turnStarted > turnTimeout:
+                        send("[!] Timeout! You have forfeited. Disconnecting...", currentUser["writeFile"])
+                        send("[!] Opponent has forfeited due to inactivity. You win!!", otherUser["writeFile"])
+                        finish(otherUser, currentUser, "timeout")
+                        gameOver[0] = True
+                        break
                     continue
 
-                print(gameOverPrompt)
-                guess = recv(currentUser["readFile"])
+                print(gameOver)
+                line = rfile.readline()
+                if not line:
+                    raise ConnectionError("Player disconnected")
+                guess = line.strip()
                 print("Received ", guess)
 
-                last_move_time[currentUser["connection"]] = time.time()
+                last_move_time[currentUser["connection"]] = clock.now()
 
             except:
                 print("[SERVERINFO] The current player disconnected.")
@@ -635,18 +898,57 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
                 raise DisconnectError("Client disconnected.")
             
 
-            if guess.lower() == 'quit':
+            command = command_parser.fire(guess, salvoSize if salvo else 1)
+
+            if command is QUIT:
                 send("Thanks for playing. Goodbye.", currentUser["writeFile"])
                 send("Your opponent quit or forfeited! You win!", otherUser["writeFile"])
-                gameOverPrompt[0] = True
+                finish(otherUser, currentUser, "quit")
+                gameOver[0] = True
                 # end the game
                 break
 
-            try:
-                row, col = parse_coordinate(guess)
+            if command is FLEET:
+                # doesn't use up the turn
+                afloat = [ship['name'] for ship in currentUser["board"].placed_ships if ship['positions']]
+                send(f"[SERVERINFO] Your ships still afloat: {', '.join(afloat)}. Enter your shot:", currentUser["writeFile"])
+                invalidInput = 1
+            elif type(command) is CommandError:
+                kind = command_parser.kind_of(guess)
+                if kind and kind != "a shot":
+                    # left over from earlier, or sent ahead; either way it's still their turn
+                    send(f"Invalid input: ignored {kind} ('{guess}'), it's your turn to fire.", currentUser["writeFile"])
+                else:
+                    send(f"Invalid input: {command.message}", currentUser["writeFile"])
+                invalidInput = 1
+            elif salvo:
+                cells = command.cells
+                results = otherUser["board"].fire_many(cells)
+                currentUser["moves"] += len(cells)
+                report = []
+                for (row, col), (result, sunk_name) in zip(cells, results):
+                    cell = f"{chr(ord('A') + row)}{col + 1}"
+                    if result != 'already_shot':
+                        publish("shot", player=currentUser["username"], target=otherUser["username"],
+                                cell=cell, result=result, sunk=sunk_name)
+                    report.append(f"{cell} {result.replace('_', ' ').upper()}")
+                hits = sum(1 for result, _ in results if result == 'hit')
+                sunk = [sunk_name for _, sunk_name in results if sunk_name]
+                sank = f" You sank the {', '.join(sunk)}!" if sunk else ""
+                send(f"SALVO: {', '.join(report)}.{sank}", currentUser["writeFile"])
+                send(f"Your opponent fired a salvo: {hits} hit{'s' if hits != 1 else ''}" + (f", your {', '.join(sunk)} sunk!" if sunk else "."), otherUser["writeFile"])
+                send_to_spectators(f"{spectatorPlayer} fired a salvo: {hits} of {len(cells)} hit" + (f" and sank {', '.join(sunk)}!" if sunk else "."))
+                if otherUser["board"].all_ships_sunk():
+                    win()
+                    return
+            else:
+                (row, col), = command.cells
                 result, sunk_name = otherUser["board"].fire_at(row, col)
                 # May need to move this as we don't want the move to count? 
                 currentUser["moves"] += 1
+                if result != 'already_shot':
+                    publish("shot", player=currentUser["username"], target=otherUser["username"],
+                            cell=f"{chr(ord('A') + row)}{col + 1}", result=result, sunk=sunk_name)
 
                 if result == 'hit':
                     if sunk_name:
@@ -657,11 +959,7 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
                         send("Your opponent hit!", otherUser["writeFile"])
                         send_to_spectators(f"{spectatorPlayer} hit!")
                     if otherUser["board"].all_ships_sunk():
-                        send_board(otherUser["board"])
-                        send(f"Congratulations! You sank all ships in {moves} moves.", currentUser["writeFile"])
-                        send_to_both("The game is over. Would you like to play again?")
-                        send_to_spectators("A game has ended.")
-                        gameOverPrompt[0] = True
+                        win()
                         return
                 elif result == 'miss':
                     send("MISS!",  currentUser["writeFile"])
@@ -669,14 +967,6 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
                     send_to_spectators(f"{spectatorPlayer} missed!")
                 elif result == 'already_shot':
                     send("You've already fired at that location.", currentUser["writeFile"])
-            except ValueError as e:
-                send(f"Invalid input: Your coordinate should take the format (letter,number)",  currentUser["writeFile"])
-                currentUser["moves"] -=1 
-                invalidInput = 1
-            except IndexError as e: 
-                send(f"Invalid input, your number and letter should be on the grid!", currentUser["writeFile"])
-                currentUser["moves"] -=1 
-                invalidInput = 1
             
             #don't change the current users, as we want to give the user another turn. 
             if invalidInput == 1:
@@ -694,8 +984,11 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
                     spectatorPlayer = 'Player 1'
 
             # if the game is over, we need to break out of the loop #after each turn, save the board state. 
-                saveBoardOne = {"owner": clientOne["username"], "board": clientOne["board"]}
-                saveBoardTwo = {"owner": clientTwo["username"], "board": clientTwo["board"]}
+                saveBoardOne = {"owner": clientOne["username"], "board": clientOne["board"].snapshot()}
+                saveBoardTwo = {"owner": clientTwo["username"], "board": clientTwo["board"].snapshot()}
+                if onTurnEnd:
+                    onTurnEnd(currentUser, otherUser)
+                publish("turn", player=currentUser["username"])
             
                 sendWaitMsg = False
             
@@ -711,13 +1004,18 @@ def run_multi_player_round(clientOne, clientTwo, spectators, newGame, savedOne,
             # etc. 
     except DisconnectError:
         print("[SERVERINFO] A player disconnected. Ending game loop.")
+        # whoever's connection is gone loses; we were waiting on the current player if we can't tell
+        if currentUser["readFile"].eof or not otherUser["readFile"].eof:
+            finish(otherUser, currentUser, "disconnect")
+        else:
+            finish(currentUser, otherUser, "disconnect")
         try:
             send("Your opponent quit or forfeited! You win!", otherUser["writeFile"])
         except:
             print("[SERVERINFO] The other player also disconnected.")
         print("did it reach here")
 
-        gameOverPrompt[0] = True
+        gameOver[0] = True
         return saveBoardOne, saveBoardTwo
         #raise Exception("Game ended due to disconnect or timeout")
 
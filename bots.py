@@ -0,0 +1,247 @@
+"""
+bots.py
+
+Computer players the server can seat opposite someone who has waited too long for a human
+(server.py --bot-after). A bot is a player dict like any other, so run_multi_player_round
+plays it without knowing, but there's no socket and no thread behind it:
+
+    player["writeFile"]  every line the game sends goes straight to Bot.hear(), which works
+                         out what the bot will say when it's next asked
+    player["readFile"]   readline() hands the game the bot's next line, straight away
+    player["connection"] a memtransport.MemoryConnection
+
+So a bot costs one small object and its boards, and hundreds can be playing at once, each
+driven by the game thread of the human it's playing.
+
+The bot places its ships at random and fires hunt-and-target: at random cells of one colour
+of a checkerboard (every ship covers both colours) until it hits something, then next to its
+hits, along the line once it has two, until the ship is sunk. It plays salvo games too.
+Once so few layouts of its opponent's ships are left that the endgame can be worked out
+exactly (solver.py), it plays single shots perfectly, unless that takes too long.
+If it's ever asked for something it has no answer to, it hangs up, like a player leaving.
+"""
+
+import itertools
+import random
+from collections import deque
+
+from battleship import Board, BOARD_SIZE, SHIPS
+from memtransport import MemoryConnection
+from solver import endgame
+
+_names = itertools.count(1)
+SHIP_SIZES = dict(SHIPS)
+
+
+def cell_name(cell):
+    return f"{chr(ord('A') + cell[0])}{cell[1] + 1}"
+
+
+class Bot:
+
+    def __init__(self, rng, size=BOARD_SIZE, ships=SHIPS):
+        self.rng = rng
+        self.size = size
+        board = Board(size)
+        board.place_ships_randomly(ships)
+        self.placements = [f"PLACE {cell_name((row, col))} {'H' if o == 0 else 'V'} {ship}" for ship, row, col, _, o in board.layout]
+        self.placed = False
+        # cells not fired at yet, and hits on ships that aren't sunk yet
+        self.unknown = {(r, c) for r in range(size) for c in range(size)}
+        self.open_hits = []
+        # sizes of the opponent's ships not sunk yet
+        self.afloat = [length for _, length in ships]
+        # the cells of the last shot (or salvo), waiting for their results
+        self.fired = []
+        # what we'll say next, oldest first
+        self.replies = deque()
+
+    # --- what the server says ---
+
+    def hear(self, line):
+        if line.startswith("It's your turn!"):
+            words = line.split()
+            # "It's your turn! Enter 3 coordinates..." in salvo games
+            shots = int(words[4]) if len(words) > 4 and words[4].isdigit() else 1
+            self.fire(shots)
+        elif line.startswith("Enter placement command"):
+            if not self.placed:
+                self.placed = True
+                self.replies.extend(self.placements)
+        elif line.startswith("Invalid input"):
+            self.fire(len(self.fired) or 1)
+        elif line.startswith("HIT!") and self.fired:
+            sunk = line.partition("You sank the ")[2].rstrip("!")
+            self.record(self.fired[0], True, sunk)
+        elif line.startswith(("MISS!", "You've already")) and self.fired:
+            self.record(self.fired[0], False, None)
+        elif line.startswith("SALVO: "):
+            self.record_salvo(line[len("SALVO: "):])
+        elif "play again" in line:
+            # bots only stay for the one game
+            self.replies.append("n")
+
+    def record_salvo(self, report):
+        # "B5 HIT, C6 MISS. You sank the CRUISER, DESTROYER!"
+        results, _, sank = report.partition(". You sank the ")
+        sunk = sank.rstrip("!").split(", ") if sank else []
+        for cell, result in zip(self.fired, results.rstrip(".").split(", ")):
+            hit = result.split(" ", 1)[1] == "HIT"
+            self.record(cell, hit, None)
+        # which hit sank which ship isn't said, so count them off the last hits
+        for name in sunk:
+            self.sink(self.open_hits[-1] if self.open_hits else self.fired[-1], name)
+
+    def record(self, cell, hit, sunk):
+        self.unknown.discard(cell)
+        if hit:
+            self.open_hits.append(cell)
+        if sunk:
+            self.sink(cell, sunk)
+
+    def sink(self, cell, name):
+        # take the sunk ship's cells off the open hits: a line through 'cell' of the ship's length
+        length = SHIP_SIZES.get(name, 1)
+        if length in self.afloat:
+            self.afloat.remove(length)
+        hits = set(self.open_hits)
+        for dr, dc in ((0, 1), (1, 0)):
+            line = [cell]
+            for step in (1, -1):
+                r, c = cell[0] + dr * step, cell[1] + dc * step
+                while (r, c) in hits:
+                    line.append((r, c))
+                    r, c = r + dr * step, c + dc * step
+            if len(line) >= length:
+                break
+        else:
+            line = [cell]
+        for part in line[:length]:
+            if part in self.open_hits:
+                self.open_hits.remove(part)
+
+    # --- what the bot says ---
+
+    def fire(self, shots):
+        self.fired = []
+        for _ in range(shots):
+            cell = self.choose(exact=shots == 1)
+            if cell is None:
+                break
+            self.fired.append(cell)
+            # so a salvo doesn't pick the same cell twice
+            self.unknown.discard(cell)
+        self.replies.append(" ".join(cell_name(cell) for cell in self.fired))
+
+    def choose(self, exact=False):
+        if exact:
+            cell = self.solved()
+            if cell:
+                return cell
+        targets = self.targets()
+        if targets:
+            return self.rng.choice(targets)
+        hunting = [cell for cell in self.unknown if (cell[0] + cell[1]) % 2 == 0] or list(self.unknown)
+        if not hunting:
+            return None
+        return self.rng.choice(sorted(hunting))
+
+    def solved(self):
+        # the best shot with perfect play, or None if it can't be worked out in time
+        if self.size != endgame.size:
+            return None
+        hits = 0
+        for r, c in self.open_hits:
+            hits |= 1 << (r * self.size + c)
+        # misses, and the cells of sunk ships
+        blocked = 0
+        for r in range(self.size):
+            for c in range(self.size):
+                if (r, c) not in self.unknown:
+                    blocked |= 1 << (r * self.size + c)
+        move = endgame.best_move(self.afloat, hits, blocked & ~hits)
+        return move and move[0]
+
+    def targets(self):
+        # next to a hit, or at either end of a line of them
+        hits = set(self.open_hits)
+        lined = []
+        beside = []
+        for r, c in self.open_hits:
+            for dr, dc in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+                cell = (r + dr, c + dc)
+                if cell not in self.unknown or cell in beside:
+                    continue
+                beside.append(cell)
+                if (r - dr, c - dc) in hits:
+                    lined.append(cell)
+        return lined or beside
+
+
+class BotReader:
+
+    def __init__(self, bot, conn):
+        self.bot = bot
+        self.conn = conn
+        self.dropped = 0
+        self.last_seen = 0.0
+
+    @property
+    def eof(self):
+        return self.conn.closed
+
+    def readline(self):
+        if self.bot.replies and not self.conn.closed:
+            return self.bot.replies.popleft() + "\n"
+        # nothing to say to what it was asked: it leaves
+        self.conn.close()
+        return ""
+
+    def poll(self, timeout=0.0):
+        return True
+
+    def drain(self):
+        pass
+
+    def take_buffered(self):
+        return b""
+
+
+class BotWriter:
+
+    def __init__(self, bot, conn):
+        self.bot = bot
+        self.conn = conn
+        self._pending = []
+
+    def write(self, text):
+        self._pending.append(text)
+        return len(text)
+
+    def flush(self):
+        if self.conn.closed:
+            raise BrokenPipeError("Bot has left")
+        data = "".join(self._pending)
+        self._pending.clear()
+        for line in data.splitlines():
+            self.bot.hear(line.strip())
+
+    def write_encoded(self, data):
+        self.write(data.decode("utf-8"))
+        self.flush()
+
+    def send_frame(self, frame):
+        return True
+
+
+def new_bot(rng=None):
+    """A player dict for a bot, ready to be passed to run_multi_player_round."""
+    bot = Bot(rng or random.Random())
+    conn = MemoryConnection()
+    return {
+        "connection": conn,
+        "readFile": BotReader(bot, conn),
+        "writeFile": BotWriter(bot, conn),
+        "username": f"bot{next(_names)}",
+        "bot": bot,
+    }
@@ -0,0 +1,83 @@
+"""
+capture.py
+
+Recording real sessions, so they can be played back against the server later with replay.py.
+
+server.py --capture-file PATH records every line each connection sends (heartbeat replies
+aside), with the time since that connection was accepted. A line's time is when its bytes were
+received from the socket, not when the game got round to reading it, so a replay sends it with
+the same timing the player did. The file is JSON lines:
+    {"session": 3, "start": 1760000000.12}                 a new connection
+    {"session": 3, "t": 1.532, "line": "B5"}               a line it sent
+    {"session": 3, "t": 40.1, "eof": true}                 it hung up
+Records from different sessions are interleaved in the order they happened.
+
+Capturing is off unless a file is given. Only what players send is recorded, not what the
+server replies, since the replay compares the server's replies between builds. The token in a
+'RESUME <username> <token>' login is a credential, so it's recorded as REDACTED_TOKEN (a replay
+of that session gets turned away as a bad resume, rather than anyone reading the file being
+able to take over the game).
+"""
+
+import itertools
+import json
+import threading
+import time
+
+REDACTED_TOKEN = "<redacted>"
+
+
+def redact(line):
+    # keep the shape of the login, without the token
+    parts = line.split()
+    if len(parts) == 3 and parts[0].upper() == "RESUME":
+        return f"{parts[0]} {parts[1]} {REDACTED_TOKEN}"
+    return line
+
+
+class Recorder:
+
+    def __init__(self, path):
+        self.path = path
+        # appended to, so several runs can be captured into one file
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _write(self, record):
+        data = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(data)
+
+    def session(self):
+        """Start recording a new connection. Returns the capture callback for its LineReader."""
+        session = next(self._ids)
+        started = time.time()
+        self._write({"session": session, "start": started})
+
+        def capture(line, received):
+            t = round(received - started, 3)
+            if line is None:
+                self._write({"session": session, "t": t, "eof": True})
+            else:
+                self._write({"session": session, "t": t, "line": redact(line)})
+
+        return capture
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load(path):
+    """Read a capture file back as {session: [(t, line or None for EOF), ...]}, in session order."""
+    sessions = {}
+    with open(path, encoding="utf-8") as f:
+        for raw in f:
+            record = json.loads(raw)
+            events = sessions.setdefault(record["session"], [])
+            if "line" in record:
+                events.append((record["t"], record["line"]))
+            elif record.get("eof"):
+                events.append((record["t"], None))
+    return sessions
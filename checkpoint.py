@@ -0,0 +1,185 @@
+"""
+checkpoint.py
+
+Crash-consistent checkpoints of running games, so a restarted server can put players back
+into the match they were in.
+
+The checkpoint file is memory-mapped and split into fixed-size slots; every room owns two
+slots and writes them alternately. A record is:
+    header: magic, version, payload length, crc32, sequence number
+    payload: JSON room state (boards are base64 Board.to_bytes(), ~32 characters each)
+The payload is written before the header, and the crc covers the sequence number and payload,
+so a record torn by a crash fails its check and the room's other slot (one save older) is
+used instead.
+
+Game threads only call save(), which stores the state and returns; boards are passed in as
+BoardSnapshots, so nothing is copied or encoded on the game thread. A single background thread
+encodes pending rooms, writes them to the map and flushes it every CHECKPOINT_INTERVAL_SECS.
+
+Only one process may have a file open at a time: slots are handed out from each store's own
+idea of which are free. close() writes out what's pending and stops, e.g. before a reload
+hands the file to the new process (see reload.py).
+"""
+
+import base64
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from battleship import BoardSnapshot
+
+MAGIC = b"BSCK"
+VERSION = 2
+HEADER = struct.Struct("<4sBIIQ")
+SLOT_SIZE = 4096
+# room slots in the file (each room uses two of them)
+MAX_ROOMS = 64
+CHECKPOINT_INTERVAL_SECS = 1.0
+
+
+def encode_snapshots(value):
+    # BoardSnapshots go into the JSON as base64 of their compact encoding (they're tuples,
+    # so json.dumps would otherwise write them out as lists)
+    if isinstance(value, BoardSnapshot):
+        return base64.b64encode(value.to_bytes()).decode("ascii")
+    if isinstance(value, dict):
+        return {key: encode_snapshots(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_snapshots(item) for item in value]
+    return value
+
+
+def decode_snapshot(data):
+    return BoardSnapshot.from_bytes(base64.b64decode(data))
+
+
+class CheckpointStore:
+
+    def __init__(self, path, max_rooms=MAX_ROOMS, slot_size=SLOT_SIZE, interval=CHECKPOINT_INTERVAL_SECS):
+        self.path = path
+        self.slot_size = slot_size
+        self.max_rooms = max_rooms
+        self.interval = interval
+        size = max_rooms * 2 * slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        # room -> (pair index, slot holding its latest record)
+        self._rooms = {}
+        # room -> state waiting to be written (None means the room has finished)
+        self._pending = {}
+        self._lock = threading.Lock()
+        # held while writing to the map, so close() can't write alongside the checkpoint thread
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._seq = 0
+
+    def _read_slot(self, slot):
+        offset = slot * self.slot_size
+        magic, version, length, crc, seq = HEADER.unpack_from(self._map, offset)
+        if magic != MAGIC or version != VERSION or length > self.slot_size - HEADER.size:
+            return None
+        start = offset + HEADER.size
+        payload = bytes(self._map[start:start + length])
+        if zlib.crc32(struct.pack("<Q", seq) + payload) != crc:
+            return None
+        return seq, json.loads(payload)
+
+    def load(self):
+        """
+        Read back every room that was still in progress. Returns {room: state}.
+        Call once at startup, before any save().
+        """
+        latest = {}
+        for pair in range(self.max_rooms):
+            for slot in (pair * 2, pair * 2 + 1):
+                record = self._read_slot(slot)
+                if record is None:
+                    continue
+                seq, state = record
+                self._seq = max(self._seq, seq)
+                room = state["room"]
+                if room not in latest or seq > latest[room][0]:
+                    latest[room] = (seq, pair, slot, state)
+        rooms = {}
+        for room, (seq, pair, slot, state) in latest.items():
+            if state.get("finished"):
+                continue
+            self._rooms[room] = (pair, slot)
+            rooms[room] = state
+        return rooms
+
+    def save(self, room, state):
+        """
+        Queue a checkpoint of this room. Cheap; encoding and writing happen on the checkpoint
+        thread, so state must not be changed afterwards (use board snapshots, not live boards).
+        """
+        with self._lock:
+            self._pending[room] = dict(state, room=room)
+
+    def finish(self, room):
+        """The room's game is over, so it shouldn't be restored any more."""
+        with self._lock:
+            self._pending[room] = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="checkpoint", daemon=True).start()
+
+    def close(self):
+        """Write out whatever is pending and stop writing the file."""
+        self._closed.set()
+        self.write_pending()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.write_pending()
+
+    def write_pending(self):
+        with self._write_lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if not pending:
+            return
+        for room, state in pending.items():
+            if state is None:
+                # tombstone both slots, so an older record can't come back once the slots are reused
+                tombstone = json.dumps({"room": room, "finished": True}).encode("utf-8")
+                self._write(room, tombstone)
+                self._write(room, tombstone)
+                self._rooms.pop(room, None)
+            else:
+                self._write(room, json.dumps(encode_snapshots(state), separators=(",", ":")).encode("utf-8"))
+        self._map.flush()
+
+    def _write(self, room, payload):
+        if len(payload) > self.slot_size - HEADER.size:
+            print(f"[SERVERERROR] Checkpoint for {room} is too big ({len(payload)} bytes), skipping.")
+            return
+        if room not in self._rooms:
+            used = {pair for pair, _ in self._rooms.values()}
+            free = next((pair for pair in range(self.max_rooms) if pair not in used), None)
+            if free is None:
+                print(f"[SERVERERROR] No free checkpoint slots for {room}.")
+                return
+            self._rooms[room] = (free, free * 2 + 1)
+        pair, last_slot = self._rooms[room]
+        self._seq += 1
+        # alternate between the pair's two slots, so the previous checkpoint survives a torn write
+        slot = pair * 2 + (pair * 2 + 1 - last_slot)
+        offset = slot * self.slot_size
+        self._map[offset + HEADER.size:offset + HEADER.size + len(payload)] = payload
+        crc = zlib.crc32(struct.pack("<Q", self._seq) + payload)
+        HEADER.pack_into(self._map, offset, MAGIC, VERSION, len(payload), crc, self._seq)
+        self._rooms[room] = (pair, slot)
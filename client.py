@@ -4,119 +4,167 @@ client.py
 Connects to a Battleship server which runs the single-player game.
 Simply pipes user input to the server, and prints all server responses.
 
-TODO: Fix the message synchronization issue using concurrency (Tier 1, item 1).
+    python client.py --host 127.0.0.1 --port 5002
+    python client.py --unix-socket /tmp/battleship.sock   # a server on this host, see server.py --unix-socket
+
+The connection, heartbeats and reading the server's messages are clientlib.py's; this is
+just the keyboard and the screen on top of it. The keyboard is read all the time: 'quit' goes
+to the server as soon as it's typed, anything else waits until the server has asked for
+something (a clientlib prompt), so what you type can't get ahead of what you've been shown.
 """
 
-import socket
+import argparse
+import asyncio
+import collections
 import threading
-import time
-
-HOST = '127.0.0.1'
-PORT = 5002
-
-# HINT: The current problem is that the client is reading from the socket,
-# then waiting for user input, then reading again. This causes server
-# messages to appear out of order.
-#
-# Consider using Python's threading module to separate the concerns:
-# - One thread continuously reads from the socket and displays messages
-# - The main thread handles user input and sends it to the server
-#
-# import threading
-
-
-
-stopInput = threading.Event()
-# placeholder variable to notify the main thread when we try to exit
-exited = 0 
 
-def main():
+import clientlib
+from clientlib import HOST, PORT
 
-    global exited
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))
-        rfile = s.makefile('r')
-        wfile = s.makefile('w')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Battleship client")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix-socket", help="connect through the server's Unix socket instead of TCP")
+    args = parser.parse_args(argv)
 
-        t1 = threading.Thread(target=receive_messages, args=(rfile,))
-        t1.start()
-
-        try:
-
-                # use the threading event to stop input from being allowed until we receive something. 
-            while not exited: 
-                print("Exited is currently", str(exited))
-                stopInput.wait()
-                if exited:
-                    break
-                user_input = input(">> ")
-                wfile.write(user_input + '\n')
-                #print("Input ended!")
-                wfile.flush()
-                #print("Sent this input!")
-                # Clear it, block input again 
-                stopInput.clear()
-
-            try:
-                s.shutdown(socket.SHUT_RDWR) 
-            except OSError:
-                print("[CLIENT INFO] Socket already closed by server.")
-            s.close()
-            t1.join()
-
-
-        except KeyboardInterrupt:
-            print("\n[INFO] Client exiting.")
+    try:
+        asyncio.run(play(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        print("\n[INFO] Client exiting.")
+
+
+async def play(host, port, unix_socket):
+    game = await clientlib.connect(host=host, port=port, unix_socket=unix_socket)
+    loop = asyncio.get_running_loop()
+    # lines typed before the server asked for them, answered one per prompt (None for end of input)
+    held = collections.deque()
+    # whether the server is waiting for us and nothing's been sent since
+    prompted = False
+    # sends still going, so they're not garbage collected half way
+    sending = set()
+
+    def read_keyboard():
+        # input() blocks, so it gets its own thread (a daemon, so it can't keep us from exiting)
+        while True:
             try:
-                s.shutdown(socket.SHUT_RDWR)
-            except OSError:
-                print("[CLIENT INFO] Socket already closed by server.")
-            except Exception as e:
-                print(f"[CLIENT INFO] Socket shutdown error: {e}")
-
+                line = input(">> ")
+            except EOFError:
+                line = None
             try:
-                s.close()
-            except Exception:
-                pass
-            t1.join()
-            exit()
-
-# HINT: A better approach would be something like:
-
-def receive_messages(rfile):
+                loop.call_soon_threadsafe(typed, line)
+            except RuntimeError:
+                # the client has already finished
+                return
+            if line is None:
+                return
+
+    def typed(line):
+        # runs on the event loop, in the order lines were typed
+        nonlocal prompted
+        if line is not None and line.strip().lower() == "quit":
+            # straight out: whatever was typed ahead of it doesn't matter any more
+            held.clear()
+            prompted = False
+            answer(line)
+            return
+        held.append(line)
+        if prompted:
+            prompted = False
+            answer(held.popleft())
+
+    def answer(line):
+        task = loop.create_task(game.close() if line is None else send(line))
+        sending.add(task)
+        task.add_done_callback(sending.discard)
+
+    async def send(line):
+        try:
+            await game.send(line)
+        except OSError:
+            print("[CLIENT INFO] Socket already closed by server.")
 
-    global exited
-#     """Continuously receive and display messages from the server"""
+    threading.Thread(target=read_keyboard, daemon=True).start()
     try:
-        while True:
-            line = rfile.readline()
-            if not line:
-                #print("[INFO] Server disconnected.")
-                exited = 1
-                stopInput.set()
-                break
-            elif "Enter" in line:
-                # open input as the server has prompted you to enter. 
-                stopInput.set()
-            # Allow input if the server is giving you another turn after incorrect input. 
-            elif "Invalid input" in line:
-                stopInput.set()
-            # if the server is responding to 'quit', or if the server disconnected. 
-            elif "Thanks for playing" in line or "Server disconnected" in line: 
-               print("[CLIENT INFO] You've left the game.")
-            elif "play again" in line or "username" in line: 
-                stopInput.set()
-            elif "Timeout!" in line:
-                print("[CLIENT INFO] You've timed out.")
-                stopInput.set()
-
-            print(line.strip())
-
-            # Open up input as we've received something. 
-    except Exception as e:
-        #print(f"Exiting! Either you've typed quit or pressed the keyboard shortcut to quit.")
-        pass
+        async for event in game:
+            show(event)
+            if isinstance(event, clientlib.PROMPTS):
+                if held:
+                    answer(held.popleft())
+                else:
+                    prompted = True
+    finally:
+        await game.close()
+
+
+def show(event):
+    if type(event) is clientlib.SpectatorUpdate:
+        show_spectator_update(event)
+        return
+    if type(event) is clientlib.StatsUpdate:
+        show_stats_update(event)
+        return
+    if type(event) is clientlib.GameOver and event.result == "loss":
+        if event.reason == "quit":
+            print("[CLIENT INFO] You've left the game.")
+        elif event.reason == "timeout":
+            print("[CLIENT INFO] You've timed out.")
+    print(event.text)
+
+
+def show_board(name, board):
+    # board is BoardSnapshot.public(): shot and hit cells as hex bitmasks, plus sunk ship names
+    shots, hits = int(board["shots"], 16), int(board["hits"], 16)
+    size = board["size"]
+    print(f"{name}'s board" + (f" (sunk: {', '.join(board['sunk'])})" if board["sunk"] else ""))
+    print("  " + " ".join(str(i + 1).rjust(2) for i in range(size)))
+    for r in range(size):
+        cells = []
+        for c in range(size):
+            bit = 1 << (r * size + c)
+            cells.append('X' if hits & bit else 'o' if shots & bit else '.')
+        print(f"{chr(ord('A') + r):2} {' '.join(cells)}")
+
+
+def show_spectator_update(event):
+    # Render the [SNAPSHOT]/[EVENT] lines sent to spectators (see spectate.py).
+    msg = event.data
+    if event.kind == "SNAPSHOT":
+        print(f"[SPECTATING] Match {msg['match']}: {' vs '.join(msg['players'])}")
+        for name, board in zip(msg["players"], msg["boards"]):
+            if board:
+                show_board(name, board)
+        if msg["turn"]:
+            print(f"[SPECTATING] {msg['turn']} to play.")
+    elif msg["type"] == "shot":
+        sunk = f" and sank the {msg['sunk']}" if msg["sunk"] else ""
+        print(f"[SPECTATING] {msg['player']} fired at {msg['cell']}: {msg['result']}{sunk}.")
+    elif msg["type"] == "turn":
+        print(f"[SPECTATING] {msg['player']} to play.")
+    elif msg["type"] == "end":
+        print(f"[SPECTATING] {msg['winner']} beat {msg['loser']} ({msg['reason']}).")
+
+
+def show_stats_update(event):
+    # Render the answers to STATS (see stats.py).
+    msg = event.data
+    if event.kind == "LEADERBOARD":
+        print("[STATS] Leaderboard:")
+        for rank, player in enumerate(msg["top"], 1):
+            print(f"  {rank:2}. {player['player']:16} {player['rating']:5}  {player['wins']}-{player['losses']}")
+        if not msg["top"]:
+            print("  nobody has finished a game yet")
+        return
+    if "rating" not in msg:
+        print(f"[STATS] {msg['player']} hasn't finished a game yet.")
+        return
+    accuracy = f"{msg['accuracy']:.0%}" if msg["accuracy"] is not None else "-"
+    print(f"[STATS] {msg['player']}: #{msg['rank']}, rating {msg['rating']}, {msg['wins']} wins, {msg['losses']} losses "
+          f"({msg['forfeits']} forfeited), {accuracy} of {msg['shots']} shots hit")
+    for game in msg["history"]:
+        print(f"  {game['result']} against {game['opponent']} ({game['reason']}), {game['hits']}/{game['shots']} hits")
+
 
 if __name__ == "__main__":
     main()
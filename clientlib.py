@@ -0,0 +1,382 @@
+"""
+clientlib.py
+
+An asyncio client for the Battleship server, for programs rather than people: bots, tests,
+load generators, and the interactive client.py, which is built on it. It does the username
+handshake, answers the server's heartbeat PINGs, and turns what the server says into events:
+
+    game = await connect("alice", port=5002)
+    async for event in game:
+        if type(event) is PlacePrompt:
+            await game.place("A1", "H", "CARRIER")
+        elif type(event) is YourTurn:
+            await game.fire("B5")                 # or game.fire("B5", "C6") in salvo games
+        elif type(event) is ShotResult:
+            print(event.results, event.sunk)
+        elif type(event) is ReplayPrompt:
+            await game.replay(False)
+    # the loop ends when the server closes the connection
+
+There's also game.fleet(), game.quit(), game.stats() and game.send(line) for anything else,
+and game.expect(YourTurn, GameOver) to skip ahead to the next event of some kinds.
+
+Every event is a namedtuple whose last field, 'text', is the line (or lines, for a Grid) it
+was parsed from. Prompts are the events after which the server is waiting for us:
+
+    UsernamePrompt   only seen if connect() wasn't given a username
+    PlacePrompt      place a ship
+    YourTurn(shots)  fire 'shots' cells
+    Fleet(ships)     our ships still afloat, in answer to FLEET; it's still our turn
+    InvalidInput     a shot was turned away; it's still our turn
+    ReplayPrompt     play again, y/n
+
+and the rest tell us what happened:
+
+    Welcome(username), ResumeToken(token), Queued, Seated, OpponentTurn,
+    ShipPlaced(ship, cell, orientation), PlacementError(message),
+    Grid(rows)                        the board we're firing at, a string of '.', 'X', 'o' per row
+    ShotResult(cells, results, sunk)  our shot(s): 'hit', 'miss' or 'already_shot' per cell
+    OpponentShot(hits, sunk)          theirs, at our board
+    GameOver(result, reason)          'win' or 'loss'; 'sunk', 'quit' or 'timeout'
+    Rejected(retry_after)             the server is full ([SERVERFULL])
+    SpectatorUpdate(kind, data)       a spectator's [SNAPSHOT] or [EVENT], data as a dict
+    StatsUpdate(kind, data)           a [LEADERBOARD] or [PLAYERSTATS] answer to STATS (see stats.py)
+    Info                              anything else
+
+A client is one connection and one reader task, with no threads, so a single event loop can
+run thousands of them.
+"""
+
+import asyncio
+import json
+from collections import namedtuple
+
+HOST = '127.0.0.1'
+PORT = 5002
+
+UsernamePrompt = namedtuple("UsernamePrompt", "text")
+PlacePrompt = namedtuple("PlacePrompt", "text")
+YourTurn = namedtuple("YourTurn", "shots text")
+Fleet = namedtuple("Fleet", "ships text")
+InvalidInput = namedtuple("InvalidInput", "message text")
+ReplayPrompt = namedtuple("ReplayPrompt", "text")
+
+Welcome = namedtuple("Welcome", "username text")
+ResumeToken = namedtuple("ResumeToken", "token text")
+Queued = namedtuple("Queued", "text")
+Seated = namedtuple("Seated", "text")
+OpponentTurn = namedtuple("OpponentTurn", "text")
+ShipPlaced = namedtuple("ShipPlaced", "ship cell orientation text")
+PlacementError = namedtuple("PlacementError", "message text")
+Grid = namedtuple("Grid", "rows text")
+ShotResult = namedtuple("ShotResult", "cells results sunk text")
+OpponentShot = namedtuple("OpponentShot", "hits sunk text")
+GameOver = namedtuple("GameOver", "result reason text")
+Rejected = namedtuple("Rejected", "retry_after text")
+SpectatorUpdate = namedtuple("SpectatorUpdate", "kind data text")
+StatsUpdate = namedtuple("StatsUpdate", "kind data text")
+Info = namedtuple("Info", "text")
+
+# the server is waiting for us after one of these
+PROMPTS = (UsernamePrompt, PlacePrompt, YourTurn, Fleet, InvalidInput, ReplayPrompt)
+
+ORIENTATIONS = {0: "H", 1: "V", "H": "H", "V": "V", "h": "H", "v": "V"}
+
+
+def cell_name(cell):
+    """'B5' for (1, 4); names are passed through."""
+    if isinstance(cell, str):
+        return cell.upper()
+    return f"{chr(ord('A') + cell[0])}{cell[1] + 1}"
+
+
+def split_names(text):
+    # "CRUISER, DESTROYER!" -> ("CRUISER", "DESTROYER")
+    return tuple(name for name in text.rstrip("!.").split(", ") if name)
+
+
+class Parser:
+    """
+    Turns the server's lines into events, one line at a time. It keeps what it needs to
+    know between lines: the cells we last fired at (the server's HIT!/MISS! don't repeat
+    them), whether this game has been decided, and the rest of a GRID block.
+    """
+
+    def __init__(self):
+        self.fired = ()
+        self.decided = False
+        # lines of a GRID block so far, and how many rows it has
+        self.grid = None
+        self.grid_rows = 0
+        # (prefix, handler) in the order they're tried; the first that matches wins
+        self.prefixes = [
+            ("It's your turn! Enter", self.your_turn),
+            ("HIT!", self.hit),
+            ("MISS!", self.miss),
+            ("You've already fired at that location", self.already),
+            ("SALVO: ", self.salvo),
+            ("Your opponent hit!", lambda text: OpponentShot(1, (), text)),
+            ("Your opponent missed!", lambda text: OpponentShot(0, (), text)),
+            ("Your opponent fired a salvo: ", self.opponent_salvo),
+            ("Your opponent quit or forfeited!", lambda text: self.over("win", "quit", text)),
+            ("It's your opponent's turn", OpponentTurn),
+            ("Invalid input", lambda text: InvalidInput(text.partition(": ")[2] or text, text)),
+            ("Enter placement command", PlacePrompt),
+            ("Enter coordinate to fire at", lambda text: YourTurn(1, text)),
+            ("Enter your username", UsernamePrompt),
+            ("[SERVERINFO] Your ships still afloat: ", self.fleet),
+            ("[!] The game is over. Do you want to play again?", self.replay_prompt),
+            ("The game is over. Would you like to play again?", self.game_over),
+            ("Congratulations!", lambda text: self.over("win", "sunk", text)),
+            ("[!] Opponent has forfeited due to inactivity", lambda text: self.over("win", "timeout", text)),
+            ("[!] Timeout! You have forfeited", lambda text: self.over("loss", "timeout", text)),
+            ("Thanks for playing", lambda text: self.over("loss", "quit", text)),
+            ("Hello ", self.welcome),
+            ("[SERVERINFO] Your resume token is ", self.resume_token),
+            ("You've been added to the game!", Seated),
+            ("Waiting on another person", Queued),
+            ("[SERVERINFO] Thanks for joining", Queued),
+            ("[SERVERINFO] You've been added back to the queue", Queued),
+            ("Invalid position", lambda text: PlacementError(text, text)),
+            ("Invalid format", lambda text: PlacementError(text, text)),
+            ("Invalid orientation", lambda text: PlacementError(text, text)),
+            ("Unknown ship name", lambda text: PlacementError(text, text)),
+            ("All ", self.all_placed),
+            ("[SERVERFULL]", self.rejected),
+            ("[SNAPSHOT] ", lambda text: self.json_line(SpectatorUpdate, text)),
+            ("[EVENT] ", lambda text: self.json_line(SpectatorUpdate, text)),
+            ("[LEADERBOARD] ", lambda text: self.json_line(StatsUpdate, text)),
+            ("[PLAYERSTATS] ", lambda text: self.json_line(StatsUpdate, text)),
+        ]
+        self.starts = tuple(prefix for prefix, _ in self.prefixes)
+
+    def feed(self, text):
+        """The event this line completes, or None (e.g. half way through a GRID)."""
+        if self.grid is not None:
+            return self.grid_line(text)
+        if text == "GRID":
+            self.grid = []
+            return None
+        if text.startswith(self.starts):
+            for prefix, handler in self.prefixes:
+                if text.startswith(prefix):
+                    return handler(text)
+        if text.endswith((" horizontally.", " vertically.")) and " placed at " in text:
+            ship, _, rest = text.partition(" placed at ")
+            cell, _, orientation = rest.partition(" ")
+            return ShipPlaced(ship.upper(), cell, "H" if orientation.startswith("h") else "V", text)
+        return Info(text)
+
+    # --- handlers ---
+
+    def grid_line(self, text):
+        if not self.grid:
+            # the column numbers: as many rows as columns follow
+            self.grid_rows = len(text.split())
+            self.grid.append(text)
+            return None
+        self.grid.append(text)
+        if len(self.grid) <= self.grid_rows:
+            return None
+        lines, self.grid = self.grid, None
+        rows = tuple("".join(line[2:].split()) for line in lines[1:])
+        return Grid(rows, "\n".join(["GRID"] + lines))
+
+    def your_turn(self, text):
+        # "It's your turn! Enter 3 coordinates to fire at..." in salvo games
+        words = text.split()
+        shots = int(words[4]) if len(words) > 4 and words[4].isdigit() else 1
+        return YourTurn(shots, text)
+
+    def hit(self, text):
+        sunk = split_names(text.partition("You sank the ")[2])
+        return ShotResult(self.fired[:1], ("hit",), sunk, text)
+
+    def miss(self, text):
+        return ShotResult(self.fired[:1], ("miss",), (), text)
+
+    def already(self, text):
+        return ShotResult(self.fired[:1], ("already_shot",), (), text)
+
+    def salvo(self, text):
+        # "SALVO: B5 HIT, C6 MISS. You sank the CRUISER, DESTROYER!"
+        report, _, sank = text[len("SALVO: "):].partition(". You sank the ")
+        cells, results = [], []
+        for part in report.rstrip(".").split(", "):
+            cell, _, result = part.partition(" ")
+            cells.append(cell)
+            results.append(result.lower().replace(" ", "_"))
+        return ShotResult(tuple(cells), tuple(results), split_names(sank), text)
+
+    def opponent_salvo(self, text):
+        # "Your opponent fired a salvo: 2 hits, your CRUISER sunk!"
+        report = text[len("Your opponent fired a salvo: "):]
+        hits, _, sunk = report.partition(", your ")
+        return OpponentShot(int(hits.split()[0]), split_names(sunk.rpartition(" sunk")[0]), text)
+
+    def fleet(self, text):
+        ships = text[len("[SERVERINFO] Your ships still afloat: "):].partition(". Enter")[0]
+        return Fleet(split_names(ships), text)
+
+    def over(self, result, reason, text):
+        self.decided = True
+        return GameOver(result, reason, text)
+
+    def game_over(self, text):
+        # both players get this when a fleet is sunk; the winner has already been congratulated
+        if self.decided:
+            return Info(text)
+        return self.over("loss", "sunk", text)
+
+    def replay_prompt(self, text):
+        self.decided = False
+        return ReplayPrompt(text)
+
+    def welcome(self, text):
+        # "Hello alice, welcome to the game!"
+        name, sep, _ = text[len("Hello "):].partition(", welcome")
+        if not sep:
+            return Info(text)
+        return Welcome(name, text)
+
+    def resume_token(self, text):
+        return ResumeToken(text[len("[SERVERINFO] Your resume token is "):].partition(".")[0], text)
+
+    def all_placed(self, text):
+        if text.endswith("ships already placed."):
+            return PlacementError(text, text)
+        return Info(text)
+
+    def rejected(self, text):
+        # "[SERVERFULL] Server full, retry in 3 s"
+        words = text.split()
+        try:
+            retry_after = float(words[-2])
+        except (IndexError, ValueError):
+            retry_after = None
+        return Rejected(retry_after, text)
+
+    def json_line(self, kind_of_event, text):
+        # "[KIND] {...}"
+        kind, _, payload = text.partition(" ")
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return Info(text)
+        return kind_of_event(kind.strip("[]"), data, text)
+
+
+class Client:
+    """
+    One connection to the server. Iterate over it for events; the iteration ends when the
+    connection does. Create with connect().
+    """
+
+    def __init__(self, reader, writer, username=None):
+        self.reader = reader
+        self.writer = writer
+        self.username = username
+        self.parser = Parser()
+        self.events = asyncio.Queue()
+        self.closed = False
+        # reads on its own, so heartbeats are answered even while nobody is iterating
+        self.receiver = asyncio.create_task(self.receive())
+
+    async def receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                text = line.decode("utf-8", errors="replace").strip()
+                if text == "PING":
+                    self.writer.write(b"PONG\n")
+                    continue
+                event = self.parser.feed(text)
+                if event is None:
+                    continue
+                if type(event) is UsernamePrompt and self.username:
+                    # the handshake: nobody needs to see this one
+                    self.writer.write(f"{self.username}\n".encode("utf-8"))
+                    continue
+                self.events.put_nowait(event)
+        except (OSError, ValueError):
+            # reset, or a line longer than the stream's limit
+            pass
+        finally:
+            self.closed = True
+            self.events.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.events.get()
+        if event is None:
+            # leave it there for anyone else waiting
+            self.events.put_nowait(None)
+            raise StopAsyncIteration
+        return event
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def expect(self, *kinds):
+        """The next event of one of these types, skipping the rest. ConnectionError if the connection ends first."""
+        async for event in self:
+            if isinstance(event, kinds):
+                return event
+        raise ConnectionError("Server closed the connection")
+
+    # --- commands ---
+
+    async def send(self, line):
+        self.writer.write(f"{line}\n".encode("utf-8"))
+        await self.writer.drain()
+
+    async def place(self, cell, orientation, ship):
+        """Place a ship, e.g. place("A1", "H", "CARRIER") or place((0, 0), 0, "CARRIER")."""
+        await self.send(f"PLACE {cell_name(cell)} {ORIENTATIONS[orientation]} {ship.upper()}")
+
+    async def fire(self, *cells):
+        """Fire at one cell, or a salvo of them: fire("B5"), fire((1, 4), (2, 5))."""
+        self.parser.fired = tuple(cell_name(cell) for cell in cells)
+        await self.send(" ".join(self.parser.fired))
+
+    async def fleet(self):
+        await self.send("FLEET")
+
+    async def quit(self):
+        await self.send("quit")
+
+    async def stats(self, player=None):
+        """Ask for the leaderboard and our own stats, or another player's (at the play-again prompt)."""
+        await self.send(f"STATS {player}" if player else "STATS")
+
+    async def replay(self, again=True):
+        """Answer the play-again prompt."""
+        await self.send("y" if again else "n")
+
+    async def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        await self.receiver
+
+
+async def connect(username=None, host=HOST, port=PORT, unix_socket=None):
+    """
+    Connect to the server, over its Unix socket if given (server.py --unix-socket). With a
+    username the handshake is done for us; without one, answer the UsernamePrompt with send().
+    """
+    if unix_socket:
+        reader, writer = await asyncio.open_unix_connection(unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    return Client(reader, writer, username)
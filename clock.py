@@ -0,0 +1,98 @@
+"""
+clock.py
+
+The time source for the game logic. run_multi_player_round and handle_game_clients call
+clock.now() and clock.sleep() instead of the time module (and the matchmaker schedules its
+reconnect wait with clock.call_later()), so a simulation (see memtransport.py and
+simulate.py) can swap in a VirtualClock and play a 10 second timeout or reconnect wait
+instantly.
+
+ - RealClock: time.time() and time.sleep(), the default; call_later() starts a timer thread.
+ - VirtualClock: time only moves when something waits on it. Callbacks scheduled with
+   call_later() run, in time order, while the clock is being waited on.
+"""
+
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+
+class RealClock:
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, secs):
+        time.sleep(secs)
+
+    def call_later(self, delay, callback, *args):
+        timer = threading.Timer(delay, callback, args)
+        timer.daemon = True
+        timer.start()
+
+
+class VirtualClock:
+    """
+    A clock for single-threaded simulations. Waiting (sleep, or run_until with a deadline)
+    jumps straight to the next scheduled callback instead of actually sleeping.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+        # heap of (time, order, callback), order keeps callbacks at the same time in FIFO order
+        self._events = []
+        self._order = itertools.count()
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback, *args):
+        if args:
+            callback = functools.partial(callback, *args)
+        heapq.heappush(self._events, (self.now + max(0.0, delay), next(self._order), callback))
+
+    def run_until(self, done, deadline=None):
+        """
+        Run scheduled callbacks until done() is true, or there's nothing scheduled before the
+        deadline (the clock then moves to the deadline). Returns done().
+        """
+        while not done():
+            if not self._events or (deadline is not None and self._events[0][0] > deadline):
+                if deadline is not None:
+                    self.now = max(self.now, deadline)
+                return done()
+            at, _, callback = heapq.heappop(self._events)
+            self.now = max(self.now, at)
+            callback()
+        return True
+
+    def sleep(self, secs):
+        self.run_until(lambda: False, self.now + secs)
+
+
+_clock = RealClock()
+
+
+def now():
+    return _clock.time()
+
+
+def sleep(secs):
+    _clock.sleep(secs)
+
+
+def call_later(delay, callback, *args):
+    _clock.call_later(delay, callback, *args)
+
+
+def current():
+    return _clock
+
+
+def use(clock):
+    """Make clock the time source for the game logic. Returns the previous one."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
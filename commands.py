@@ -0,0 +1,150 @@
+"""
+commands.py
+
+Parses everything a player can type into typed commands, without printing or raising:
+
+    B5 / b5                Fire(cells=((1, 4),))        a shot, on your turn
+    B5 C6 / B5,C6          Fire(cells=((1, 4), (2, 5))) a salvo (salvo games)
+    PLACE A1 H CARRIER     Place(row, col, orientation, ship)
+    FLEET                  FLEET       which of your ships are still afloat / left to place
+    quit                   QUIT
+    y / n                  YES / NO    at the play-again prompt
+    STATS [player]         Stats(player) the leaderboard, or one player's stats (logging in, play-again prompt)
+
+Anything else comes back as a CommandError(code, message), with a message for the player.
+The parse functions return errors rather than raising them, since bad input is normal.
+
+Players may send commands ahead of the prompt for them (see connection.LineReader): they're
+read in order once the game gets there. A command that has gone stale by then, e.g. a shot
+still queued when the game ends, is a valid command for a different part of the game;
+kind_of() names it, so it can be turned away with a clear message instead of "Invalid input".
+
+Every coordinate of the board is looked up in a table built once for the board size, in upper
+and lower case. A single shot is a dict lookup returning a Fire that was also built up front,
+so the shot on every turn costs no int() or upper() calls, and no new objects.
+"""
+
+from collections import namedtuple
+
+Fire = namedtuple("Fire", "cells")
+Place = namedtuple("Place", "row col orientation ship")
+Fleet = namedtuple("Fleet", "")
+Quit = namedtuple("Quit", "")
+Answer = namedtuple("Answer", "reply")
+Stats = namedtuple("Stats", "player")
+CommandError = namedtuple("CommandError", "code message")
+
+FLEET = Fleet()
+QUIT = Quit()
+YES = Answer('y')
+NO = Answer('n')
+
+BAD_FORMAT = CommandError("format", "Your coordinate should take the format (letter,number)")
+OFF_GRID = CommandError("off_grid", "your number and letter should be on the grid!")
+DUPLICATE_SHOT = CommandError("duplicate", "each shot in a salvo must be at a different cell")
+BAD_PLACEMENT = CommandError("format", "Invalid format. Use: PLACE A1 H DESTROYER")
+BAD_ORIENTATION = CommandError("orientation", "Invalid orientation. Use H (horizontal) or V (vertical).")
+BAD_ANSWER = CommandError("answer", "Invalid input. Please type 'y' or 'n'.")
+
+ORIENTATIONS = {"H": 0, "h": 0, "V": 1, "v": 1}
+ANSWERS = {"y": YES, "Y": YES, "n": NO, "N": NO}
+# shown in salvo error messages, as many as the player has shots
+SALVO_EXAMPLE = ["B5", "C6", "D7", "E8", "F9"]
+
+
+class CommandParser:
+    """The coordinate and ship tables for one board size and set of ships."""
+
+    def __init__(self, size, ship_names):
+        self.size = size
+        # "B5" and "b5" -> (1, 4)
+        self.cells = {}
+        for row in range(size):
+            for col in range(size):
+                for letter in (chr(ord('A') + row), chr(ord('a') + row)):
+                    self.cells[f"{letter}{col + 1}"] = (row, col)
+        # and the same, wrapped up as a single shot
+        self.shots = {text: Fire((cell,)) for text, cell in self.cells.items()}
+        self.ships = frozenset(ship_names)
+        self.ship_names = ", ".join(ship_names)
+
+    def coordinate(self, text):
+        """(row, col) for e.g. 'B5', or None."""
+        return self.cells.get(text)
+
+    def _bad_cell(self, text):
+        # a letter then a number is the right shape, just not on this board
+        if text[:1].isalpha() and text[1:].isdigit():
+            return OFF_GRID
+        return BAD_FORMAT
+
+    def fire(self, line, shots=1):
+        """Parse a line typed on your turn: a Fire of exactly 'shots' cells, QUIT or FLEET."""
+        text = line.strip()
+        command = self.shots.get(text)
+        if command is not None and shots == 1:
+            return command
+        word = text.lower()
+        if word == "quit":
+            return QUIT
+        if word == "fleet":
+            return FLEET
+        words = text.replace(",", " ").split()
+        if len(words) != shots:
+            if shots == 1:
+                return self._bad_cell(text)
+            return CommandError("count", f"fire exactly {shots} shots, e.g. {' '.join(SALVO_EXAMPLE[:shots])}")
+        cells = []
+        for word in words:
+            cell = self.cells.get(word)
+            if cell is None:
+                return self._bad_cell(word)
+            cells.append(cell)
+        if len(set(cells)) != len(cells):
+            return DUPLICATE_SHOT
+        return Fire(tuple(cells))
+
+    def place(self, line):
+        """Parse a line typed while placing ships: a Place, or FLEET."""
+        words = line.split()
+        if len(words) == 1 and words[0].lower() == "fleet":
+            return FLEET
+        if len(words) != 4 or words[0].upper() != "PLACE":
+            return BAD_PLACEMENT
+        _, coord, orient, name = words
+        cell = self.cells.get(coord)
+        if cell is None:
+            return self._bad_cell(coord)
+        orientation = ORIENTATIONS.get(orient)
+        if orientation is None:
+            return BAD_ORIENTATION
+        ship = name.upper()
+        if ship not in self.ships:
+            return CommandError("ship", f"Unknown ship name. '{ship}'. Available: {self.ship_names}")
+        return Place(cell[0], cell[1], orientation, ship)
+
+    def kind_of(self, line):
+        """
+        What a command that isn't valid at this point would be valid as: 'a shot',
+        'a ship placement' or 'a play-again answer'. None if it's just not a command.
+        """
+        text = line.strip()
+        if text in ANSWERS:
+            return "a play-again answer"
+        words = text.replace(",", " ").split()
+        if words and all(word in self.cells for word in words):
+            return "a shot"
+        if type(self.place(text)) is Place:
+            return "a ship placement"
+        return None
+
+    def stats(self, line):
+        """A Stats for 'STATS' (player None) or 'STATS <player>', else None."""
+        words = line.split()
+        if not words or words[0].upper() != "STATS" or len(words) > 2:
+            return None
+        return Stats(words[1] if len(words) == 2 else None)
+
+    def answer(self, line):
+        """Parse the answer to the play-again prompt: YES or NO."""
+        return ANSWERS.get(line.strip(), BAD_ANSWER)
@@ -0,0 +1,318 @@
+"""
+connection.py
+
+Line-based I/O over a connected socket, used in place of socket.makefile() objects.
+
+ - LineReader: readline()/poll() over the socket, with heartbeat frames (PING/PONG)
+   filtered out so the game code only ever sees real commands.
+ - LineWriter: write()/flush() with a lock, so the heartbeat thread and a game
+   thread can both write to the same player without interleaving messages. A peer that
+   stops reading can't hold the writer up for long: see "Slow consumers" below.
+
+Both keep the same method names as the makefile objects they replace, so the rest of
+the server can keep using player["readFile"] / player["writeFile"] as before.
+
+Slow consumers: a peer whose receive window has filled (it's stopped reading, or its network
+has) would block flush() for as long as it likes, and with it the game thread writing to
+them. Instead, a LineWriter
+ - keeps at most max_buffer bytes queued for the peer: that much in the kernel's send
+   buffer (SO_SNDBUF), and that much written but not flushed yet,
+ - gives a flush deadline seconds to get everything into that buffer.
+Missing either means the peer is given up on: the socket is shut down, so both the writer
+and the reader see the connection as gone and the game treats it like any other disconnect
+(the opponent is told, and the seat is held for a reconnect). Every time this happens it's
+counted in slow_consumers, by reason.
+"""
+
+import select
+import socket
+import threading
+import time
+from collections import Counter, deque
+
+PING = "PING"
+PONG = "PONG"
+HEARTBEAT_FRAMES = (PING, PONG)
+
+RECV_SIZE = 4096
+# longest line we'll buffer from a peer before giving up on them
+MAX_LINE_LENGTH = 1024
+# lines a peer may send ahead of the game reading them (e.g. all their PLACE commands at once)
+MAX_PENDING_LINES = 32
+# seconds a flush may wait for a peer to take what it's sent
+WRITE_DEADLINE_SECS = 5.0
+# bytes that may be waiting to reach a peer
+MAX_OUTBOUND_BYTES = 64 * 1024
+
+# peers given up on for not reading, since startup: 'deadline' or 'buffer' -> count
+slow_consumers = Counter()
+
+
+class LineTooLongError(ConnectionError):
+    "Raised when a peer sends more than max_line bytes without a newline."
+    pass
+
+
+class SlowConsumerError(ConnectionError):
+    "Raised when a peer isn't reading what we send: a flush missed its deadline, or too much is waiting."
+    pass
+
+
+class LineReader:
+    """
+    Reads newline-terminated lines from a socket.
+
+    Heartbeat frames are consumed here: they update last_seen and are passed to
+    on_frame(frame) (if given), but are never returned from readline().
+    capture(line, received), if given, is called with every other line, and with None at EOF,
+    along with the time.time() its bytes were received from the socket (see capture.py).
+
+    Lines a peer sends before the game asks for them wait here, in order, up to max_pending
+    of them. Any more are dropped, and the first one dropped in each burst (until a line fits
+    again) is passed to on_overflow(line) (if given), so the peer can be told once rather than
+    once per line; the connection itself stays up.
+    """
+
+    def __init__(self, conn, on_frame=None, max_line=MAX_LINE_LENGTH, initial=b"", capture=None, max_pending=MAX_PENDING_LINES, on_overflow=None):
+        self.conn = conn
+        self.on_frame = on_frame
+        self.capture = capture
+        self.max_line = max_line
+        self.max_pending = max_pending
+        self.on_overflow = on_overflow
+        # lines dropped because too many were already waiting
+        self.dropped = 0
+        # dropping lines since on_overflow was last called
+        self._overflowing = False
+        # time of the last bytes received from the peer, of any kind
+        self.last_seen = time.time()
+        self._buffer = b""
+        self._lines = deque()
+        self._eof = False
+        # held by whoever is currently reading the socket
+        self._lock = threading.Lock()
+        # bytes another process read from this connection before handing it to us
+        if initial:
+            self._feed(initial)
+
+    def _feed(self, data):
+        received = time.time()
+        if not data:
+            self._eof = True
+            if self._buffer:
+                self._lines.append(self._buffer.decode("utf-8", errors="replace"))
+                if self.capture:
+                    self.capture(self._lines[-1], received)
+                self._buffer = b""
+            if self.capture:
+                self.capture(None, received)
+            return
+        self.last_seen = received
+        *complete, self._buffer = (self._buffer + data).split(b"\n")
+        if len(self._buffer) > self.max_line or any(len(raw) > self.max_line for raw in complete):
+            self._eof = True
+            self._buffer = b""
+            raise LineTooLongError(f"Line longer than {self.max_line} bytes.")
+        for raw in complete:
+            line = raw.decode("utf-8", errors="replace")
+            frame = line.strip()
+            if frame in HEARTBEAT_FRAMES:
+                if self.on_frame:
+                    self.on_frame(frame)
+                continue
+            if self.capture:
+                self.capture(line, received)
+            if len(self._lines) >= self.max_pending:
+                self.dropped += 1
+                if self.on_overflow and not self._overflowing:
+                    self.on_overflow(line)
+                self._overflowing = True
+                continue
+            self._overflowing = False
+            self._lines.append(line + "\n")
+
+    def readline(self):
+        """
+        Block until a full line is available and return it (including the newline).
+        Returns '' once the peer has closed the connection. Honours the socket's timeout,
+        raising socket.timeout just like a makefile() reader would.
+        """
+        with self._lock:
+            while not self._lines and not self._eof:
+                self._feed(self.conn.recv(RECV_SIZE))
+            if self._lines:
+                return self._lines.popleft()
+            return ""
+
+    def poll(self, timeout=0.0):
+        """
+        Wait up to 'timeout' seconds for a full line (or EOF) to be ready to read.
+        Unlike select() on the raw socket, this ignores heartbeat frames and also
+        sees lines that have already been buffered.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while not self._lines and not self._eof:
+                remaining = max(0.0, deadline - time.time())
+                ready, _, _ = select.select([self.conn], [], [], remaining)
+                if not ready:
+                    return False
+                self._feed(self.conn.recv(RECV_SIZE))
+            return True
+
+    def drain(self):
+        """
+        Read whatever has already arrived without blocking, so heartbeat replies from
+        players nobody is reading from (e.g. people waiting in the queue) are still seen.
+        If another thread is in the middle of a read, it will see the frames itself.
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            while not self._eof:
+                try:
+                    self._feed(self.conn.recv(RECV_SIZE, socket.MSG_DONTWAIT))
+                except BlockingIOError:
+                    break
+        except (OSError, ValueError):
+            self._eof = True
+        finally:
+            self._lock.release()
+
+    def take_buffered(self):
+        """
+        Remove and return everything received but not yet read, as raw bytes.
+        Used when the connection is handed to another process, so no input is lost.
+        """
+        with self._lock:
+            data = "".join(self._lines).encode("utf-8") + self._buffer
+            self._lines.clear()
+            self._buffer = b""
+            return data
+
+    @property
+    def eof(self):
+        return self._eof
+
+
+class LineWriter:
+    """
+    Buffers write() calls and sends them on flush(). All access goes through one lock,
+    so whole messages from different threads never get mixed together.
+
+    A flush that can't get everything to the peer within 'deadline' seconds (None to wait
+    forever), or more than max_buffer bytes written without a flush, gives up on the peer
+    (see "Slow consumers" above): from then on every write raises SlowConsumerError.
+    """
+
+    def __init__(self, conn, deadline=WRITE_DEADLINE_SECS, max_buffer=MAX_OUTBOUND_BYTES):
+        self.conn = conn
+        self.deadline = deadline
+        self.max_buffer = max_buffer
+        self._pending = []
+        self._size = 0
+        self._lock = threading.Lock()
+        # why we gave up on the peer, once we have
+        self.slow = None
+        try:
+            # so what the kernel holds for a peer that isn't reading is bounded too
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, max_buffer)
+        except (OSError, AttributeError):
+            pass
+
+    def write(self, text):
+        with self._lock:
+            if self.slow:
+                raise SlowConsumerError(f"Gave up on peer ({self.slow})")
+            self._pending.append(text)
+            self._size += len(text)
+            if self._size > self.max_buffer:
+                self._give_up("buffer")
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            data = "".join(self._pending).encode("utf-8")
+            self._pending.clear()
+            self._size = 0
+            self._send(data)
+
+    def write_encoded(self, data):
+        """
+        Send bytes that are already encoded (e.g. one event shared by many spectators),
+        after anything still pending, so it isn't re-encoded for every peer.
+        """
+        with self._lock:
+            if self._pending:
+                pending = "".join(self._pending).encode("utf-8")
+                self._pending.clear()
+                self._size = 0
+                data = pending + data
+            self._send(data)
+
+    def _send(self, data):
+        # sendall(), but only waiting up to the deadline for the peer to make room
+        if self.slow:
+            raise SlowConsumerError(f"Gave up on peer ({self.slow})")
+        if self.deadline is None:
+            self.conn.sendall(data)
+            return
+        view = memoryview(data)
+        # only starts once the peer has made us wait
+        deadline = None
+        while view:
+            # With a socket timeout set, send() waits (up to that timeout, not our deadline) for
+            # room before trying, even with MSG_DONTWAIT. So on such a socket only send once
+            # select() says there is room.
+            if self.conn.gettimeout() is None or select.select([], [self.conn], [], 0)[1]:
+                try:
+                    view = view[self.conn.send(view, socket.MSG_DONTWAIT):]
+                    continue
+                except BlockingIOError:
+                    pass
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.deadline
+            if now >= deadline or not select.select([], [self.conn], [], deadline - now)[1]:
+                self._give_up("deadline")
+
+    def _give_up(self, reason):
+        # called with the lock held
+        self.slow = reason
+        self._pending.clear()
+        self._size = 0
+        slow_consumers[reason] += 1
+        print(f"[SERVERINFO] Peer {self.conn} isn't reading ({reason}), disconnecting them "
+              f"({sum(slow_consumers.values())} slow consumers so far).")
+        try:
+            # wakes up whoever is reading from them, with EOF
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        raise SlowConsumerError(f"Gave up on peer ({reason})")
+
+    def send_frame(self, frame):
+        """
+        Try to send a single control frame without ever blocking the caller.
+        Returns False if it couldn't be sent right now (another thread is writing, or the
+        peer's receive window is full). Raises OSError if the connection is gone.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self._pending:
+                return False
+            data = (frame + "\n").encode("utf-8")
+            try:
+                sent = self.conn.send(data, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return False
+            if sent < len(data):
+                # finish the frame on the next flush so the stream stays line-aligned
+                self._pending.append(data[sent:].decode("utf-8"))
+                self._size += len(data) - sent
+            return True
+        finally:
+            self._lock.release()
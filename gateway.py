@@ -0,0 +1,196 @@
+"""
+gateway.py
+
+Front door for running several server.py nodes as one cluster.
+
+Clients connect to the gateway exactly as they would to server.py. The gateway does the
+username handshake, picks a game node, does the handshake again with that node on the
+player's behalf, and from then on just relays bytes both ways (heartbeats included).
+
+Nodes are started with --gateway HOST:PORT pointing at the gateway's control port, and send
+a load report once a second:
+    {"type": "load", "address": [host, port], "unix": path or null, "players": n, "free": f}
+"free" is how many seats the node's game has open. New players go to a node with one free
+seat first (so they complete a match), then to the least loaded node with a whole free
+game. A player who reconnects shortly after dropping goes back to the node they were on.
+
+Admission control (admission.py) happens here, where each player's own address is still
+known: the same limits as server.py, and the same [SERVERFULL] line. A node turning a player
+away is passed on to the player the same way. Nodes don't apply per-IP limits to the
+gateway's address, since every player it proxies comes from there, but they can't tell it
+apart from anyone else on their host if that's 127.0.0.1: a node on the gateway's host is
+reached through the Unix socket it reports (server.py --unix-socket) instead of TCP.
+
+Everything can run on one machine, e.g.
+    python gateway.py --port 5002 --control-port 5100
+    python server.py --port 5003 --gateway 127.0.0.1:5100 --unix-socket /tmp/battleship-5003.sock
+    python server.py --port 5004 --gateway 127.0.0.1:5100 --unix-socket /tmp/battleship-5004.sock
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from admission import AdmissionController, MAX_PLAYERS, MAX_HANDSHAKES, MAX_CONNECTIONS_PER_IP, CONNECT_RATE, CONNECT_BURST
+
+HOST = '127.0.0.1'
+PORT = 5002
+CONTROL_PORT = 5100
+# how long a player's node is remembered after they disconnect, so they can rejoin their game
+RECONNECT_SECS = 30
+HANDSHAKE_TIMEOUT_SECS = 10
+MAX_LINE_LENGTH = 1024
+
+
+class Gateway:
+
+    def __init__(self, admission=None):
+        self.admission = admission or AdmissionController()
+        # (host, port) -> {"players": n, "free": f, "unix": path or None}
+        self.nodes = {}
+        # username -> ((host, port), time they left, or None while still connected)
+        self.placements = {}
+
+    def pick_node(self, username):
+        placed = self.placements.get(username)
+        if placed:
+            address, left_at = placed
+            if address in self.nodes and (left_at is None or time.time() - left_at < RECONNECT_SECS):
+                return address
+        if not self.nodes:
+            return None
+        # prefer completing a half-full game, then the emptiest node
+        return min(self.nodes, key=lambda a: (self.nodes[a]["free"] != 1, self.nodes[a]["free"] == 0, self.nodes[a]["players"]))
+
+    async def handle_control(self, reader, writer):
+        address = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                report = json.loads(line)
+                if report.get("type") == "load":
+                    address = tuple(report["address"])
+                    if address not in self.nodes:
+                        print(f"[GATEWAY] Node {address[0]}:{address[1]} joined.")
+                    self.nodes[address] = {"players": report["players"], "free": report["free"], "unix": report.get("unix")}
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if address in self.nodes:
+                print(f"[GATEWAY] Node {address[0]}:{address[1]} left.")
+                del self.nodes[address]
+            writer.close()
+
+    async def handle_player(self, reader, writer):
+        username = None
+        retry_after = self.admission.admit(writer.get_extra_info("socket"), writer.get_extra_info("peername")[0])
+        if retry_after:
+            print(f"[GATEWAY] Rejected {writer.get_extra_info('peername')}, asked to retry in {retry_after}s ({self.admission.rejected} rejected so far).")
+            writer.write(f"[SERVERFULL] Server full, retry in {retry_after} s\n".encode("utf-8"))
+            writer.close()
+            return
+        try:
+            try:
+                username, node_reader, node_writer = await self.handshake(reader, writer)
+            finally:
+                self.admission.handshake_done()
+            if username is None:
+                return
+            await asyncio.gather(relay(reader, node_writer), relay(node_reader, writer))
+        except (ConnectionError, asyncio.TimeoutError, OSError) as e:
+            print(f"[GATEWAY] Connection for {username} ended: {e}")
+        finally:
+            if username in self.placements:
+                self.placements[username] = (self.placements[username][0], time.time())
+            writer.close()
+
+    async def handshake(self, reader, writer):
+        # The player's username, and the connection to the node they've been given (None if they weren't).
+        writer.write(b"Enter your username: \n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), HANDSHAKE_TIMEOUT_SECS)
+        username = line.decode("utf-8", errors="replace").strip()[:MAX_LINE_LENGTH]
+        if not username:
+            return None, None, None
+
+        address = self.pick_node(username)
+        if address is None:
+            writer.write(b"[SERVERFULL] Server full, retry in 5 s\n")
+            await writer.drain()
+            return None, None, None
+        node = self.nodes[address]
+        if node["unix"]:
+            node_reader, node_writer = await asyncio.open_unix_connection(node["unix"])
+        else:
+            node_reader, node_writer = await asyncio.open_connection(*address)
+        # do the node's username handshake for the player, they've already answered ours
+        prompt = await asyncio.wait_for(node_reader.readline(), HANDSHAKE_TIMEOUT_SECS)
+        if not prompt.startswith(b"Enter your username"):
+            # e.g. [SERVERFULL]: the node turned them away, so tell them why
+            writer.write(prompt)
+            await writer.drain()
+            node_writer.close()
+            return None, None, None
+        # count them now, rather than waiting for the node's next report
+        node["players"] += 1
+        node["free"] = max(0, node["free"] - 1)
+        self.placements[username] = (address, None)
+        node_writer.write(username.encode("utf-8") + b"\n")
+        await node_writer.drain()
+        print(f"[GATEWAY] {username} -> {address[0]}:{address[1]}")
+        return username, node_reader, node_writer
+
+    def forget_old_placements(self):
+        now = time.time()
+        for username, (_, left_at) in list(self.placements.items()):
+            if left_at is not None and now - left_at > RECONNECT_SECS:
+                del self.placements[username]
+
+
+async def relay(reader, writer):
+    # copy bytes one way until either side closes
+    try:
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def run_gateway(host, port, control_port, admission=None):
+    gateway = Gateway(admission)
+    players = await asyncio.start_server(gateway.handle_player, host, port)
+    control = await asyncio.start_server(gateway.handle_control, host, control_port)
+    print(f"[GATEWAY] Players on {host}:{port}, nodes report to {host}:{control_port}")
+    async with players, control:
+        while True:
+            await asyncio.sleep(RECONNECT_SECS)
+            gateway.forget_old_placements()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Battleship cluster gateway")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT, help="port clients connect to")
+    parser.add_argument("--control-port", type=int, default=CONTROL_PORT, help="port game nodes send load reports to")
+    parser.add_argument("--max-players", type=int, default=MAX_PLAYERS, help="live connections before new ones are turned away")
+    parser.add_argument("--max-handshakes", type=int, default=MAX_HANDSHAKES, help="handshakes allowed in flight at once")
+    parser.add_argument("--max-per-ip", type=int, default=MAX_CONNECTIONS_PER_IP, help="live connections allowed from one IP")
+    parser.add_argument("--connect-rate", type=float, default=CONNECT_RATE, help="new connections per second allowed from one IP")
+    parser.add_argument("--connect-burst", type=int, default=CONNECT_BURST, help="connections one IP may open in a burst")
+    args = parser.parse_args(argv)
+    admission = AdmissionController(args.max_players, args.max_handshakes, args.max_per_ip, args.connect_rate, args.connect_burst)
+    try:
+        asyncio.run(run_gateway(args.host, args.port, args.control_port, admission))
+    except KeyboardInterrupt:
+        print("[GATEWAY] Shutting down.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+heartbeat.py
+
+Application-level heartbeats for connected players.
+
+A single HeartbeatMonitor thread looks after every registered player (no thread per
+connection). Every interval it:
+ - drains any bytes that have arrived from players nobody is currently reading from,
+ - sends PING to players we haven't heard from within the last interval,
+ - reports players that have been silent for interval * misses seconds as dead.
+
+Clients answer PING with PONG (see client.py), and any inbound line counts as a sign of
+life, so active players are never pinged.
+"""
+
+import threading
+import time
+
+from connection import PING
+
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_MISSES = 3
+
+
+class HeartbeatMonitor:
+
+    def __init__(self, on_dead, interval=HEARTBEAT_INTERVAL, misses=HEARTBEAT_MISSES):
+        # on_dead(player) is called from the monitor thread for each peer that stops responding
+        self.on_dead = on_dead
+        self.interval = interval
+        self.misses = misses
+        self._players = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, player):
+        with self._lock:
+            if not any(p is player for p in self._players):
+                self._players.append(player)
+
+    def unregister(self, player):
+        with self._lock:
+            self._players = [p for p in self._players if p is not player]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self, now=None):
+        """Run one heartbeat pass over all registered players. Returns the players found dead."""
+        with self._lock:
+            players = list(self._players)
+
+        dead = []
+        for player in players:
+            reader = player["readFile"]
+            reader.drain()
+            now_ts = time.time() if now is None else now
+            silent_for = now_ts - reader.last_seen
+
+            if reader.eof or silent_for > self.interval * self.misses:
+                dead.append(player)
+                continue
+            if silent_for >= self.interval:
+                try:
+                    player["writeFile"].send_frame(PING)
+                except OSError:
+                    dead.append(player)
+
+        for player in dead:
+            self.unregister(player)
+            try:
+                self.on_dead(player)
+            except Exception as e:
+                print(f"[SERVERERROR] Error while evicting dead player: {e}")
+        return dead
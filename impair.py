@@ -0,0 +1,305 @@
+"""
+impair.py
+
+A TCP proxy that makes the network worse, for seeing how the game copes with something other
+than 127.0.0.1: players connect to the proxy, which connects each of them on to the server and
+passes bytes both ways with
+
+    --delay MS       added one-way latency, each direction
+    --jitter MS      +/- random variation on the delay (bytes still arrive in order, as on TCP)
+    --rate BYTES     bandwidth cap per direction per connection, in bytes per second
+    --stall-every S  on average every S seconds a connection freezes completely...
+    --stall-for S    ...for this long (both directions), like a wifi dropout
+    --reset-every S  on average every S seconds a connection is reset (RST to both ends)
+    --loss PCT       packet loss: each segment (up to CHUNK_SIZE bytes) is lost with this
+                     probability. It's a byte stream, so nothing is missing at the other end;
+                     as with TCP, a lost segment arrives one retransmission timeout later...
+    --rto MS         ...starting at this, and doubling each time the same segment is lost again,
+                     and everything sent after it waits behind it (head-of-line blocking)
+
+Everything is random per connection, from --seed.
+
+Every connection reaches the server from the proxy, i.e. from 127.0.0.1, so more than a few
+players through it run into the server's per-IP admission limits (admission.py: 8 connections
+and a burst of 5 per IP). Start the server with limits that let a crowd in from one address,
+e.g. soak.LOOPBACK_ADMISSION:
+
+    python server.py --port 5002 --max-per-ip 1000 --connect-rate 1000 --connect-burst 1000
+    python impair.py --listen 5003 --server 5002 --delay 80 --jitter 40
+    python client.py --port 5003
+
+or with --load N, which also starts N always-prompt players (soak.py's clients) through the
+proxy for --duration seconds and reports:
+    turn latency   seconds from a player firing to hearing HIT/MISS, p50/p90/p99/max
+    false forfeits players forfeited for inactivity although they answered every prompt
+                   within a fraction of a second, i.e. the network ate their turn
+    dropped        connections reset in the middle of a session
+    stalled        sessions that heard nothing from the server for soak.STALL_SECS
+
+    python impair.py --server 5002 --load 8 --duration 120 --delay 150 --jitter 100 --stall-every 60 --stall-for 8
+    python impair.py --server 5002 --load 8 --duration 120 --delay 50 --loss 2
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import threading
+import time
+
+LISTEN_PORT = 5003
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 5002
+RECV_SIZE = 4096
+# bytes sent at once under a rate cap or with loss, about one TCP segment
+CHUNK_SIZE = 1400
+# Linux's minimum retransmission timeout, in seconds
+RTO = 0.2
+
+
+class Impairment:
+    """What to do to each connection. Times are in seconds, rate in bytes per second (0 = no cap)."""
+
+    def __init__(self, delay=0.0, jitter=0.0, rate=0, stall_every=0.0, stall_for=0.0, reset_every=0.0, loss=0.0, rto=RTO):
+        self.delay = delay
+        self.jitter = jitter
+        self.rate = rate
+        self.stall_every = stall_every
+        self.stall_for = stall_for
+        self.reset_every = reset_every
+        # chance of each segment being lost, 0 to 1
+        self.loss = loss
+        self.rto = rto
+
+    def describe(self):
+        parts = [f"delay {self.delay * 1000:.0f}ms +/- {self.jitter * 1000:.0f}ms"]
+        if self.rate:
+            parts.append(f"{self.rate} B/s")
+        if self.stall_every:
+            parts.append(f"{self.stall_for}s stall every ~{self.stall_every}s")
+        if self.reset_every:
+            parts.append(f"reset every ~{self.reset_every}s")
+        if self.loss:
+            parts.append(f"{self.loss * 100:g}% loss (rto {self.rto * 1000:.0f}ms)")
+        return ", ".join(parts)
+
+
+class ImpairedLink:
+    """One proxied connection: a client socket, its server socket and the pumps between them."""
+
+    def __init__(self, impairment, rng):
+        self.impairment = impairment
+        self.rng = rng
+        # nothing moves either way until then
+        self.stalled_until = 0.0
+        self.writers = []
+
+    def arrival(self, previous):
+        """When bytes read now should be delivered: never before bytes read earlier."""
+        spread = self.rng.uniform(-self.impairment.jitter, self.impairment.jitter)
+        return max(previous, time.monotonic() + max(0.0, self.impairment.delay + spread))
+
+    def retransmits(self):
+        """Extra seconds one segment takes to get through: an RTO, doubling, for every time it's lost."""
+        extra = 0.0
+        rto = self.impairment.rto
+        while self.impairment.loss and self.rng.random() < self.impairment.loss:
+            extra += rto
+            rto *= 2
+        return extra
+
+    async def pump(self, reader, writer):
+        """Copy one direction, reader -> writer, with the delay, jitter and rate cap applied."""
+        queue = asyncio.Queue()
+
+        async def deliver():
+            # when the rate cap next allows sending
+            free_at = 0.0
+            while True:
+                due, data = await queue.get()
+                if data is None:
+                    # pass the half-close on, the other direction may still have data
+                    if writer.can_write_eof():
+                        writer.write_eof()
+                    else:
+                        writer.close()
+                    return
+                segments = self.impairment.rate or self.impairment.loss
+                for i in range(0, len(data), CHUNK_SIZE if segments else len(data)):
+                    piece = data[i:i + CHUNK_SIZE] if segments else data
+                    # a lost segment holds up everything behind it until it's resent
+                    due += self.retransmits()
+                    now = time.monotonic()
+                    wait = max(due, free_at, self.stalled_until) - now
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    # a stall may have started while we slept
+                    while self.stalled_until > time.monotonic():
+                        await asyncio.sleep(self.stalled_until - time.monotonic())
+                    writer.write(piece)
+                    await writer.drain()
+                    if self.impairment.rate:
+                        free_at = max(free_at, time.monotonic()) + len(piece) / self.impairment.rate
+
+        delivering = asyncio.ensure_future(deliver())
+        # if the far end goes away, don't wait for this end to send something first
+        delivering.add_done_callback(lambda task: task.cancelled() or task.exception() is None or self.abort())
+        previous = 0.0
+        try:
+            while True:
+                data = await reader.read(RECV_SIZE)
+                previous = self.arrival(previous)
+                queue.put_nowait((previous, data or None))
+                if not data:
+                    break
+            await delivering
+        except (ConnectionError, OSError):
+            self.abort()
+        finally:
+            delivering.cancel()
+
+    async def chaos(self):
+        """Start stalls and resets at random, until the connection is gone. Returns True after a reset."""
+        impairment = self.impairment
+        events = []
+        if impairment.stall_every:
+            events.append(("stall", impairment.stall_every))
+        if impairment.reset_every:
+            events.append(("reset", impairment.reset_every))
+        if not events:
+            return False
+        # the next time each kind of event happens, as a Poisson process
+        upcoming = {kind: time.monotonic() + self.rng.expovariate(1 / every) for kind, every in events}
+        while True:
+            kind = min(upcoming, key=upcoming.get)
+            await asyncio.sleep(max(0.0, upcoming[kind] - time.monotonic()))
+            if kind == "reset":
+                self.abort()
+                return True
+            self.stalled_until = time.monotonic() + impairment.stall_for
+            upcoming[kind] = self.stalled_until + self.rng.expovariate(1 / impairment.stall_every)
+
+    def abort(self):
+        """Reset both ends: SO_LINGER with a zero timeout makes close() send RST, not FIN."""
+        for writer in self.writers:
+            sock = writer.get_extra_info("socket")
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            except (OSError, AttributeError):
+                pass
+            writer.transport.abort()
+
+
+class ImpairmentProxy:
+
+    def __init__(self, impairment, server_host=SERVER_HOST, server_port=SERVER_PORT, seed=0):
+        self.impairment = impairment
+        self.server_host = server_host
+        self.server_port = server_port
+        self.rng = random.Random(seed)
+        self.connections = 0
+        self.resets = 0
+        self.loop = None
+
+    def start(self, host, port):
+        """Start proxying on a background thread. Returns once the port is open."""
+        ready = threading.Event()
+        failed = []
+
+        def run():
+            try:
+                asyncio.run(self.serve(host, port, ready))
+            except OSError as e:
+                failed.append(e)
+                ready.set()
+
+        threading.Thread(target=run, name="impair", daemon=True).start()
+        ready.wait()
+        if failed:
+            raise failed[0]
+
+    async def serve(self, host, port, ready=None):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"[IMPAIR] {host}:{port} -> {self.server_host}:{self.server_port}, {self.impairment.describe()}")
+        if ready:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, client_reader, client_writer):
+        self.connections += 1
+        link = ImpairedLink(self.impairment, random.Random(self.rng.random()))
+        try:
+            server_reader, server_writer = await asyncio.open_connection(self.server_host, self.server_port)
+        except OSError:
+            link.writers = [client_writer]
+            link.abort()
+            return
+        link.writers = [client_writer, server_writer]
+        chaos = asyncio.ensure_future(link.chaos())
+        try:
+            await asyncio.gather(link.pump(client_reader, server_writer), link.pump(server_reader, client_writer))
+        finally:
+            if chaos.done() and not chaos.cancelled() and chaos.result():
+                self.resets += 1
+            chaos.cancel()
+            for writer in link.writers:
+                writer.close()
+
+
+def measure(proxy_port, clients, duration, seed):
+    """Run always-prompt players through the proxy and return their turn latencies and forfeits."""
+    from soak import Churn
+    churn = Churn(proxy_port, clients, seed, behaviours=["play"])
+    churn.start()
+    time.sleep(duration)
+    churn.stopping.set()
+    return churn
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TCP proxy that adds latency, jitter, bandwidth caps, stalls and resets")
+    parser.add_argument("--listen", type=int, default=LISTEN_PORT, help="port players connect to")
+    parser.add_argument("--server-host", default=SERVER_HOST)
+    parser.add_argument("--server", type=int, default=SERVER_PORT, help="port of the real server")
+    parser.add_argument("--delay", type=float, default=0, help="one-way delay in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0, help="delay variation in milliseconds")
+    parser.add_argument("--rate", type=int, default=0, help="bytes per second per direction (0 for no cap)")
+    parser.add_argument("--stall-every", type=float, default=0, help="mean seconds between stalls (0 for none)")
+    parser.add_argument("--stall-for", type=float, default=5, help="seconds each stall lasts")
+    parser.add_argument("--reset-every", type=float, default=0, help="mean seconds between resets (0 for none)")
+    parser.add_argument("--loss", type=float, default=0, help="percent of segments lost (and retransmitted)")
+    parser.add_argument("--rto", type=float, default=RTO * 1000, help="retransmission timeout in milliseconds, doubling on repeated loss")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--load", type=int, default=0, help="also run this many players through the proxy and report")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run --load for")
+    args = parser.parse_args(argv)
+
+    impairment = Impairment(args.delay / 1000, args.jitter / 1000, args.rate, args.stall_every, args.stall_for, args.reset_every,
+                            args.loss / 100, args.rto / 1000)
+    proxy = ImpairmentProxy(impairment, args.server_host, args.server, args.seed)
+    if not args.load:
+        try:
+            asyncio.run(proxy.serve('127.0.0.1', args.listen))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    from soak import LOOPBACK_ADMISSION, percentile
+    proxy.start('127.0.0.1', args.listen)
+    print(f"[IMPAIR] All {args.load} players connect from 127.0.0.1: the server needs {' '.join(LOOPBACK_ADMISSION)} (or similar) to let them in.")
+    churn = measure(args.listen, args.load, args.duration, args.seed)
+    latencies = churn.turn_latencies
+    summary = ", ".join(f"{name} {'-' if value is None else f'{value * 1000:.0f}ms'}"
+                        for name, value in (("p50", percentile(latencies, 50)), ("p90", percentile(latencies, 90)),
+                                            ("p99", percentile(latencies, 99)), ("max", percentile(latencies, 100))))
+    print(f"[IMPAIR] {churn.connections} sessions, {len(latencies)} turns, {proxy.resets} resets injected")
+    print(f"[IMPAIR] turn latency: {summary}")
+    print(f"[IMPAIR] false forfeits: {churn.forfeits}, dropped: {churn.dropped}, stalled: {churn.stalls}, other errors: {churn.errors}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
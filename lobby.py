@@ -0,0 +1,234 @@
+"""
+lobby.py
+
+Shared lobby for running server.py as several worker processes (see supervisor.py).
+
+Each worker hosts its own game and talks to the lobby over a Unix SOCK_SEQPACKET socket.
+Players are moved between processes by passing their socket's file descriptor:
+
+ - worker -> lobby  {"type": "status", "free": n, "waiting_since": t}
+       how many seats the worker's game has free, and since when its lone player has waited
+ - worker -> lobby  {"type": "handoff", "username": ..., "pending": ...} + fd
+       the worker can't seat this player, so it gives them to the lobby
+ - lobby -> worker  {"type": "seat", "username": ..., "pending": ...} + fd
+       a player for a worker that reported a free seat
+ - lobby -> worker  {"type": "release"}
+       give your lone waiting player back, so they can be paired with one on another worker
+
+"pending" carries any bytes the player had already sent that the old process hadn't read yet.
+
+A worker's status is only as fresh as its last report, so a worker that hands a player over
+counts as having no free seats until it reports again: otherwise a player it has just
+released could be seated straight back on it. Players waiting here are dropped if they hang
+up before a seat turns up.
+
+The lobby socket is only accessible to the user running the server (see bind_private), and
+the lobby also checks that every worker connecting to it runs as that user, since players'
+connections are passed to whoever is on the other end.
+"""
+
+import json
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+MAX_MESSAGE = 65536
+# how long two workers can each have a single waiting player before the lobby pairs them up
+PAIR_AFTER_SECS = 2
+
+
+def encode(msg):
+    return json.dumps(msg).encode("utf-8")
+
+
+def decode(data):
+    return json.loads(data.decode("utf-8"))
+
+
+def bind_private(path, kind=socket.SOCK_SEQPACKET):
+    """A Unix socket listening at 'path' that only the user running the server can connect to."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    listener = socket.socket(socket.AF_UNIX, kind)
+    # create the socket file without group/other access from the start
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    # in case the umask above isn't honoured for sockets on this platform
+    os.chmod(path, 0o600)
+    listener.listen()
+    return listener
+
+
+def same_user(conn):
+    # whoever is on the other end of a Unix socket runs as us
+    _, uid, _ = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+    return uid == os.getuid()
+
+
+def hung_up(sock):
+    # a player's connection that has been closed from their end (without reading what they've sent)
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+def run_lobby(path):
+    """Run the lobby process: accept worker links and move players to workers with free seats."""
+    listener = bind_private(path)
+    print(f"[LOBBY] Listening for workers on {path}")
+
+    # worker socket -> {"free": int, "waiting_since": float or None}
+    workers = {}
+    # players handed to us that haven't been seated yet: [(connection, msg)]
+    waiting = []
+
+    while True:
+        ready, _, _ = select.select([listener] + list(workers), [], [], 0.5)
+        for sock in ready:
+            if sock is listener:
+                conn, _ = listener.accept()
+                if not same_user(conn):
+                    print("[LOBBY] Turned away a worker running as another user.")
+                    conn.close()
+                    continue
+                workers[conn] = {"free": 0, "waiting_since": None}
+                continue
+            try:
+                data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, 1)
+            except OSError:
+                data, fds = b"", []
+            if not data:
+                print("[LOBBY] A worker went away.")
+                del workers[sock]
+                sock.close()
+                continue
+            msg = decode(data)
+            if msg["type"] == "status":
+                workers[sock] = {"free": msg["free"], "waiting_since": msg.get("waiting_since")}
+            elif msg["type"] == "handoff" and fds:
+                player = socket.socket(fileno=fds[0])
+                waiting.append((player, msg))
+                # its last report is from before this player left it
+                workers[sock] = {"free": 0, "waiting_since": None}
+                try:
+                    player.send(b"[SERVERINFO] Finding you a room with a free seat...\n", socket.MSG_DONTWAIT)
+                except OSError:
+                    pass
+
+        for player, msg in [w for w in waiting if hung_up(w[0])]:
+            print(f"[LOBBY] {msg['username']} left before a seat was found.")
+            waiting.remove((player, msg))
+            player.close()
+        seat_waiting_players(workers, waiting)
+
+
+def seat_waiting_players(workers, waiting):
+    # Fill half-full games first, so a lone player gets an opponent before anyone starts a new room.
+    order = sorted((w for w in workers if workers[w]["free"] > 0), key=lambda w: workers[w]["free"])
+    for worker in order:
+        while waiting and workers[worker]["free"] > 0:
+            player, msg = waiting[0]
+            try:
+                socket.send_fds(worker, [encode({"type": "seat", "username": msg["username"], "pending": msg.get("pending", "")})], [player.fileno()])
+            except OSError:
+                break
+            # the worker has its own copy of the descriptor now
+            waiting.pop(0)
+            player.close()
+            workers[worker]["free"] -= 1
+
+    # Two workers each holding one waiting player: ask the one that's waited least to give theirs up.
+    now = time.time()
+    lonely = [w for w in workers if workers[w]["free"] == 1 and workers[w]["waiting_since"]
+              and now - workers[w]["waiting_since"] > PAIR_AFTER_SECS]
+    if len(lonely) >= 2 and not waiting:
+        newest = max(lonely, key=lambda w: workers[w]["waiting_since"])
+        try:
+            newest.send(encode({"type": "release"}))
+            # don't ask again until the worker reports its new status
+            workers[newest]["waiting_since"] = None
+        except OSError:
+            pass
+
+
+class LobbyLink:
+    """
+    A worker's connection to the lobby. Reports seat status, hands off players it can't
+    seat, and calls on_seat(conn, username, pending) / on_release() for lobby requests.
+    """
+
+    def __init__(self, path, on_seat, on_release):
+        self.path = path
+        self.on_seat = on_seat
+        self.on_release = on_release
+        self._lock = threading.Lock()
+        self.sock = self._connect()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        sock.connect(self.path)
+        # players' connections are handed to whoever is listening there
+        if not same_user(sock):
+            sock.close()
+            raise ConnectionError(f"{self.path} belongs to another user")
+        return sock
+
+    def start(self):
+        threading.Thread(target=self._run, name="lobby-link", daemon=True).start()
+
+    def report(self, free, waiting_since=None):
+        try:
+            with self._lock:
+                self.sock.send(encode({"type": "status", "free": free, "waiting_since": waiting_since}))
+        except OSError:
+            pass
+
+    def hand_off(self, conn, username, pending=b""):
+        """
+        Give this connection to the lobby. The caller should close its own copy afterwards.
+        Raises OSError if the lobby can't be reached, in which case the caller keeps the player.
+        """
+        msg = {"type": "handoff", "username": username, "pending": pending.decode("utf-8", errors="replace")}
+        with self._lock:
+            socket.send_fds(self.sock, [encode(msg)], [conn.fileno()])
+
+    def _run(self):
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.sock, MAX_MESSAGE, 1)
+            except OSError:
+                data, fds = b"", []
+            if not data:
+                print("[SERVERERROR] Lost connection to the lobby, reconnecting...")
+                self._reconnect()
+                continue
+            msg = decode(data)
+            if msg["type"] == "seat" and fds:
+                conn = socket.socket(fileno=fds[0])
+                self.on_seat(conn, msg["username"], msg.get("pending", "").encode("utf-8"))
+            elif msg["type"] == "release":
+                self.on_release()
+
+    def _reconnect(self):
+        # the supervisor restarts a crashed lobby, keep trying until it's back
+        while True:
+            time.sleep(1)
+            try:
+                sock = self._connect()
+            except OSError:
+                continue
+            with self._lock:
+                self.sock.close()
+                self.sock = sock
+            return
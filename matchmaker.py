@@ -0,0 +1,352 @@
+"""
+matchmaker.py
+
+The lobby for a single server process, run as an actor: one thread owns who is seated at the
+game, who is queued and which game is waiting for a dropped player, and changes them only in
+answer to messages on its inbox. Nothing else touches that state, so there is no lock to take
+and no interleaving of two threads each half-way through pairing players up.
+
+Messages (each is a method that just posts to the inbox):
+
+    join(player)          a player ready for a game: new connection, handed over, given up resume
+    leave(player)         a player who has gone (e.g. no heartbeat); unseated/unqueued and closed if idle
+    finished(players)     their game is over, free the seats for whoever is queued
+    replay(player)        a player said 'y' at the play-again prompt, back of the queue
+    pause(players, ...)   a game lost a player: hold their seat until they reconnect (replies)
+    resume(players, ...)  restart a checkpointed game, if the seats are free (replies)
+    release()             give up our lone seated player to another process (multi-process lobby)
+    drain(seated)         take everyone idle off our hands, for a reload (replies)
+    report()              pass our LobbyState to report(state) (multi-process lobby): from the
+                          actor, so the lobby never gets a load computed before a handoff we've
+                          already sent it
+
+The ones marked "replies" block the caller until the actor has answered. If handling one
+fails the caller still gets an answer (pause: False, resume: False, drain: nobody), rather
+than waiting forever.
+
+A game that can't be started (start_game returns False: the server is draining for a reload)
+puts its players back at the front of the queue, where drain() hands them on.
+
+Threads that need to read the state (load reports, broadcasts, the game sending to the
+queue) use the latest snapshot instead, a LobbyState of tuples replaced after every message.
+
+A player whose username matches the one a paused game is waiting for gets their seat back
+and the game picks up from its saved boards. Otherwise joins are first come, first served.
+
+For a simulation (simulate.py) the matchmaker can run inline instead: each message is handled
+on the thread that sends it, the reconnect wait is timed on the clock (clock.py), and the
+messages that reply run a clock.VirtualClock until they have their answer, rather than
+blocking.
+
+With bot_after set, once a second the actor looks for anyone who has been waiting that long
+(alone in a seat, or queued behind a running game) and gives them a bot match instead
+(start_bot_game(player), see bots.py). Bot matches don't use the seats, so any number run
+alongside the one human game.
+"""
+
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import clock
+
+LobbyState = namedtuple("LobbyState", "seated waiting in_game rejoining")
+# the answer to a message whose handler failed
+FAILED = object()
+
+
+class Paused:
+    """A game that lost a player: who is still there, who it waits for, and its saved boards."""
+
+    def __init__(self, players, missing, saved, reply):
+        self.players = players
+        self.missing = missing
+        self.saved = saved
+        self.reply = reply
+
+
+class QueueView:
+    """The queued players as the game thread sees them (e.g. to send them game news)."""
+
+    def __init__(self, matchmaker):
+        self.matchmaker = matchmaker
+
+    def __iter__(self):
+        return iter(self.matchmaker.state.waiting)
+
+    def __len__(self):
+        return len(self.matchmaker.state.waiting)
+
+
+class Matchmaker:
+    """
+    start_game(players, saved) starts a game thread and returns False if it can't (e.g. the
+    server is draining), notify(player, msg) sends a player a line, and hand_off(player) may
+    move a player to another process, returning False if they should stay here.
+    rejoin_secs is how long a paused game keeps a dropped player's seat.
+    start_bot_game(player) starts a game against a bot, returning False if it can't, for
+    players who have waited bot_after seconds (0 for never).
+    report(state) sends our load to the lobby, see report().
+    inline handles messages as they're sent, with no actor thread (see above).
+    """
+
+    def __init__(self, start_game, notify, hand_off=None, rejoin_secs=10, start_bot_game=None, bot_after=0, report=None, inline=False):
+        self.start_game = start_game
+        self.notify = notify
+        self.hand_off = hand_off
+        self.rejoin_secs = rejoin_secs
+        self.start_bot_game = start_bot_game
+        self.bot_after = bot_after
+        self.on_report = report
+        self.inline = inline
+        # set while an inline matchmaker is handling messages, so one sent meanwhile waits its turn
+        self.handling = False
+        self.inbox = queue.Queue()
+        # only ever touched on the actor thread
+        self.seated = []
+        self.waiting = []
+        self.in_game = False
+        self.paused = None
+        self.state = LobbyState((), (), False, None)
+        self.queued = QueueView(self)
+
+    def start(self):
+        threading.Thread(target=self.run, name="matchmaker", daemon=True).start()
+        if self.bot_after and self.start_bot_game:
+            threading.Thread(target=self.tick, name="matchmaker-tick", daemon=True).start()
+
+    def tick(self):
+        while True:
+            time.sleep(1)
+            self.send("backfill")
+
+    def run(self):
+        while True:
+            self.handle(*self.inbox.get())
+
+    def handle(self, kind, args):
+        try:
+            getattr(self, "_" + kind)(*args)
+        except Exception as e:
+            print(f"[SERVERERROR] Matchmaker failed handling {kind}: {e}")
+            # whoever is waiting for an answer mustn't wait forever
+            for arg in args:
+                reply = arg.reply if isinstance(arg, Paused) else arg
+                if isinstance(reply, queue.Queue) and reply.empty():
+                    reply.put(FAILED)
+        self.state = self._snapshot()
+
+    def _snapshot(self):
+        return LobbyState(tuple(self.seated), tuple(self.waiting), self.in_game,
+                          self.paused.missing if self.paused else None)
+
+    def send(self, kind, *args):
+        self.inbox.put((kind, args))
+        if self.inline and not self.handling:
+            self.handling = True
+            try:
+                while not self.inbox.empty():
+                    self.handle(*self.inbox.get())
+            finally:
+                self.handling = False
+
+    def wait(self, reply):
+        # inline, the answer may need the clock to move, e.g. a player coming back in a few
+        # seconds; with nothing left scheduled it never will
+        if self.inline and not clock.current().run_until(lambda: not reply.empty()):
+            return FAILED
+        return reply.get()
+
+    def ask(self, kind, *args, failed=None):
+        # post a message and wait for the actor's answer ('failed' if handling it went wrong)
+        reply = queue.Queue()
+        self.send(kind, reply, *args)
+        answer = self.wait(reply)
+        return failed if answer is FAILED else answer
+
+    # --- messages ---
+
+    def join(self, player):
+        self.send("join", player)
+
+    def leave(self, player):
+        self.send("leave", player)
+
+    def finished(self, players):
+        self.send("finished", players)
+
+    def replay(self, player):
+        self.send("replay", player)
+
+    def pause(self, players, missing, saved):
+        """
+        Called by a game thread that lost 'missing'. Blocks until they're back (True: the
+        matchmaker has restarted the game, with the saved boards) or their seat is given up (False).
+        """
+        reply = queue.Queue()
+        self.send("pause", Paused(players, missing, saved, reply))
+        return self.wait(reply) is True
+
+    def resume(self, players, saved):
+        """Start a checkpointed game if nothing else is using the seats. Returns whether it did."""
+        return self.ask("resume", players, saved, failed=False)
+
+    def release(self):
+        self.send("release")
+
+    def drain(self, seated=False):
+        """Remove and return everyone queued (and seated but not playing, if 'seated')."""
+        return self.ask("drain", seated, failed=[])
+
+    def report(self):
+        self.send("report")
+
+    # --- handlers, on the actor thread ---
+
+    def _join(self, player):
+        if self.paused and player["username"] == self.paused.missing:
+            self._reconnect(player)
+            return
+        if any(p is player for p in self.seated + self.waiting):
+            return
+        if self.in_game or self.paused or len(self.seated) >= 2:
+            # another worker may have a free seat, let the lobby find it (but don't bounce players around)
+            if self.hand_off and not player.get("from_lobby") and self.hand_off(player):
+                return
+            print("[SERVERINFO] Game is in progress, adding this client to the queue. ")
+            self._enqueue(player)
+            names = [p["username"] for p in self.seated] + ([self.paused.missing] if self.paused else [])
+            names = " and ".join(names)
+            self.notify(player, f"[SERVERINFO] Thanks for joining - game in progress between {names}, you'll join when someone disconnects or a new game starts. You can be a spectator for now!")
+            return
+        self._enqueue(player)
+        self._fill()
+
+    def _reconnect(self, player):
+        paused, self.paused = self.paused, None
+        print(f"[SERVERINFO] {player['username']} is back, picking their game up where it left off.")
+        self.seated = paused.players + [player]
+        self._start(paused.saved)
+        # the paused game thread is done with them either way
+        paused.reply.put(True)
+
+    def _leave(self, player):
+        idle = any(p is player for p in self.waiting)
+        if idle:
+            self.waiting.remove(player)
+        # someone waiting alone for an opponent, no game thread is looking after them
+        if not self.in_game and not self.paused and any(p is player for p in self.seated):
+            self.seated.remove(player)
+            idle = True
+        if idle:
+            # nobody else is using their connection
+            try:
+                player["connection"].close()
+            except OSError:
+                pass
+
+    def _finished(self, players):
+        print(f"[SERVERINFO] Game between {' and '.join(p['username'] for p in players)} is over.")
+        self.seated = []
+        self.in_game = False
+        self._fill()
+
+    def _replay(self, player):
+        self._enqueue(player)
+        self.notify(player, "[SERVERINFO] You've been added back to the queue.")
+        self._fill()
+
+    def _pause(self, paused):
+        self.in_game = False
+        if paused.missing is None:
+            # nobody actually left (the game thread hit an error): just start it again
+            self._reconnect_all(paused)
+            return
+        print(f"[SERVERINFO] Holding {paused.missing}'s seat for {self.rejoin_secs}s.")
+        self.seated = list(paused.players)
+        self.paused = paused
+        clock.call_later(self.rejoin_secs, self.send, "rejoin_over", paused)
+
+    def _reconnect_all(self, paused):
+        self.seated = list(paused.players)
+        self._start(paused.saved)
+        paused.reply.put(True)
+
+    def _rejoin_over(self, paused):
+        if self.paused is not paused:
+            # they made it back in time
+            return
+        print(f"[SERVERINFO] {paused.missing} didn't come back, giving up their seat.")
+        self.paused = None
+        self.seated = []
+        paused.reply.put(False)
+        self._fill()
+
+    def _resume(self, reply, players, saved):
+        if self.seated or self.paused or self.in_game:
+            reply.put(False)
+            return
+        self.seated = list(players)
+        self.in_game = self.start_game(self.seated, saved)
+        if not self.in_game:
+            self.seated = []
+        reply.put(self.in_game)
+
+    def _release(self):
+        if len(self.seated) != 1 or self.waiting or self.in_game or self.paused:
+            return
+        player = self.seated.pop()
+        if not self.hand_off or not self.hand_off(player):
+            self.seated.append(player)
+
+    def _drain(self, reply, seated):
+        idle, self.waiting = self.waiting, []
+        if seated and not self.in_game and not self.paused:
+            idle += self.seated
+            self.seated = []
+        reply.put(idle)
+
+    def _report(self):
+        if self.on_report:
+            self.on_report(self._snapshot())
+
+    def _backfill(self):
+        cutoff = time.time() - self.bot_after
+        alone = self.seated if len(self.seated) == 1 and not self.in_game and not self.paused else []
+        for player in alone + self.waiting:
+            if player["queuedAt"] <= cutoff and self.start_bot_game(player):
+                print(f"[SERVERINFO] {player['username']} waited {self.bot_after}s, giving them a bot to play.")
+                if player in alone:
+                    self.seated.remove(player)
+                else:
+                    self.waiting.remove(player)
+
+    def _enqueue(self, player):
+        player["queuedAt"] = time.time()
+        self.waiting.append(player)
+
+    def _fill(self):
+        # seat queued players, in order, and start a game once there are two
+        if self.in_game or self.paused:
+            return
+        seated = []
+        while len(self.seated) < 2 and self.waiting:
+            player = self.waiting.pop(0)
+            self.seated.append(player)
+            seated.append(player)
+            self.notify(player, "You've been added to the game!")
+        if len(self.seated) == 2:
+            if self._start(None):
+                print("[SERVERINFO] Game started on the server!")
+        elif seated:
+            self.notify(seated[0], "Waiting on another person to join the game...!")
+
+    def _start(self, saved):
+        # Start a game for whoever is seated. If it can't start, they go back to the front of the
+        # queue, for drain() to hand on, rather than sitting in seats no game is looking after.
+        self.in_game = self.start_game(self.seated, saved)
+        if not self.in_game:
+            self.waiting[:0] = self.seated
+            self.seated = []
+        return self.in_game
@@ -0,0 +1,156 @@
+"""
+memtransport.py
+
+An in-memory stand-in for a player's socket, for running the server's game logic without
+the network.
+
+The game code only talks to a player through three objects in the player dict:
+    player["connection"]   settimeout(), shutdown(), close(), fileno()
+                           (and used as the key into last_move_time)
+    player["readFile"]     readline(), poll(timeout), drain(), eof, last_seen
+    player["writeFile"]    write(), flush(), write_encoded(), send_frame()
+connection.LineReader/LineWriter are the socket implementation of that; this module is the
+in-memory one. What the server writes is handed straight to a callback (the simulated
+client) each time it flushes, and the client's replies are scheduled on a clock.VirtualClock, so a reply can
+arrive "later", or never, without anyone actually waiting.
+
+Everything runs on one thread: a read with nothing to read runs the clock forward until a
+reply arrives, the read times out (settimeout(), poll()), or nothing else is scheduled, which
+counts as the client having gone silent for good (readline() returns '' like a closed socket).
+"""
+
+import itertools
+import socket
+from collections import deque
+
+from connection import MAX_PENDING_LINES
+
+_fds = itertools.count(1000)
+
+
+class MemoryConnection:
+
+    def __init__(self):
+        self.timeout = None
+        self.closed = False
+        self._fd = next(_fds)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def shutdown(self, how):
+        if self.closed:
+            raise OSError("Connection already closed")
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+    def fileno(self):
+        return -1 if self.closed else self._fd
+
+
+class MemoryReader:
+    """Server side of the client -> server direction."""
+
+    def __init__(self, conn, clock, max_pending=MAX_PENDING_LINES):
+        self.conn = conn
+        self.clock = clock
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.last_seen = clock.time()
+        self._lines = deque()
+        self._eof = False
+
+    @property
+    def eof(self):
+        return self._eof or self.conn.closed
+
+    def deliver(self, line):
+        """Called (via the clock) when the client's line arrives."""
+        if not self.eof:
+            self.last_seen = self.clock.time()
+            if len(self._lines) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._lines.append(line + "\n")
+
+    def hang_up(self):
+        self._eof = True
+
+    def _ready(self):
+        return bool(self._lines) or self.eof
+
+    def readline(self):
+        deadline = None if self.conn.timeout is None else self.clock.time() + self.conn.timeout
+        if not self.clock.run_until(self._ready, deadline):
+            if deadline is not None:
+                raise socket.timeout("timed out")
+            # nothing will ever arrive: the same as the client going away
+            self._eof = True
+        if self._lines:
+            return self._lines.popleft()
+        return ""
+
+    def poll(self, timeout=0.0):
+        return self.clock.run_until(self._ready, self.clock.time() + timeout)
+
+    def drain(self):
+        pass
+
+    def take_buffered(self):
+        data = "".join(self._lines).encode("utf-8")
+        self._lines.clear()
+        return data
+
+
+class MemoryWriter:
+    """
+    Server side of the server -> client direction: each flush() passes what was written to
+    on_output(text), one or more whole lines (a board is one call, not eleven).
+    """
+
+    def __init__(self, conn, on_output):
+        self.conn = conn
+        self.on_output = on_output
+        self._pending = []
+
+    def write(self, text):
+        self._pending.append(text)
+        return len(text)
+
+    def flush(self):
+        if not self._pending:
+            return
+        if self.conn.closed:
+            raise BrokenPipeError("Connection closed")
+        data = self._pending[0] if len(self._pending) == 1 else "".join(self._pending)
+        self._pending.clear()
+        self.on_output(data)
+
+    def write_encoded(self, data):
+        self.write(data.decode("utf-8"))
+        self.flush()
+
+    def send_frame(self, frame):
+        if self.conn.closed:
+            raise OSError("Connection closed")
+        return True
+
+
+def connect(username, clock, on_output):
+    """
+    Make a player dict for a simulated client. on_output(text) gets what the server sends,
+    a flush at a time; the client replies with player["readFile"].deliver(line), usually from a
+    clock.call_later() callback.
+    """
+    conn = MemoryConnection()
+    return {
+        "connection": conn,
+        "readFile": MemoryReader(conn, clock),
+        "writeFile": MemoryWriter(conn, on_output),
+        "username": username,
+    }
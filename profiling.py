@@ -0,0 +1,216 @@
+"""
+profiling.py
+
+Profiling a running server without restarting it.
+
+ - SIGUSR1 starts profiling; the next SIGUSR1 stops it and writes the results:
+       profile-<time>.prof   cProfile stats (open with pstats or snakeviz)
+       profile-<time>.txt    the top functions by cumulative time, readable as is
+       memory-<time>.txt     tracemalloc's top allocations while profiling was on
+ - SIGUSR2 writes stacks-<time>.txt, the current stack of every thread (e.g. to see where
+   a stuck game thread is waiting).
+ - With an admin socket (server.py --admin-socket PATH), the same can be done by sending
+   one command per line, e.g. `echo stacks | nc -U /tmp/battleship-admin.sock`:
+       start, stop, stacks, memory (top allocations so far, without stopping), status
+       (also counts the players dropped for not reading, see connection.py),
+       trace (tracemalloc only, no cProfile: replies with the bytes traced and writes the
+       allocations that grew since the last trace to trace-<time>.txt; used by soak.py)
+   The socket is only accessible to the user running the server.
+
+On Python 3.12 cProfile records every thread, so one profiler covers all the "game" threads,
+"matchmaker" and "matchmaker-tick", "heartbeat", the "spectator" senders and the rest (the
+names show up in the stacks dump). While profiling is off nothing is hooked in at all: the
+only cost is the signal handlers.
+"""
+
+import cProfile
+import io
+import linecache
+import os
+import pstats
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+from connection import slow_consumers
+
+PROFILE_DIR = "profiles"
+ADMIN_SOCKET = "/tmp/battleship-admin.sock"
+# rows in the text reports
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# frames kept per allocation by tracemalloc
+TRACE_FRAMES = 5
+
+
+class Profiler:
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.profile = None
+        self.started = None
+        # last snapshot taken by the trace command, to diff the next one against
+        self._traced = None
+        self._lock = threading.Lock()
+
+    def _path(self, kind, ext):
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+        return os.path.join(self.directory, f"{kind}-{stamp}-{os.getpid()}.{ext}")
+
+    def start(self):
+        with self._lock:
+            if self.profile:
+                return "Already profiling."
+            tracemalloc.start(TRACE_FRAMES)
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            self.started = time.time()
+        print("[SERVERINFO] Profiling started.")
+        return "Profiling started."
+
+    def stop(self):
+        with self._lock:
+            if not self.profile:
+                return "Not profiling."
+            profile, self.profile = self.profile, None
+            profile.disable()
+            memory = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            elapsed = time.time() - self.started
+
+        prof_path = self._path("profile", "prof")
+        profile.dump_stats(prof_path)
+        text = io.StringIO()
+        text.write(f"Profiled for {elapsed:.1f}s\n\n")
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        with open(prof_path[:-len("prof")] + "txt", "w") as f:
+            f.write(text.getvalue())
+        memory_path = self.write_memory(memory)
+        print(f"[SERVERINFO] Profiling stopped, wrote {prof_path} and {memory_path}")
+        return f"Wrote {prof_path} and {memory_path}"
+
+    def toggle(self):
+        return self.stop() if self.profile else self.start()
+
+    def write_memory(self, memory=None):
+        if memory is None:
+            if not tracemalloc.is_tracing():
+                return None
+            memory = tracemalloc.take_snapshot()
+        path = self._path("memory", "txt")
+        stats = memory.statistics("traceback")
+        with open(path, "w") as f:
+            f.write(f"{sum(stat.size for stat in stats) / 1024:.1f} KiB traced in {len(stats)} places\n\n")
+            for stat in stats[:TOP_ALLOCATIONS]:
+                f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                for line in stat.traceback.format():
+                    f.write(line + "\n")
+                f.write("\n")
+        return path
+
+    def trace(self):
+        """Start tracemalloc if needed, and write what has grown since the last call."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        # leave out memory used by tracing itself (and the source lines cached for the report)
+        memory = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        traced = sum(stat.size for stat in memory.statistics("filename"))
+        if self._traced is None:
+            self._traced = memory
+            return f"{traced} (first trace, nothing to compare yet)"
+        path = self._path("trace", "txt")
+        with open(path, "w") as f:
+            for stat in memory.compare_to(self._traced, "traceback")[:TOP_ALLOCATIONS]:
+                f.write(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+} blocks), {stat.size / 1024:.1f} KiB now\n")
+                for line in stat.traceback.format():
+                    f.write(line + "\n")
+                f.write("\n")
+        self._traced = memory
+        return f"{traced} {path}"
+
+    def write_stacks(self):
+        path = self._path("stacks", "txt")
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with open(path, "w") as f:
+            for ident, frame in sys._current_frames().items():
+                f.write(f"Thread {names.get(ident, '?')} ({ident}):\n")
+                f.write("".join(traceback.format_stack(frame)))
+                f.write("\n")
+        print(f"[SERVERINFO] Wrote thread stacks to {path}")
+        return f"Wrote {path}"
+
+    def command(self, line):
+        """Run one admin command and return the reply."""
+        cmd = line.strip().lower()
+        if cmd == "start":
+            return self.start()
+        if cmd == "stop":
+            return self.stop()
+        if cmd == "stacks":
+            return self.write_stacks()
+        if cmd == "memory":
+            path = self.write_memory()
+            return f"Wrote {path}" if path else "Not profiling, start it first."
+        if cmd == "trace":
+            return self.trace()
+        if cmd == "status":
+            slow = ", ".join(f"{count} {reason}" for reason, count in sorted(slow_consumers.items())) or "none"
+            if self.profile:
+                return f"Profiling for {time.time() - self.started:.0f}s, {threading.active_count()} threads, slow consumers dropped: {slow}."
+            return f"Not profiling, {threading.active_count()} threads, slow consumers dropped: {slow}."
+        return "Commands: start, stop, stacks, memory, status, trace"
+
+    def on_signal(self, signum, frame):
+        # SIGUSR1 toggles profiling, SIGUSR2 dumps stacks
+        try:
+            if signum == signal.SIGUSR2:
+                self.write_stacks()
+            else:
+                self.toggle()
+        except OSError as e:
+            print(f"[SERVERERROR] Could not write profiling output: {e}")
+
+    def serve_admin(self, path=ADMIN_SOCKET):
+        """Accept admin commands on a Unix socket (in a background thread)."""
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # create the socket file without group/other access from the start
+        old_umask = os.umask(0o077)
+        try:
+            listener.bind(path)
+        finally:
+            os.umask(old_umask)
+        listener.listen()
+        print(f"[SERVERINFO] Admin commands on {path}")
+        # in case the umask above isn't honoured for sockets on this platform
+        os.chmod(path, 0o600)
+
+        def handle(conn):
+            with conn, conn.makefile("rw") as f:
+                for line in f:
+                    try:
+                        reply = self.command(line)
+                    except OSError as e:
+                        reply = f"Error: {e}"
+                    f.write(reply + "\n")
+                    f.flush()
+
+        def run():
+            while True:
+                conn, _ = listener.accept()
+                threading.Thread(target=handle, args=(conn,), name="admin", daemon=True).start()
+
+        threading.Thread(target=run, name="admin-listener", daemon=True).start()
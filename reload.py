@@ -0,0 +1,138 @@
+"""
+reload.py
+
+Zero-downtime restarts for server.py.
+
+When the running server gets SIGHUP it:
+ 1. opens a Unix socket at the handover path and starts a new copy of itself with
+    --takeover <path>,
+ 2. passes its listening socket to the new process, which starts accepting straight away
+    (no moment where the port is closed),
+ 3. passes over everyone who isn't in the middle of a game (the queue, a lone waiting player),
+ 4. keeps running its current game; players freed when it ends are passed over too,
+ 5. writes out its last checkpoints, sends "done" and exits.
+
+The checkpoint file (checkpoint.py) belongs to one process at a time: the new one only opens it
+once the old one is done, so they never both write it, and games the old one was still playing
+aren't offered to anyone for resuming.
+
+Everything goes over one SOCK_SEQPACKET connection as JSON messages with file descriptors
+attached, the same way lobby.py moves players between workers (and, as there, the socket is
+private to the user running the server, and each end checks the other runs as that user):
+    {"type": "listener"} + fd
+    {"type": "seat", "username": ..., "pending": ...} + fd
+    {"type": "done"}
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from lobby import encode, decode, bind_private, same_user, MAX_MESSAGE
+
+HANDOVER_PATH = "/tmp/battleship-handover.sock"
+# how long to wait for the new process to start and connect
+SUCCESSOR_TIMEOUT_SECS = 15
+
+
+class Handover:
+    """The old process's side: starts the successor and sends it sockets."""
+
+    def __init__(self, path=HANDOVER_PATH):
+        self.path = path
+        self._listener = bind_private(path)
+        self._listener.settimeout(SUCCESSOR_TIMEOUT_SECS)
+        self.sock = None
+        self._lock = threading.Lock()
+
+    def start_successor(self):
+        # same command line as we were started with, minus any --takeover from our own start
+        args = []
+        skip = False
+        for arg in sys.argv[1:]:
+            if skip:
+                skip = False
+            elif arg == "--takeover":
+                skip = True
+            elif not arg.startswith("--takeover="):
+                args.append(arg)
+        proc = subprocess.Popen([sys.executable, sys.argv[0]] + args + ["--takeover", self.path])
+        try:
+            while True:
+                sock, _ = self._listener.accept()
+                if same_user(sock):
+                    break
+                sock.close()
+            self.sock = sock
+        finally:
+            self._listener.close()
+            os.unlink(self.path)
+        return proc
+
+    def send_listener(self, listener):
+        with self._lock:
+            socket.send_fds(self.sock, [encode({"type": "listener"})], [listener.fileno()])
+
+    def hand_off(self, conn, username, pending=b""):
+        """Same signature as LobbyLink.hand_off, so server.hand_off() works with either."""
+        msg = {"type": "seat", "username": username, "pending": pending.decode("utf-8", errors="replace")}
+        with self._lock:
+            socket.send_fds(self.sock, [encode(msg)], [conn.fileno()])
+
+    def done(self):
+        with self._lock:
+            try:
+                self.sock.send(encode({"type": "done"}))
+            except OSError:
+                pass
+            self.sock.close()
+
+
+def take_over(path, on_seat, on_done=None):
+    """
+    The new process's side: connect to the old process, and return the listening socket it
+    passes over. on_seat(conn, username, pending) is called (from a background thread) for
+    every player handed over, until the old process is done; then on_done(), if given (also
+    if the old process goes away without saying so).
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    deadline = time.time() + SUCCESSOR_TIMEOUT_SECS
+    while True:
+        try:
+            sock.connect(path)
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+    if not same_user(sock):
+        raise ConnectionError(f"{path} belongs to another user")
+
+    data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, 1)
+    if not fds or decode(data)["type"] != "listener":
+        raise ConnectionError("Old server did not send its listening socket.")
+    listener = socket.socket(fileno=fds[0])
+
+    def receive_players():
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, 1)
+            except OSError:
+                break
+            if not data:
+                break
+            msg = decode(data)
+            if msg["type"] == "done":
+                break
+            if msg["type"] == "seat" and fds:
+                on_seat(socket.socket(fileno=fds[0]), msg["username"], msg.get("pending", "").encode("utf-8"))
+        print("[SERVERINFO] Old server has finished handing over.")
+        sock.close()
+        if on_done:
+            on_done()
+
+    threading.Thread(target=receive_players, name="takeover", daemon=True).start()
+    return listener
@@ -0,0 +1,173 @@
+"""
+replay.py
+
+Plays sessions recorded with server.py --capture-file back against a server, and measures
+how it responds, so two builds can be compared on real player behaviour (typos, hesitating
+near the turn timeout, quitting half way through placing ships, ...).
+
+Every recorded session gets its own connection, all in parallel, and sends its lines at the
+recorded times (divided by --speed, so --speed 10 replays an hour in six minutes). Heartbeat
+PINGs are answered as client.py would. The results are:
+    latency: seconds from sending a line to the next line the server sends back
+             (p50, p90, p99 and max over every line sent). A line sent before the server
+             asked for it (it's still the opponent's turn) waits for the prompt, so this
+             includes some game time as well as the server's own.
+    outcomes: how many sessions saw each kind of ending, e.g. win, timeout, opponent
+             forfeit, invalid input, server full, dropped
+and are written as JSON with --out. Given --compare with an earlier results file, the
+differences are printed too:
+
+    python replay.py capture.jsonl --port 5002 --speed 5 --out new.json --compare old.json
+
+--unix-socket connects through the server's Unix socket instead (server.py --unix-socket).
+
+Every session connects from this host, so over TCP the server has to be started with per-IP
+admission limits (admission.py) that let them all in at once, or most get [SERVERFULL]:
+
+    python server.py --port 5002 --max-per-ip 1000 --connect-rate 1000 --connect-burst 1000
+
+Connections over the Unix socket aren't limited per IP, so it needs nothing extra.
+
+Note that a sped-up replay changes what the server sees: a player who took 9s over a turn
+takes under 2s at --speed 5, so timeouts are only reproduced faithfully at 1x.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+from capture import load
+from soak import percentile
+
+HOST = '127.0.0.1'
+PORT = 5002
+# how long to keep listening after a session's last line, for the server's final replies
+LINGER_SECS = 3
+# server messages counted as outcomes (first match wins, per line)
+OUTCOMES = [
+    ("Congratulations!", "win"),
+    ("Opponent has forfeited due to inactivity", "opponent timed out"),
+    ("Timeout! You have forfeited", "timeout"),
+    ("Your opponent quit or forfeited! You win!", "opponent left"),
+    ("Invalid input", "invalid input"),
+    ("Invalid format", "invalid placement"),
+    ("Invalid position", "invalid placement"),
+    ("[SERVERFULL]", "server full"),
+]
+
+
+async def replay_session(events, host, port, speed, latencies, outcomes, unix_socket=None):
+    try:
+        if unix_socket:
+            reader, writer = await asyncio.open_unix_connection(unix_socket)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        outcomes["could not connect"] += 1
+        return
+    # when each line still waiting for a reply was sent
+    waiting = []
+    seen = set()
+
+    async def receive():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            text = line.decode("utf-8", errors="replace").strip()
+            if text == "PING":
+                writer.write(b"PONG\n")
+                continue
+            if waiting:
+                now = time.monotonic()
+                latencies.extend(now - sent for sent in waiting)
+                waiting.clear()
+            for marker, outcome in OUTCOMES:
+                if marker in text:
+                    seen.add(outcome)
+                    break
+
+    receiving = asyncio.ensure_future(receive())
+    started = time.monotonic()
+    try:
+        for t, line in events:
+            delay = started + t / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if receiving.done():
+                seen.add("dropped by server")
+                break
+            if line is None:
+                break
+            waiting.append(time.monotonic())
+            writer.write(line.encode("utf-8") + b"\n")
+            await writer.drain()
+        # give the server a moment to answer the last line (and notice a hang-up)
+        await asyncio.wait([receiving], timeout=LINGER_SECS)
+    except ConnectionError:
+        seen.add("dropped by server")
+    finally:
+        receiving.cancel()
+        writer.close()
+    for outcome in seen:
+        outcomes[outcome] += 1
+
+
+async def replay(path, host, port, speed, limit=None, unix_socket=None):
+    sessions = load(path)
+    if limit:
+        sessions = dict(list(sessions.items())[:limit])
+    latencies = []
+    outcomes = Counter()
+    started = time.monotonic()
+    await asyncio.gather(*(replay_session(events, host, port, speed, latencies, outcomes, unix_socket) for events in sessions.values()))
+    return {
+        "sessions": len(sessions),
+        "lines": sum(len([e for e in events if e[1] is not None]) for events in sessions.values()),
+        "seconds": round(time.monotonic() - started, 2),
+        "speed": speed,
+        "latency": {name: percentile(latencies, pct) for name, pct in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))},
+        "outcomes": dict(outcomes),
+    }
+
+
+def compare(old, new):
+    print(f"[REPLAY] {'':20} {'before':>10} {'after':>10}")
+    for name in new["latency"]:
+        before, after = old["latency"].get(name), new["latency"][name]
+        fmt = lambda v: "-" if v is None else f"{v * 1000:.1f}ms"
+        print(f"[REPLAY] latency {name:12} {fmt(before):>10} {fmt(after):>10}")
+    for outcome in sorted(set(old["outcomes"]) | set(new["outcomes"])):
+        before, after = old["outcomes"].get(outcome, 0), new["outcomes"].get(outcome, 0)
+        flag = "" if before == after else "  <-- changed"
+        print(f"[REPLAY] {outcome:20} {before:>10} {after:>10}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured sessions against a Battleship server")
+    parser.add_argument("capture", help="file written by server.py --capture-file")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix-socket", help="connect through the server's Unix socket instead of TCP")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--limit", type=int, help="only replay the first N sessions")
+    parser.add_argument("--out", help="write the results here as JSON")
+    parser.add_argument("--compare", help="results file from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(replay(args.capture, args.host, args.port, args.speed, args.limit, args.unix_socket))
+    print(f"[REPLAY] {results['sessions']} sessions, {results['lines']} lines in {results['seconds']}s at {args.speed}x")
+    print(f"[REPLAY] {json.dumps(results['latency'])}")
+    print(f"[REPLAY] {json.dumps(results['outcomes'])}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
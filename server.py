@@ -1,27 +1,133 @@
+import argparse
+import ipaddress
+import json
+import os
+import secrets
+import select
+import signal
 import socket
+import struct
 import threading
 import queue
 import time
-from battleship import run_single_player_game_online, run_multi_player_round, DisconnectError
+import clock
+from battleship import run_single_player_game_online, run_multi_player_round, DisconnectError, command_parser
+from commands import CommandError
 from shared import last_move_time, gameOverPrompt
+from connection import LineReader, LineWriter, MAX_LINE_LENGTH, MAX_PENDING_LINES, WRITE_DEADLINE_SECS, MAX_OUTBOUND_BYTES
+from heartbeat import HeartbeatMonitor, HEARTBEAT_INTERVAL, HEARTBEAT_MISSES
+from tournament import run_tournament, FORMATS
+from lobby import LobbyLink
+from reload import Handover, take_over, HANDOVER_PATH
+from checkpoint import CheckpointStore, decode_snapshot
+from supervisor import run_supervisor
+from spectate import open_match, close_match, spectate, stop_watching
+from webfeed import WebFeed
+from profiling import Profiler, PROFILE_DIR
+from capture import Recorder
+from admission import AdmissionController, reject, MAX_PLAYERS, MAX_HANDSHAKES, MAX_CONNECTIONS_PER_IP, CONNECT_RATE, CONNECT_BURST
+from matchmaker import Matchmaker
+from bots import new_bot
+from solver import review
+from stats import StatsStore
 
+# players signing up for tournaments (in tournament mode, instead of the matchmaker)
 incoming = queue.Queue()
-returning_players = queue.Queue()
 
 
 HOST = '127.0.0.1'
 PORT = 5002
 global clients 
 global gameOver
-global connectedPlayers 
-global clientStorage
-global recentDisconnect
-global newGame
-global gameStateOne
-global gameStateTwo
-pause_clients = threading.Lock()
 
 TIMEOUT_SECS = 10
+# how long a tournament entrant has to place all their ships before forfeiting the match
+PLACEMENT_TIMEOUT_SECS = 60
+# how long a player has to answer the play-again prompt
+REPLAY_TIMEOUT_SECS = 10
+# salvo rules: one shot per ship still afloat each turn, all on one line
+SALVO = False
+# how long a game waits for a disconnected player to come back
+RECONNECT_WAIT_SECS = 10
+# give a player who has waited this many seconds for an opponent a bot to play instead (0 for never), see bots.py
+BOT_AFTER_SECS = 0
+
+# Admission control, see admission.py. All of these can be changed on the command line, as can
+# the heartbeat (heartbeat.py), line length, commands sent ahead and slow consumer limits
+# (connection.py).
+LISTEN_BACKLOG = 64
+# seconds a new connection gets to send its username
+HANDSHAKE_TIMEOUT_SECS = 10
+
+# Multi-process mode, see supervisor.py and lobby.py.
+WORKERS = 1
+LOBBY_SOCKET = "/tmp/battleship-lobby.sock"
+# set in worker processes once they've connected to the lobby
+lobbyLink = None
+# when the lone seated player started waiting for an opponent
+waitingSince = None
+
+# Unix domain socket for bots and tools on the same host, speaking the same protocol as the
+# TCP port. Off unless a path is given. Who may connect is down to the socket file's mode.
+UNIX_SOCKET = None
+UNIX_SOCKET_MODE = 0o660
+unix_listener = None
+# what connections on it count as for admission control: trusted, so only max-players applies
+UNIX_PEER = "unix"
+
+# Cluster mode, see gateway.py: "host:port" of the gateway's control port, or None.
+GATEWAY = None
+
+# Graceful reload, see reload.py. Set once SIGHUP has handed the listening socket to a new process.
+draining = False
+handover = None
+# passed on the command line to a process started by a reload
+TAKEOVER = None
+listener = None
+# set while SIGHUP's reload thread is starting the new process
+reloading = False
+# written to by the reload thread to get the accept loop out of select()
+wake_accept = os.pipe()
+
+# Game checkpoints, see checkpoint.py. Off unless a checkpoint file is given.
+CHECKPOINT_FILE = None
+checkpoints = None
+# rooms loaded from the checkpoint file at startup (after a reload, once the old process is
+# done with it) that nobody has resumed yet
+restorable = {}
+# when those were loaded: a saved turn is taken to have run until then
+restoredAt = None
+# room -> players who have resumed so far
+resuming = {}
+# how long a resumed player waits for their opponent before getting a new game instead
+RESUME_WAIT_SECS = 60
+# whatever is left of the turn they were on, a resumed player gets at least this long to move
+RESUME_MIN_TURN_SECS = 3
+# guards restorable and resuming, which connection threads and the resume timers share
+resume_lock = threading.Lock()
+
+# Player stats and the leaderboard, see stats.py. Off unless a database file is given.
+STATS_DB = None
+stats = None
+
+# Tournament mode, see tournament.py: 'single' or 'swiss' (None for normal matchmaking),
+# and how many players register before an event starts.
+TOURNAMENT = None
+ENTRANTS = 8
+# players signed up for the next tournament
+registered = []
+registration_open = threading.Condition()
+
+# Read-only HTTP/SSE view of running matches, see webfeed.py. Off unless a port is given.
+HTTP_PORT = None
+
+# On-demand profiling, see profiling.py: SIGUSR1/SIGUSR2, or commands on an admin socket if one is given.
+profiler = Profiler(PROFILE_DIR)
+ADMIN_SOCKET = None
+
+# Session capture for replay.py, see capture.py. Off unless a capture file is given.
+CAPTURE_FILE = None
+recorder = None
 
 timeout_forfeit_occurred = threading.Event()
 
@@ -34,32 +140,182 @@ def send_server_message(player, msg):
     except Exception as e:
         print("[SERVERERROR] Could not send message.")
 
+def player_reader(conn, writeFile, **kwargs):
+    # A LineReader for a player's connection, which tells them if they send too much ahead.
+    def overflow(line):
+        # once per burst (see LineReader), so a flood can't fill up what's waiting to be sent to them.
+        # Not flushed: this can be the heartbeat thread, which mustn't block on one player.
+        writeFile.write(f"[SERVERINFO] Too many commands sent ahead, ignoring '{line.strip()}' and anything else until you're asked.\n")
+    return LineReader(conn, max_line=MAX_LINE_LENGTH, max_pending=MAX_PENDING_LINES, on_overflow=overflow, **kwargs)
+
 def send_all_message(msg):
     print(msg)
-    for client in connectedPlayers:
+    lobby = matchmaker.state
+    for client in lobby.seated + lobby.waiting:
         try:
             client["writeFile"].write(msg+"\n")
             client["writeFile"].flush()
         except:
             pass
-    for client in clientStorage:
-        try:
-            client["writeFile"].write(msg+'\n')
-            client["writeFile"].flush()
-        except:
-            pass
+
+
+def evict_dead_player(player):
+    # Called by the heartbeat thread when a peer stops answering PINGs (e.g. a half-open connection).
+    print(f"[SERVERINFO] No heartbeat from {player['username']}, evicting them.")
+    # If they were in a game, shutting the socket down makes the game thread take its usual disconnect
+    # path. Only whoever owns the connection closes it (the game thread, or the matchmaker for an idle
+    # player), so its descriptor can't be reused while a game thread is still reading from it.
+    try:
+        player["connection"].shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    if "watching" in player:
+        # a spectator: their sender owns the connection, and closes it once stopped
+        stop_watching(player)
+    else:
+        matchmaker.leave(player)
+
+heartbeats = HeartbeatMonitor(evict_dead_player, HEARTBEAT_INTERVAL, HEARTBEAT_MISSES)
+admission = AdmissionController()
+
+
+def start_game(players, saved=None):
+    # Called by the matchmaker with the two players it has seated (and the boards, to pick up an interrupted game).
+    # While draining for a reload no new games start here; the players are handed to the new process instead.
+    if draining:
+        return False
+    gameThread = threading.Thread(target=handle_game_clients, args=(list(players), saved), name="game")
+    gameThread.start()
+    return True
+
+
+def hand_to_lobby(player):
+    # In a worker, a player we can't seat may have a free seat waiting on another worker.
+    return lobbyLink is not None and hand_off(player, lobbyLink)
+
+
+def start_bot_game(player):
+    if draining:
+        return False
+    threading.Thread(target=play_bot_match, args=(player,), name="game").start()
+    return True
+
+
+def send_load(lobby):
+    # Called by the matchmaker with its current state, in order with any players it has handed off.
+    global waitingSince
+    if lobbyLink is None:
+        return
+    free = max(0, 2 - len(lobby.seated) - len(lobby.waiting))
+    if len(lobby.seated) == 1 and not lobby.rejoining:
+        waitingSince = waitingSince or time.time()
+    else:
+        waitingSince = None
+    lobbyLink.report(free, waitingSince)
+
+
+# Owns who is playing, who is queued and who may rejoin, see matchmaker.py.
+matchmaker = Matchmaker(start_game, send_server_message, hand_to_lobby, RECONNECT_WAIT_SECS, start_bot_game, report=send_load)
+
+
+def enqueue(player):
+    # Somewhere for a player to go once they're connected and past the handshake.
+    if TOURNAMENT:
+        incoming.put(player)
+    else:
+        matchmaker.join(player)
+
+
+def room_name(playerOne, playerTwo):
+    return " vs ".join(sorted((playerOne["username"], playerTwo["username"])))
+
+
+def checkpoint_turn(nextPlayer, otherPlayer):
+    # Called by run_multi_player_round at the start of every turn.
+    if not checkpoints:
+        return
+    state = {
+        "turn": nextPlayer["username"],
+        "turn_started": time.time(),
+        "players": [{
+            "username": p["username"],
+            "token": p.get("token"),
+            "moves": p.get("moves", 0),
+            "board": p["board"].snapshot(),
+        } for p in (nextPlayer, otherPlayer)],
+    }
+    checkpoints.save(room_name(nextPlayer, otherPlayer), state)
+
+
+def find_resumable(username, token):
+    for room, state in restorable.items():
+        if any(p["username"] == username and p["token"] and secrets.compare_digest(p["token"], token) for p in state["players"]):
+            return room
+    return None
+
+
+def resume_player(player, room):
+    # Put a player back into the game they were in before the server went down, once both are back.
+    with resume_lock:
+        waiting = resuming.setdefault(room, [])
+        if room not in restorable or any(p["username"] == player["username"] for p in waiting):
+            # the token has already been used
+            send_server_message(player, "[SERVERINFO] That resume token isn't valid.")
+            player["connection"].close()
+            return
+        waiting.append(player)
+        if len(waiting) < 2:
+            send_server_message(player, "[SERVERINFO] Welcome back! Waiting for your opponent to rejoin...")
+            threading.Timer(RESUME_WAIT_SECS, abandon_resume, args=(room,)).start()
+            return
+        state = restorable.pop(room)
+        del resuming[room]
+    # whoever's turn it was goes first
+    ordered = sorted(waiting, key=lambda p: p["username"] != state["turn"])
+    # the turn they were on keeps running from where it was when the server went down (as far
+    # as we know: until we started), so resuming doesn't give whoever's turn it was a fresh clock
+    used = min(max(0, restoredAt - state["turn_started"]), TIMEOUT_SECS - RESUME_MIN_TURN_SECS)
+    saved = []
+    for p in ordered:
+        snapshot = next(s for s in state["players"] if s["username"] == p["username"])
+        p["moves"] = snapshot["moves"]
+        p["token"] = snapshot["token"]
+        saved.append({"owner": p["username"], "board": decode_snapshot(snapshot["board"]), "turn_used": used})
+    if matchmaker.resume(ordered, saved):
+        print(f"[SERVERINFO] Resuming {room} from its checkpoint.")
+        return
+    # a game has started here in the meantime, so this one can't be picked up
+    print(f"[SERVERINFO] Can't resume {room}, a game is already running.")
+    give_up_resume(room, ordered)
+
+
+def abandon_resume(room):
+    with resume_lock:
+        waiting = resuming.pop(room, None)
+        if not waiting:
+            return
+        restorable.pop(room, None)
+    give_up_resume(room, waiting)
+
+
+def give_up_resume(room, players):
+    if checkpoints:
+        checkpoints.finish(room)
+    for player in players:
+        send_server_message(player, "[SERVERINFO] Your old game couldn't be picked up, finding you a new one.")
+        enqueue(player)
 
 
 def prompt_replay(player, result_queue):
     try:
-        # set a timeout for the socket
-        player["connection"].settimeout(10)
         while True:
             player["writeFile"].write("[!] The game is over. Do you want to play again? [y/n]\n")
             player["writeFile"].flush()
-            try:
+            # no socket timeout for this: with one set, writes to the player would wait on it too
+            # (and not on the LineWriter's deadline)
+            if player["readFile"].poll(REPLAY_TIMEOUT_SECS):
                 response = player["readFile"].readline()
-            except socket.timeout:
+            else:
                 print(f"[REPLAY] Player {player['connection']} did not respond in time. Disconnecting")
                 result_queue.put((player, 'n'))
                 try:
@@ -67,54 +323,131 @@ def prompt_replay(player, result_queue):
                     player["connection"].close()
                 except:
                     pass
+                return
             if not response:
                 print(f"[REPLAY] No response from player {player['connection']}. Assuming 'n'.")
                 result_queue.put((player, 'n'))
                 return
-            response = response.strip().lower()
-            print(f"[REPLAY] Player {player['connection']} answered: {response}")
-            if response in ('y', 'n'):
-                result_queue.put((player, response))
+            print(f"[REPLAY] Player {player['connection']} answered: {response.strip()}")
+            stats_command = command_parser.stats(response)
+            if stats_command:
+                send_stats(player, stats_command)
+                continue
+            answer = command_parser.answer(response)
+            if type(answer) is CommandError:
+                kind = command_parser.kind_of(response)
+                if kind:
+                    # e.g. a shot queued up before the game ended: skip it and ask again
+                    player["writeFile"].write(f"[SERVERINFO] Ignored {kind} ('{response.strip()}'), the game is over.\n")
+                    continue
+                player["writeFile"].write(answer.message + "\n")
+                player["writeFile"].flush()
+            else:
+                result_queue.put((player, answer.reply))
                 print("input received.")
                 return
-            else:
-                player["writeFile"].write("Invalid input. Please type 'y' or 'n'.\n")
-                player["writeFile"].flush()
     except Exception as e:
         print(f"[SERVERINFO] Error while prompting replay: {e}")
         result_queue.put((player, 'n'))
-    finally:
-        # remove timeout so doesn't affect other reads
+
+def logging_shots(publish):
+    # onEvent for a game: publishes to its feed, and keeps everyone's shots in order for the endgame review
+    shots = {}
+
+    def on_event(event):
+        if event["type"] == "shot":
+            shots.setdefault(event["player"], []).append(command_parser.coordinate(event["cell"]))
+        publish(event)
+    return on_event, shots
+
+
+def send_review(players, shots):
+    # Tell whoever sank the other's fleet how their endgame compared with perfect play (solver.py).
+    if SALVO:
+        return
+    for winner, loser in (players, players[::-1]):
+        if winner.get("result") != "win" or winner.get("endReason") != "sunk" or "bot" in winner:
+            continue
+        board = loser["board"].snapshot()
         try:
-            player["connection"].settimeout(None)
-        except:
-            pass
+            found = review(board.size, board.layout, shots.get(winner["username"], []))
+        except Exception as e:
+            print(f"[SERVERERROR] Endgame review failed: {e}")
+            return
+        if found is None:
+            return
+        before, expected, taken = found
+        msg = f"[SERVERINFO] Endgame review: after your first {before} shots, perfect play needed {expected:.1f} more on average; you took {taken}."
+        fewer = round(taken - expected)
+        if fewer >= 1:
+            msg += f" You could have won in about {fewer} fewer shot{'s' if fewer != 1 else ''}."
+        send_server_message(winner, msg)
+
+
+def shots_fired(player, opponent):
+    # (shots, hits) of 'player' at the opponent's board
+    board = opponent.get("board")
+    if board is None:
+        return 0, 0
+    snapshot = board.snapshot()
+    return bin(snapshot.shots).count("1"), bin(snapshot.hits()).count("1")
+
+
+def record_result(players):
+    # Hand a decided game to the stats store (stats.py). Bot matches aren't ranked.
+    if not stats or any("bot" in p for p in players):
+        return
+    winner = next((p for p in players if p.get("result") == 'win'), None)
+    loser = next((p for p in players if p.get("result") == 'loss'), None)
+    if winner is None or loser is None:
+        return
+    stats.record(winner["username"], loser["username"], winner.get("endReason", "sunk"),
+                 shots_fired(winner, loser), shots_fired(loser, winner))
+
+
+def send_stats(player, command):
+    # 'STATS': the leaderboard and your own stats; 'STATS <player>': theirs. As JSON, like the spectator lines.
+    if not stats:
+        send_server_message(player, "[SERVERINFO] This server doesn't keep stats.")
+        return
+    lines = []
+    if command.player is None:
+        lines.append("[LEADERBOARD] " + json.dumps({"top": stats.leaderboard()}))
+    name = command.player or player["username"]
+    if name:
+        lines.append("[PLAYERSTATS] " + json.dumps(stats.player(name) or {"player": name}))
+    send_server_message(player, "\n".join(lines))
 
-def handle_game_clients(connectedPlayers):
-    global clients
-    global gameOver
-    # Get the queue of people waiting to play. 
-    global clientStorage
-    global recentDisconnect
-    global newGame
-    global gameStateOne
-    global gameStateTwo
-
-    for client in connectedPlayers:
+
+def handle_game_clients(players, saved=None):
+    # One game between the two players the matchmaker seated. 'saved' has their boards if
+    # it's picking up a game that was interrupted, instead of starting a new one.
+
+    for client in players:
         last_move_time[client["connection"]] = 0
+        client.pop("result", None)
+        client.pop("endReason", None)
+        if saved is None:
+            # so a game that ends before the new boards are placed isn't counted with the old ones
+            client.pop("board", None)
+    room = room_name(players[0], players[1])
 
     gameOverPrompt[0] = False
     
     def monitor_timeout(player, opponent):
 
-        while last_move_time[player["connection"]] == 0:
-            time.sleep(0.5)
+        while last_move_time.get(player["connection"]) == 0:
+            clock.sleep(0.5)
 
         while True:
-            time.sleep(1)
+            clock.sleep(1)
             if gameOverPrompt[0]:
                 break
-            if time.time() - last_move_time[player["connection"]] > TIMEOUT_SECS:
+            last_move = last_move_time.get(player["connection"])
+            if last_move is None:
+                # the game is over and has forgotten their connection
+                break
+            if clock.now() - last_move > TIMEOUT_SECS:
                 try:
                     player["writeFile"].write("[!] Timeout! You have forfeited. Disconnecting...\n")
                     player["writeFile"].flush()
@@ -129,275 +462,622 @@ def handle_game_clients(connectedPlayers):
                     pass
 
                 print(f"[SERVERINFO] Timeout for {player['connection']}. Forfeit...prompting.")
+                if not player.get("result"):
+                    player["result"], opponent["result"] = 'loss', 'win'
+                    player["endReason"] = opponent["endReason"] = 'timeout'
                 gameOverPrompt[0] = True
                 timeout_forfeit_occurred.set()
                 break
 
-    t1 = threading.Thread(target=monitor_timeout, args=(connectedPlayers[0], connectedPlayers[1]))
+    t1 = threading.Thread(target=monitor_timeout, args=(players[0], players[1]))
     t1.start()
-    while True: 
+    feed = open_match(players[0], players[1])
+    on_event, shots = logging_shots(feed.publish)
+    # what to pick up from if someone drops out
+    states = saved
+    try:
+        if saved is None:
+            start_msg = f"A new game has started between {players[0]['username']} and {players[1]['username']}! Others can watch by logging in as 'SPECTATE {feed.id}'."
+            send_all_message(start_msg)
+            states = run_multi_player_round(players[0], players[1], matchmaker.queued, True, False, False, onTurnEnd=checkpoint_turn, onEvent=on_event, salvo=SALVO)
+        else:
+            print("[INFO] A game has resumed on this server!")
+            states = run_multi_player_round(players[0], players[1], matchmaker.queued, False, saved[0], saved[1], onTurnEnd=checkpoint_turn, onEvent=feed.publish, salvo=SALVO)
+    except Exception as e:
+        print(f"[SERVERERROR] Error in game thread: {e}")
+        print("Someone disconnected. Prompting both users to see who it was. ")
+    finally: 
+        close_match(feed)
+        # a rematch or a restarted game puts them back; don't keep every connection ever seen
+        for client in players:
+            last_move_time.pop(client["connection"], None)
+
+    # A decided game doesn't need restoring after a crash.
+    if checkpoints and (timeout_forfeit_occurred.is_set() or any(p.get("result") for p in players)):
+        checkpoints.finish(room)
+
+    # played to the end (not cut short by someone dropping): no need to wait for anyone to rejoin
+    finished = any(p.get("result") and p.get("endReason") != "disconnect" for p in players)
+    if timeout_forfeit_occurred.is_set() or finished:
+        print("[SERVERINFO] Game finished or timeout forfeit occurred. Skipping reconnection wait")
+        timeout_forfeit_occurred.clear()
+        # the seats are free for whoever is queued while these two decide whether to go again
+        matchmaker.finished(players)
+        record_result(players)
+        if saved is None:
+            # (a resumed game's shots from before it stopped weren't seen here)
+            send_review(players, shots)
+        ask_replay(players)
+        return
+
+    still_connected = hold_seat(players, states)
+    if still_connected is None:
+        # the matchmaker has restarted the game
+        return
+    # nobody came back, so there's nothing to pick up after a restart either
+    if checkpoints:
+        checkpoints.finish(room)
+    if still_connected:
+        record_result(players)
+        ask_replay(still_connected)
+
+
+def hold_seat(players, states):
+    # A game cut short by a player dropping out: give them RECONNECT_WAIT_SECS to rejoin, and
+    # the matchmaker restarts the game from 'states' if they do (then this returns None).
+    # Otherwise they've forfeited, and this returns the players still here (maybe nobody).
+    # Check who we can send messages to, to figure out who is still connected.
+    still_connected = []
+    missing = None
+    for player in players:
         try:
-            if newGame:
-                #print("[INFO] A new game has started on this server!")
-                start_msg = f"A new game has started between {connectedPlayers[0]['username']} and {connectedPlayers[1]['username']}!"
-                send_all_message(start_msg)
-                gameStateOne, gameStateTwo = run_multi_player_round(connectedPlayers[0], connectedPlayers[1], clientStorage, newGame, False, False)
-            else:
-                print("[INFO] A game has resumed on this server!")
-                gameStateOne, gameStateTwo = run_multi_player_round(connectedPlayers[0], connectedPlayers[1], clientStorage, newGame, gameStateOne, gameStateTwo)
+            if player["readFile"].eof:
+                raise ConnectionError("Player disconnected")
+            player["writeFile"].write("[!] A client disconnected, waiting for them to rejoin...\n")
+            player["writeFile"].flush()
+            still_connected.append(player)
         except Exception as e:
-            print(f"[SERVERERROR] Error in game thread: {e}")
-            print("Someone disconnected. Prompting both users to see who it was. ")
-        finally: 
-            still_connected = []
-            toRemove = []
-
-            if timeout_forfeit_occurred.is_set():
-                print("[SERVERINFO] Timeout forfeit occurred. Skipping reconnection wait")
-                timeout_forfeit_occurred.clear()
-                still_connected = connectedPlayers[:]
-
-                result_queue = queue.Queue()
-                threads = []
-
-                for player in still_connected:
-                    t = threading.Thread(target=prompt_replay, args=(player, result_queue))
-                    t.start()
-                    threads.append(t)
-
-                for t in threads:
-                   t.join()
-
-                with pause_clients:
-                    connectedPlayers.clear()
-                    while not result_queue.empty():
-                        player, response = result_queue.get()
-                        if response == 'y':
-                            clientStorage.append(player)
-                            send_server_message(player, "[SERVERINFO] You've been added back to the queue.")
-                        else:
-                            try:
-                                player["connection"].shutdown(socket.SHUT_RDWR)
-                                player["connection"].close()
-                            except:
-                                pass
-                    
-                    print("Length of connected Players:", len(connectedPlayers), " and len of clientStorage: ", len(clientStorage))
-                    # If both current players don't want to replay ('n') and someone was waiting
-                    if len(clientStorage) == 1 and len(connectedPlayers) == 0:
-                        print("Someone was waiting in the queue, adding them to the game...")
-                        waiting_player = clientStorage.pop(0)
-                        connectedPlayers.append(waiting_player)
-                        print(f"[SERVERINFO] Added player: {waiting_player['username']}")
-                        send_server_message(waiting_player, "You've been added to the game!")
-                        send_server_message(waiting_player, "Waiting for another player to join the game...")
-
-                    # If both current players don't want to replay, and the queue has more than 2 ppl waiting
-                    elif len(clientStorage) >= 2:
-                        player1 = clientStorage.pop(0)
-                        player2 = clientStorage.pop(0)
-                        connectedPlayers.extend([player1, player2])
-                        timeout_forfeit_occurred.clear()
-                        print("[SERVERINFO] Starting next match with new players.")
-                        gameThread = threading.Thread(target=handle_game_clients, args=(connectedPlayers,))
-                        gameThread.start()
-                    
-                    # If both current players don't want to replay, and no one is in queue
-                    elif len(clientStorage) == 0 and len(connectedPlayers) == 0:
-                        print("[SERVERINFO] ")
+            print("[SERVERERROR] Could not send message to player.")
+            missing = player["username"]
+            try:
+                player["connection"].close()
+            except:
+                pass
+    if not still_connected:
+        matchmaker.finished(players)
+        return []
+    # Give them a chance to rejoin...
+    if matchmaker.pause(still_connected, missing, states):
+        return None
+    # they didn't come back: a forfeit (missing is always set here, with nobody missing the
+    # matchmaker restarts the game straight away)
+    for player in players:
+        player["result"] = 'loss' if player["username"] == missing else 'win'
+        player["endReason"] = 'disconnect'
+    return still_connected
 
 
-                return
-            
-            else:
-                #    Check who we can send messages to, to figure out who is still connected. 
-                for player in connectedPlayers:
-                    try:
-                        player["writeFile"].write("[!] A client disconnected, waiting for them to rejoin...\n")
-                        player["writeFile"].flush()
-                    except Exception as e:
-                        print("[SERVERERROR] Could not send message to player.")
-                        try:
-                            recentDisconnect = player["username"]
-                            player["connection"].close()
-                            toRemove.append(player)
-                        except:
-                            pass
-            for player in toRemove:
-                connectedPlayers.remove(player)
-            # Give them a chance to rejoin... 
-            time.sleep(10)
-            print("The len of connected players is: ", len(connectedPlayers))
-            # We update connectedPlayers during this time in the main thread...
-            recentDisconnect = None
-            if len(connectedPlayers) == 1:
-                # Prompt both players to see if they want to play again.
-                for player in connectedPlayers:
-                    while True:
-                        try:
-                            player["writeFile"].write("[!] The game is over. Do you want to play again? [y/n]\n")
-                            player["writeFile"].flush()
-                            prompt = player["readFile"].readline()
-                            if not prompt:
-                                raise ConnectionError("Player disconnected")
-                            prompt = prompt.strip().lower()
-                            if prompt == 'y':                                
-                                clientStorage.append(player)
-                                send_server_message(player, "[SERVERINFO] You've been added back to the queue.")
-                                break
-                            elif prompt == 'n':
-                                player["connection"].shutdown( socket.SHUT_RDWR)
-                                player["connection"].close()
-                                break
-                            else:
-                                player["writeFile"].write("Please type [y/n].\n")
-                                player["writeFile"].flush()
-                        except Exception as e:
-                            print("[SERVERINFO] Could not prompt player — assumed disconnected.")
-                            try:
-                                player["connection"].close()
-                            except:
-                                pass
-                            break
-                
-                # Threads keep mucking up these lists
-                with pause_clients: 
-                    connectedPlayers.clear()
-                    for player in still_connected:
-                        connectedPlayers.append(player)
-                        returning_players.put(player)
-                        # assume someone disconnected? 
-                        send_server_message(player, "Finding someone new to play a game with you!")
-
-                    if len(connectedPlayers) == 0 and len(clientStorage) >= 2:
-                        player1 = clientStorage.pop(0)
-                        player2 = clientStorage.pop(0)
-                        connectedPlayers.extend([player1, player2])
-                        timeout_forfeit_occurred.clear()
-                        print("[SERVERINFO] Starting next match with new players.")
-                        gameThread = threading.Thread(target=handle_game_clients, args=(connectedPlayers,))
-                        gameThread.start()
-
-                    else:
-                        
-                        #print("Length of connected Players:", len(connectedPlayers), " and len of clientStorage: ", len(clientStorage))
-                        while len(connectedPlayers) < 2 and len(clientStorage) > 0:
-                            newPlayerConnected = clientStorage.pop(0)
-                            connectedPlayers.append(newPlayerConnected)
-                            send_server_message(newPlayerConnected, "You've been added to the game!")
-                        if len(connectedPlayers) == 2:
-                            gameThread = threading.Thread(target=handle_game_clients, args=(connectedPlayers,))
-                            gameThread.start()
-                            print("[SERVERINFO] Game started on the server!")
+def play_bot_match(player):
+    # Like a tournament match, with its own game-over flag and turn timeout, so it can run alongside the main game.
+    bot = new_bot()
+    send_server_message(player, f"[SERVERINFO] Nobody else is free right now, so you'll play {bot['username']}, a computer player.")
+    player.pop("result", None)
+    player.pop("endReason", None)
+    feed = open_match(player, bot)
+    on_event, shots = logging_shots(feed.publish)
+    try:
+        run_multi_player_round(player, bot, [], True, False, False, [False], TIMEOUT_SECS, onEvent=on_event, salvo=SALVO)
+    except Exception as e:
+        print(f"[SERVERERROR] Error in bot match: {e}")
+    finally:
+        close_match(feed)
+        last_move_time.pop(bot["connection"], None)
+        last_move_time.pop(player["connection"], None)
+    if player["readFile"].eof or player.get("endReason") == "disconnect":
+        try:
+            player["connection"].close()
+        except OSError:
+            pass
+        return
+    send_review([player, bot], shots)
+    ask_replay([player])
 
-                break
 
-            # The player reconnected in this time, we added it straight to connectedPlayers. 
-            elif len(connectedPlayers) == 2:
-                newGame = False
-                print("Starting a new game with the same players, this should pick up from the last game.")
-                gameThread = threading.Thread(target=handle_game_clients, args=(connectedPlayers,))
-                gameThread.start()
-            break
+def ask_replay(players):
+    # Ask everyone at once whether they want another game; the ones who do go back in the queue.
+    result_queue = queue.Queue()
+    threads = []
 
+    for player in players:
+        t = threading.Thread(target=prompt_replay, args=(player, result_queue))
+        t.start()
+        threads.append(t)
 
+    for t in threads:
+       t.join()
 
+    while not result_queue.empty():
+        player, response = result_queue.get()
+        if response == 'y':
+            matchmaker.replay(player)
+        else:
+            try:
+                player["connection"].shutdown(socket.SHUT_RDWR)
+                player["connection"].close()
+            except:
+                pass
 
 
-def manage_queues():
+def register_for_tournaments():
+    # Replaces the matchmaker in tournament mode: everyone who connects signs up for the next event.
+    while True:
+        register(incoming.get())
 
-    global connectedPlayers, clientStorage, recentDisconnect, newGame
 
+def register(player):
+    with registration_open:
+        registered.append(player)
+        count = len(registered)
+        registration_open.notify()
+    send_server_message(player, f"[TOURNAMENT] You're registered for the next {TOURNAMENT} tournament ({count}/{ENTRANTS} players).")
 
-    # continuously manage the queues and games. 
 
-    while True: 
-        print("Length of connected Players:", len(connectedPlayers), " and len of clientStorage: ", len(clientStorage))
-        try: 
-            player = returning_players.get_nowait()
-            print("Added the returning player again!")
+def take_registered():
+    # Everyone signed up for the next event, for a reload to hand over.
+    with registration_open:
+        players = registered[:]
+        del registered[:]
+    while True:
+        try:
+            players.append(incoming.get_nowait())
         except queue.Empty:
-            player = incoming.get()
-            print("Pulled from regular queue.")
-
-        with pause_clients:
-
-            #while len(connectedPlayers) < 2 and len(clientStorage) > 0:
-            #    newPlayerConnected = clientStorage.pop(0)
-            #    connectedPlayers.append(newPlayerConnected)
-            #    send_server_message(newPlayerConnected, "You've been added to the game!")
-            # If there aren't enough players in the game. 
-            if len(connectedPlayers) < 2:
-                if len(clientStorage) != 0:
-                    print("Someone was waiting in the queue, adding them to the game and this connection to the queue.")
-                    newPlayerConnected = clientStorage.pop(0)
-                    connectedPlayers.append(newPlayerConnected)
-                    clientStorage.append(player)
-                    send_server_message(newPlayerConnected, "You've been added to the game!")
-                else: 
-                    print("Adding this new connection to the game, no one was waiting in the queue. ")
-                    connectedPlayers.append(player)
-
-                print("After sorting, length of connected Players:", len(connectedPlayers), " and len of clientStorage: ", len(clientStorage))
-                
-                if len(connectedPlayers) == 2:
-                    gameThread = threading.Thread(target=handle_game_clients, args=(connectedPlayers,))
-                    gameThread.start()
-                    print("[SERVERINFO] Game started on the server!")
-                elif len(connectedPlayers) == 1:
-                    send_server_message(player, "Waiting on another person to join the game...!")
-                else:
-                    pass
-            else:
-                if not any(p["username"] == player["username"] for p in connectedPlayers):
-                    print("[SERVERINFO] Game is in progress, adding this client to the queue. ")
-                    clientStorage.append(player)
-                    send_server_message(player, f"[SERVERINFO] Thanks for joining - game in progress between {connectedPlayers[0]['username']} and {connectedPlayers[1]['username']}, you'll join when someone disconnects or a new game starts. You can be a spectator for now!")
+            return players
 
 
+def has_left(player):
+    return player["connection"].fileno() == -1 or player["readFile"].eof
+
+
+def play_tournament_match(playerOne, playerTwo):
+    # Players who have already left lose by walkover.
+    for player, opponent in ((playerOne, playerTwo), (playerTwo, playerOne)):
+        if has_left(player):
+            send_server_message(opponent, f"[TOURNAMENT] {player['username']} has forfeited, you go through.")
+            return opponent
+    for player, opponent in ((playerOne, playerTwo), (playerTwo, playerOne)):
+        player.pop("result", None)
+        player.pop("endReason", None)
+        player.pop("board", None)
+        send_server_message(player, f"[TOURNAMENT] Your match against {opponent['username']} is starting!")
+    feed = open_match(playerOne, playerTwo)
+    try:
+        # each match has its own game-over flag, and forfeits on the usual turn timeout (and on
+        # taking too long to place ships: nobody else could evict an entrant who never does)
+        run_multi_player_round(playerOne, playerTwo, [], True, False, False, [False], TIMEOUT_SECS, onEvent=feed.publish, salvo=SALVO,
+                               placementTimeout=PLACEMENT_TIMEOUT_SECS)
+    except Exception as e:
+        print(f"[SERVERERROR] Error in tournament match: {e}")
+    finally:
+        close_match(feed)
+        last_move_time.pop(playerOne["connection"], None)
+        last_move_time.pop(playerTwo["connection"], None)
+    if not any(p.get("result") for p in (playerOne, playerTwo)):
+        # cut short before it was decided (e.g. someone hung up placing ships): whoever is
+        # still here goes through, and only if both are is it left to seeding
+        for player, opponent in ((playerOne, playerTwo), (playerTwo, playerOne)):
+            if has_left(player) and not has_left(opponent):
+                player["result"], opponent["result"] = 'loss', 'win'
+                player["endReason"] = opponent["endReason"] = 'disconnect'
+                send_server_message(opponent, f"[TOURNAMENT] {player['username']} has forfeited, you go through.")
+                break
+    record_result((playerOne, playerTwo))
+    for player in (playerOne, playerTwo):
+        if player.get("result") == 'win':
+            return player
+    return None
+
+
+def run_tournaments():
+    while True:
+        with registration_open:
+            while True:
+                # forget anyone who left while waiting for the event to fill up
+                for p in registered:
+                    if p["readFile"].eof:
+                        p["connection"].close()
+                registered[:] = [p for p in registered if p["connection"].fileno() != -1]
+                if draining:
+                    # no new events: drain_and_exit hands whoever is registered to the new process
+                    return
+                if len(registered) >= ENTRANTS:
+                    break
+                registration_open.wait(timeout=1)
+            entrants = registered[:ENTRANTS]
+            del registered[:ENTRANTS]
+
+        # named like a game thread, so a reload waits for the whole event to finish
+        event = threading.Thread(target=play_tournament, args=(entrants,), name="game")
+        event.start()
+        event.join()
+
+
+def play_tournament(entrants):
+    def announce(msg):
+        print(msg)
+        for player in entrants:
+            send_server_message(player, msg)
+
+    run_tournament(entrants, play_tournament_match, TOURNAMENT, announce)
+
+    # everyone still here is signed up for the next one (before this thread ends, so a reload
+    # waiting on it finds them registered)
+    for player in entrants:
+        if player["connection"].fileno() == -1:
+            continue
+        # nobody reads from them between matches: see whether they've hung up
+        player["readFile"].drain()
+        if not player["readFile"].eof:
+            register(player)
+
+
+def hand_off(player, link):
+    # Pass this player's socket to another process (the lobby, or a new server taking over from a reload).
+    # Returns False if they should stay here instead.
+    heartbeats.unregister(player)
+    pending = player["readFile"].take_buffered()
+    try:
+        link.hand_off(player["connection"], player["username"], pending)
+    except OSError as e:
+        print(f"[SERVERERROR] Could not hand {player['username']} over: {e}")
+        player["readFile"] = player_reader(player["connection"], player["writeFile"], initial=pending)
+        heartbeats.register(player)
+        return False
+    print(f"[SERVERINFO] Handed {player['username']} over to another process.")
+    # the other process has its own copy of the connection now
+    player["connection"].close()
+    return True
+
+
+def adopt_player(conn, username, pending, note, **extra):
+    # A player handed to us by another process; they've already done the handshake.
+    writeFile = LineWriter(conn, WRITE_DEADLINE_SECS, MAX_OUTBOUND_BYTES)
+    player = {
+     "connection": conn,
+     "readFile": player_reader(conn, writeFile, initial=pending),
+     "writeFile": writeFile,
+     "username": username,
+     **extra
+    }
+    heartbeats.register(player)
+    send_server_message(player, note)
+    enqueue(player)
+
+
+def seat_from_lobby(conn, username, pending):
+    adopt_player(conn, username, pending, "[SERVERINFO] You've been moved to a room with a free seat.", from_lobby=True)
+
+
+def seat_from_old_server(conn, username, pending):
+    adopt_player(conn, username, pending, "[SERVERINFO] The server has been updated, you're still in the queue.")
 
-def handle_new_connection(conn, addr):
-    global connectedPlayers, clientStorage, recentDisconnect, newGame
-    #global gameStateOne, gameStateTwo
 
+def release_to_lobby():
+    # The lobby wants our lone waiting player so they can be paired with one on another worker.
+    matchmaker.release()
+
+
+def report_to_lobby():
+    while True:
+        # sent from the matchmaker's thread, see send_load
+        matchmaker.report()
+        time.sleep(1)
+
+
+def report_to_gateway():
+    # Send this node's load to the gateway once a second, reconnecting if the gateway restarts.
+    host, port = GATEWAY.rsplit(":", 1)
+    while True:
+        try:
+            with socket.create_connection((host, int(port))) as link:
+                print(f"[SERVERINFO] Reporting load to gateway {GATEWAY}")
+                while True:
+                    lobby = matchmaker.state
+                    players = len(lobby.seated) + len(lobby.waiting)
+                    free = max(0, 2 - players)
+                    report = {"type": "load", "address": [HOST, PORT], "unix": UNIX_SOCKET, "players": players, "free": free}
+                    link.sendall((json.dumps(report) + "\n").encode("utf-8"))
+                    time.sleep(1)
+        except OSError as e:
+            print(f"[SERVERERROR] Lost gateway {GATEWAY}: {e}")
+            time.sleep(1)
+
+
+def handle_new_connection(conn, addr):
     print(f"[SERVERINFO] New connection from {addr}")
-    writeFile = conn.makefile('w')
-    readFile = conn.makefile('r')
-    writeFile.write(f"Enter your username: \n")
-    writeFile.flush()
-    username = readFile.readline().strip()
-    writeFile.write(f"Hello {username}, welcome to the game!\n")
-    writeFile.flush()
+    writeFile = LineWriter(conn, WRITE_DEADLINE_SECS, MAX_OUTBOUND_BYTES)
+    readFile = player_reader(conn, writeFile, capture=recorder.session() if recorder else None)
+    try:
+        writeFile.write(f"Enter your username: \n")
+        writeFile.flush()
+        # Don't let a client that never sends its username hold a handshake slot forever: this is
+        # a deadline for the whole line, so trickling it in a byte at a time doesn't reset it.
+        if not readFile.poll(HANDSHAKE_TIMEOUT_SECS):
+            raise TimeoutError(f"No username within {HANDSHAKE_TIMEOUT_SECS}s")
+        username = readFile.readline().strip()
+        if not username:
+            raise ConnectionError("No username sent")
+        # 'SPECTATE [id]' watches a match instead of playing
+        if username.upper().split()[0] == "SPECTATE":
+            spectator = {"connection": conn, "readFile": readFile, "writeFile": writeFile, "username": f"spectator@{addr[0]}:{addr[1]}"}
+            if spectate(spectator, username):
+                heartbeats.register(spectator)
+            else:
+                conn.close()
+            return
+        # 'STATS [player]' looks at the leaderboard without joining
+        stats_command = command_parser.stats(username)
+        if stats_command:
+            send_stats({"writeFile": writeFile, "username": None}, stats_command)
+            conn.close()
+            return
+        # 'RESUME <username> <token>' gets a player back into a game saved before a restart
+        resumeRoom = None
+        token = None
+        if username.upper().startswith("RESUME "):
+            parts = username.split()
+            with resume_lock:
+                resumeRoom = find_resumable(parts[1], parts[2]) if len(parts) == 3 else None
+            if resumeRoom is None:
+                # not a way in under someone else's name
+                writeFile.write("[SERVERINFO] That resume token isn't valid.\n")
+                writeFile.flush()
+                conn.close()
+                return
+            username, token = parts[1], parts[2]
+        writeFile.write(f"Hello {username}, welcome to the game!\n")
+        if checkpoints:
+            # this connection's own, so logging in under the same name doesn't replace it
+            token = token or secrets.token_hex(16)
+            writeFile.write(f"[SERVERINFO] Your resume token is {token}. If the server restarts mid-game, enter 'RESUME {username} {token}' as your username to get back in.\n")
+        writeFile.flush()
+    except (OSError, ValueError) as e:
+        print(f"[SERVERINFO] Handshake with {addr} failed: {e}")
+        try:
+            conn.close()
+        except OSError:
+            pass
+        return
+    finally:
+        admission.handshake_done()
+
     player = {
      "connection": conn,
-     "readFile": conn.makefile('r'),
-     "writeFile": conn.makefile('w'),
-     "username": username
+     "readFile": readFile,
+     "writeFile": writeFile,
+     "username": username,
+     "token": token
     }
-    """
-    # need logic for restoring the gameState's
-    # encountering: [SERVERERROR] Error in game thread: 'board'
-    if username == gameStateOne.get("username", ""):
-        for key in ["board", "opponentBoard", "shots"]:
-            if key in gameStateOne:
-                player[key] = gameStateOne[key]
-    elif username == gameStateTwo.get("username", ""):
-        for key in ["board", "opponentBoard", "shots"]:
-            if key in gameStateTwo:
-                player[key] = gameStateTwo[key]
+    heartbeats.register(player)
+    if resumeRoom:
+        resume_player(player, resumeRoom)
+        return
+    # if a paused game is waiting for this username, the matchmaker puts them back into it
+    enqueue(player)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Battleship server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG, help="listen() backlog for pending connections")
+    parser.add_argument("--max-players", type=int, default=MAX_PLAYERS, help="live connections before new ones are turned away")
+    parser.add_argument("--max-handshakes", type=int, default=MAX_HANDSHAKES, help="handshakes allowed in flight at once")
+    parser.add_argument("--handshake-timeout", type=float, default=HANDSHAKE_TIMEOUT_SECS, help="seconds a client gets to send its username")
+    parser.add_argument("--max-line", type=int, default=MAX_LINE_LENGTH, help="longest line accepted from a client, in bytes")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING_LINES, help="commands a client may send ahead of being asked")
+    parser.add_argument("--write-deadline", type=float, default=WRITE_DEADLINE_SECS, help="seconds a client may keep a write waiting before it's disconnected")
+    parser.add_argument("--max-outbound", type=int, default=MAX_OUTBOUND_BYTES, help="bytes that may be waiting to reach a client before it's disconnected")
+    parser.add_argument("--max-per-ip", type=int, default=MAX_CONNECTIONS_PER_IP, help="live connections allowed from one IP")
+    parser.add_argument("--connect-rate", type=float, default=CONNECT_RATE, help="new connections per second allowed from one IP")
+    parser.add_argument("--connect-burst", type=int, default=CONNECT_BURST, help="connections one IP may open in a burst")
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL, help="seconds of silence before a PING is sent")
+    parser.add_argument("--heartbeat-misses", type=int, default=HEARTBEAT_MISSES, help="unanswered intervals before a peer is dropped")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes sharing the port (more than 1 starts the supervisor)")
+    parser.add_argument("--lobby-socket", default=LOBBY_SOCKET, help="Unix socket the workers use to reach the lobby")
+    parser.add_argument("--bot-after", type=float, default=BOT_AFTER_SECS, help="seconds a player waits for an opponent before being given a bot (0 for never)")
+    parser.add_argument("--salvo", action="store_true", help="play salvo rules: one shot per ship left each turn")
+    parser.add_argument("--tournament", choices=FORMATS, default=TOURNAMENT, help="run bracketed events instead of normal matchmaking")
+    parser.add_argument("--entrants", type=int, default=ENTRANTS, help="players per tournament")
+    parser.add_argument("--checkpoint-file", default=CHECKPOINT_FILE, help="memory-mapped file to checkpoint games to, and restore them from on startup")
+    parser.add_argument("--stats-db", default=STATS_DB, help="SQLite file to keep player stats and the leaderboard in (players can then send STATS)")
+    parser.add_argument("--takeover", default=TAKEOVER, help=argparse.SUPPRESS)
+    parser.add_argument("--gateway", default=GATEWAY, help="HOST:PORT of a gateway control port to report load to (cluster mode)")
+    parser.add_argument("--http-port", type=int, default=HTTP_PORT, help="serve a read-only HTTP/SSE feed of running matches on this port")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="where profiling output (SIGUSR1, SIGUSR2, admin socket) is written")
+    parser.add_argument("--capture-file", default=CAPTURE_FILE, help="record every line players send, with timestamps, for replay.py")
+    parser.add_argument("--unix-socket", default=UNIX_SOCKET, help="also accept players on this Unix socket (for bots and tools on this host)")
+    parser.add_argument("--unix-socket-mode", type=lambda mode: int(mode, 8), default=UNIX_SOCKET_MODE, help="permissions for the Unix socket file, in octal (default 660)")
+    parser.add_argument("--admin-socket", default=ADMIN_SOCKET, help="Unix socket to accept profiling commands on (start, stop, stacks, memory, status)")
+    return parser.parse_args(argv)
 
-    """
 
-    with pause_clients:
-        if player["username"] == recentDisconnect:
-            connectedPlayers.append(player)
-            print("Added the returning player again!")
-            newGame = False
+def configure(args):
+    global HOST, PORT, LISTEN_BACKLOG, HANDSHAKE_TIMEOUT_SECS, MAX_LINE_LENGTH, WORKERS, LOBBY_SOCKET, GATEWAY, TOURNAMENT, ENTRANTS, TAKEOVER, CHECKPOINT_FILE, STATS_DB, HTTP_PORT, ADMIN_SOCKET, CAPTURE_FILE, SALVO, BOT_AFTER_SECS, MAX_PENDING_LINES, WRITE_DEADLINE_SECS, MAX_OUTBOUND_BYTES, UNIX_SOCKET, UNIX_SOCKET_MODE, admission
+    HOST, PORT = args.host, args.port
+    LISTEN_BACKLOG = args.backlog
+    HANDSHAKE_TIMEOUT_SECS = args.handshake_timeout
+    MAX_LINE_LENGTH = args.max_line
+    MAX_PENDING_LINES = args.max_pending
+    WRITE_DEADLINE_SECS = args.write_deadline
+    MAX_OUTBOUND_BYTES = args.max_outbound
+    admission = AdmissionController(args.max_players, args.max_handshakes, args.max_per_ip, args.connect_rate, args.connect_burst)
+    heartbeats.interval = args.heartbeat_interval
+    heartbeats.misses = args.heartbeat_misses
+    WORKERS = args.workers
+    LOBBY_SOCKET = args.lobby_socket
+    GATEWAY = args.gateway
+    TOURNAMENT = args.tournament
+    SALVO = args.salvo
+    BOT_AFTER_SECS = matchmaker.bot_after = args.bot_after
+    TAKEOVER = args.takeover
+    CHECKPOINT_FILE = args.checkpoint_file
+    STATS_DB = args.stats_db
+    ENTRANTS = max(2, args.entrants)
+    HTTP_PORT = args.http_port
+    profiler.directory = args.profile_dir
+    ADMIN_SOCKET = args.admin_socket
+    CAPTURE_FILE = args.capture_file
+    UNIX_SOCKET = args.unix_socket
+    UNIX_SOCKET_MODE = args.unix_socket_mode
+    admission.trusted.add(UNIX_PEER)
+    if GATEWAY:
+        gateway_ip = socket.gethostbyname(GATEWAY.rsplit(":", 1)[0])
+        if ipaddress.ip_address(gateway_ip).is_loopback:
+            # trusting 127.0.0.1 would let anyone on this host past the per-IP limits: a gateway
+            # here reaches us through the Unix socket instead (reported to it, see report_to_gateway)
+            if not UNIX_SOCKET:
+                print("[SERVERINFO] The gateway is on this host but there's no --unix-socket, so its players count against the per-IP limits.")
         else:
-            newGame = True
-            incoming.put(player)
+            # every player proxied by the gateway arrives from its address (it limits them per IP itself)
+            admission.trusted.add(gateway_ip)
+
+
+def request_reload(signum, frame):
+    # SIGHUP: starting the new server takes a while, so it's done on a thread of its own rather
+    # than in the signal handler, and the accept loop carries on until it's ready.
+    global reloading
+    if draining or reloading:
+        return
+    reloading = True
+    threading.Thread(target=reload, name="reload", daemon=True).start()
+
 
-def main():
+def reload():
+    # Start a new server process and give it our listening socket and idle players.
+    global draining, handover, reloading
+    print("[SERVERINFO] Reload requested, starting the new server...")
+    try:
+        handover = Handover(HANDOVER_PATH)
+        handover.start_successor()
+        handover.send_listener(listener)
+    except OSError as e:
+        print(f"[SERVERERROR] Reload failed, carrying on as we were: {e}")
+        handover = None
+        reloading = False
+        return
+    draining = True
+    # wake the accept loop, which then closes our copy of the listening socket
+    os.write(wake_accept[1], b"x")
+
+
+def drain_and_exit():
+    # After a reload: keep passing idle players to the new process until our last game is over.
+    while True:
+        game_running = any(t.name == "game" and t.is_alive() for t in threading.enumerate())
+        # (the matchmaker isn't running in tournament mode)
+        idle = matchmaker.drain(seated=not game_running) if not TOURNAMENT else take_registered()
+        for player in idle:
+            hand_off(player, handover)
+        if not game_running:
+            break
+        time.sleep(0.5)
+    if checkpoints:
+        # our last games' finishes, written before the new process opens the file
+        checkpoints.close()
+    handover.done()
+    if stats:
+        # results from our last games, which the writer thread may not have got to
+        stats.write_pending()
+    print("[SERVERINFO] Handover complete, old server exiting.")
+    os._exit(0)
+
+
+def run_worker(worker_id, lobby_path):
+    # Runs in a child process started by the supervisor; configure() has already run in the parent.
+    global lobbyLink
+    print(f"[SERVERINFO] Worker {worker_id} starting.")
+    lobbyLink = LobbyLink(lobby_path, seat_from_lobby, release_to_lobby)
+    lobbyLink.start()
+    threading.Thread(target=report_to_lobby, daemon=True).start()
+    run_server(reuse_port=True)
+
+
+def open_unix_listener(path, mode):
+    # Bound before any workers are forked, so they all accept from the one socket.
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # create the socket file with the right permissions from the start
+    old_umask = os.umask(0o777 & ~mode)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    # in case the umask above isn't honoured for sockets on this platform
+    os.chmod(path, mode)
+    sock.listen(LISTEN_BACKLOG)
+    print(f"[SERVERINFO] Also listening on {path} (mode {mode:o})")
+    return sock
+
+
+def serve_unix(sock):
+    # Accept loop for the Unix socket, alongside the TCP one in run_server.
+    while True:
+        try:
+            conn, _ = sock.accept()
+        except OSError:
+            if draining:
+                return
+            raise
+        # no address to go by, so name the connection after the process on the other end
+        pid, _, _ = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+        accept_connection(conn, (UNIX_PEER, pid), UNIX_PEER)
+
+
+def accept_connection(conn, addr, peer):
+    print(f"[SERVERINFO] Connection received from {addr}")
+
+    # Turn the connection away now rather than starting a thread we can't afford.
+    retry_after = admission.admit(conn, peer)
+    if retry_after:
+        print(f"[SERVERINFO] Rejected {addr}, asked to retry in {retry_after}s ({admission.rejected} rejected so far).")
+        reject(conn, retry_after)
+        return
+
+    handle_conn_thread = threading.Thread(target=handle_new_connection, args=(conn, addr,))
+    handle_conn_thread.start()
+    # I needed to add all of this to a separate thread, as we were getting stuck waiting for a new connection before proceeding to 
+    # shuffle the queues when a new game started. 
+
+
+def main(argv=None):
+    global unix_listener
+    configure(parse_args(argv))
+    if UNIX_SOCKET:
+        unix_listener = open_unix_listener(UNIX_SOCKET, UNIX_SOCKET_MODE)
+    if WORKERS > 1:
+        run_supervisor(WORKERS, LOBBY_SOCKET, run_worker)
+    else:
+        run_server()
+
+
+def open_checkpoints():
+    # Find the games that can be resumed and start checkpointing. After a reload this waits
+    # for the old process to finish with the file (see reload.py).
+    global checkpoints, restorable, restoredAt
+    store = CheckpointStore(CHECKPOINT_FILE)
+    rooms = store.load()
+    with resume_lock:
+        restoredAt = time.time()
+        restorable = rooms
+    if rooms:
+        print(f"[SERVERINFO] {len(rooms)} game(s) can be resumed from {CHECKPOINT_FILE}.")
+    store.start()
+    checkpoints = store
+
+
+def run_server(reuse_port=False):
 
 
     """
@@ -407,40 +1087,84 @@ def main():
     ALL at the same time ???
     """
 
-    global clientStorage 
-    global connectedPlayers
-    global recentDisconnect
-    recentDisconnect = None
-    connectedPlayers = []
-    # for waiting players
-    clientStorage = []
     clients = 0
     
-    print(f"[INFO] Server listening on {HOST}:{PORT}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen(2)
+    global listener, recorder, stats
+    if CAPTURE_FILE:
+        recorder = Recorder(CAPTURE_FILE)
+        print(f"[SERVERINFO] Capturing player input to {CAPTURE_FILE}")
+    if CHECKPOINT_FILE and not TAKEOVER:
+        open_checkpoints()
+    if STATS_DB:
+        stats = StatsStore(STATS_DB)
+        stats.start()
+
+    if TAKEOVER:
+        # Started by a reload: the old server passes us its listening socket, so the port never closes.
+        # the old process keeps checkpointing its games until it's done with them
+        listener = take_over(TAKEOVER, seat_from_old_server, open_checkpoints if CHECKPOINT_FILE else None)
+        print(f"[INFO] Took over listening on {HOST}:{PORT}")
+    else:
+        print(f"[INFO] Server listening on {HOST}:{PORT}")
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # so a restarted server (e.g. after a crash, to resume checkpointed games) can bind straight away
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # every worker binds the same port, and the kernel shares new connections out between them
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind((HOST, PORT))
+        listener.listen(LISTEN_BACKLOG)
+    if not reuse_port:
+        signal.signal(signal.SIGHUP, request_reload)
+    signal.signal(signal.SIGUSR1, profiler.on_signal)
+    signal.signal(signal.SIGUSR2, profiler.on_signal)
+    if ADMIN_SOCKET:
+        # workers each get their own socket
+        profiler.serve_admin(ADMIN_SOCKET if not reuse_port else f"{ADMIN_SOCKET}.{os.getpid()}")
+    if HTTP_PORT:
+        try:
+            WebFeed().start(HOST, HTTP_PORT)
+        except OSError as e:
+            # e.g. another worker, or the process we're taking over from, already has the port
+            print(f"[SERVERERROR] Could not serve the match feed on port {HTTP_PORT}: {e}")
+
+    with listener as s:
         print("[SERVERINFO] Listening for clients, waiting for at least 2 to start game...")
         started = False
     
         # Each conn should be unique?? So we can store them here? 
         storeConns = []
         # Don't start the game until we at least have 2
-        manage_queue_thread = threading.Thread(target=manage_queues)
-        manage_queue_thread.start()
+        if TOURNAMENT:
+            threading.Thread(target=register_for_tournaments, daemon=True).start()
+            threading.Thread(target=run_tournaments, daemon=True).start()
+        else:
+            matchmaker.start()
+        heartbeats.start()
+        if GATEWAY:
+            threading.Thread(target=report_to_gateway, daemon=True).start()
+        if unix_listener:
+            threading.Thread(target=serve_unix, args=(unix_listener,), daemon=True).start()
 
         while True: 
 
             print("[SERVERINFO] Main thread is listening for new connections!")
-            # Listen for a new incoming request
+            # Listen for a new incoming request (or the reload thread saying it's handed over)
+            ready, _, _ = select.select([s, wake_accept[0]], [], [])
+            if draining:
+                break
+            if s not in ready:
+                continue
             conn, addr = s.accept()
 
-            print(f"[SERVERINFO] Connection received from {addr}")
+            accept_connection(conn, addr, addr[0])
+
+    # the listening socket now belongs to the process that took over from us (closing our copy
+    # doesn't close theirs), and it has bound its own Unix socket in place of ours
+    if unix_listener:
+        unix_listener.close()
+
+    drain_and_exit()
 
-            handle_conn_thread = threading.Thread(target=handle_new_connection, args=(conn, addr,))
-            handle_conn_thread.start()
-            # I needed to add all of this to a separate thread, as we were getting stuck waiting for a new connection before proceeding to 
-            # shuffle the queues when a new game started. 
-        
 if __name__ == "__main__":
     main()
@@ -0,0 +1,265 @@
+"""
+simulate.py
+
+Plays whole matches against the real game logic with no sockets, threads or waiting, for fast
+regression and fuzz testing of the server's state machine.
+
+Each match runs run_multi_player_round between two simulated clients, connected with
+memtransport.py, on a clock.VirtualClock. The clients answer prompts after random "thinking"
+delays, and each may, at random, send junk, quit, go silent (and time out), hang up, come back
+after hanging up, and answer the replay prompt with y, n or nothing (server.prompt_replay).
+Some send commands ahead of being asked: all their ships at once (after a shot the server
+should turn away), and their replay answer as soon as they see the game end.
+
+A hang-up mid-game goes through the server's own reconnect path: server.hold_seat() pauses the
+game in a Matchmaker (run inline, on the virtual clock), and a player who comes back joins it
+again, within server.RECONNECT_WAIT_SECS (the game is restarted from its saved boards) or too
+late (they forfeit).
+
+After every match the outcome is checked, e.g. exactly one winner and one loser for a decided
+game, the loser's fleet really is sunk when the game ended that way, a resumed game gets the
+boards it was saved with, and every replay prompt produces exactly one answer.
+
+    python simulate.py --matches 10000 --seed 1
+    python simulate.py --matches 10000 --salvo        (salvo rules, see Board.fire_many)
+"""
+
+import argparse
+import contextlib
+import io
+import queue
+import random
+import time
+from collections import Counter
+
+import clock
+import memtransport
+import server
+from matchmaker import Matchmaker
+from battleship import Board, SHIPS, BOARD_SIZE, DisconnectError, run_multi_player_round
+from shared import last_move_time
+
+CELLS = [f"{chr(ord('A') + r)}{c + 1}" for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+
+
+class SimClient:
+    """A scripted player. Reacts to the server's prompts the way client.py's user would."""
+
+    def __init__(self, name, sim_clock, rng, server_timeout):
+        self.name = name
+        self.clock = sim_clock
+        self.rng = rng
+        # what this player will get up to, decided up front
+        self.think = rng.choice([0.1, 1.0, 3.0])
+        self.junk_rate = rng.choice([0.0, 0.0, 0.1])
+        self.quit_at = rng.choice([None] * 8 + [rng.randrange(1, 60)])
+        self.silent_at = rng.choice([None] * 8 + [rng.randrange(1, 60)])
+        self.drop_at = rng.choice([None] * 8 + [rng.randrange(1, 60)])
+        self.rejoins = rng.random() < 0.5
+        self.replay = rng.choice(['y', 'n', None, 'maybe'])
+        # sends commands before being asked: all its ships at once, its replay answer early
+        self.pipeline = rng.random() < 0.3
+        # placement prompts already answered by commands sent ahead
+        self.answered_ahead = 0
+        self.server_timeout = server_timeout
+        self.shots = self.rng.sample(CELLS, len(CELLS))
+        self.turns = 0
+        # shots asked for on the current turn
+        self.salvo = 1
+        self.player = None
+        self.connect()
+
+    def connect(self):
+        self.player = memtransport.connect(self.name, self.clock, self.receive)
+        plan = Board(BOARD_SIZE)
+        plan.place_ships_randomly(SHIPS)
+        self.placements = [f"PLACE {chr(ord('A') + row)}{col + 1} {'H' if orientation == 0 else 'V'} {name}"
+                           for name, row, col, _, orientation in plan.layout]
+        return self.player
+
+    def say(self, line, delay=None):
+        reader = self.player["readFile"]
+        delay = self.rng.uniform(0, self.think) if delay is None else delay
+        self.clock.call_later(delay, lambda: reader.deliver(line))
+
+    def say_ahead(self, lines):
+        # several lines in one go, in order
+        reader = self.player["readFile"]
+        self.clock.call_later(self.rng.uniform(0, self.think), lambda: [reader.deliver(line) for line in lines])
+
+    def receive(self, text):
+        # one flush from the server: a board needs no answer, skip it without splitting
+        if text.startswith("GRID"):
+            return
+        if text.count("\n") == 1:
+            self.react(text[:-1])
+        else:
+            for line in text.splitlines():
+                self.react(line)
+
+    def react(self, line):
+        # most lines are results that need no answer, skip them cheaply
+        first = line[:1]
+        if first not in ("E", "I", "[", "C", "Y") or line.startswith("[SERVERINFO]"):
+            return
+        if line.startswith("Enter placement command"):
+            if self.answered_ahead:
+                self.answered_ahead -= 1
+            elif self.pipeline and self.placements:
+                # with a shot first, which the server should turn away as too early
+                self.say_ahead(["B5"] + self.placements)
+                self.answered_ahead = len(self.placements)
+                self.placements = []
+            else:
+                self.say(self.placements.pop(0) if self.placements else "PLACE A1 H CARRIER")
+        elif line.startswith("It's your turn!") or line.startswith("Invalid input:"):
+            # (not the replay prompt's "Invalid input. Please type 'y' or 'n'.")
+            if line.startswith("It's your turn!"):
+                self.turns += 1
+                # salvo prompts say how many shots: "Enter 2 coordinates to fire at"
+                words = line.split()
+                self.salvo = int(words[4]) if words[4].isdigit() else 1
+            if self.turns == self.drop_at:
+                self.clock.call_later(self.rng.uniform(0, self.think), self.player["readFile"].hang_up)
+            elif self.turns == self.silent_at:
+                pass
+            elif self.turns == self.quit_at:
+                self.say("quit")
+            elif self.rng.random() < self.junk_rate:
+                self.say(self.rng.choice(["", "Z9", "A11", "hello", "K1", "B", "PLACE A1 H CARRIER", "A1 A1"]))
+            else:
+                self.say(" ".join(self.shots.pop() if self.shots else "A1" for _ in range(self.salvo)))
+        elif self.pipeline and self.replay in ('y', 'n') and (line.startswith("Congratulations!") or "You win" in line):
+            # answer the replay prompt before it's asked
+            self.say(self.replay)
+            self.replay = None
+        elif "Do you want to play again" in line:
+            if self.replay == 'maybe':
+                # an invalid answer first, then a real one
+                self.replay = 'y'
+                self.say("maybe")
+            elif self.replay:
+                self.say(self.replay)
+
+
+class SimulationError(AssertionError):
+    pass
+
+
+def check(condition, msg):
+    if not condition:
+        raise SimulationError(msg)
+
+
+def play_match(rng, timeout, salvo=False):
+    """Simulate one match, check it, and return a short description of how it went."""
+    sim_clock = clock.VirtualClock()
+    previous = clock.use(sim_clock)
+    # games the matchmaker (re)starts, as (players, saved boards)
+    restarts = []
+    matchmaker = Matchmaker(lambda players, saved: restarts.append((players, saved)) or True,
+                            server.send_server_message, rejoin_secs=server.RECONNECT_WAIT_SECS, inline=True)
+    previous_matchmaker, server.matchmaker = server.matchmaker, matchmaker
+    one = SimClient("one", sim_clock, rng, timeout)
+    two = SimClient("two", sim_clock, rng, timeout)
+    events = []
+    try:
+        gameOver = [False]
+        try:
+            saved = run_multi_player_round(one.player, two.player, [], True, False, False, gameOver, timeout, onEvent=events.append, salvo=salvo)
+        except DisconnectError:
+            # a hang-up while placing ships, nothing to resume
+            check(not any(e["type"] == "shot" for e in events), "shots published before the boards were placed")
+            return "dropped while placing"
+
+        ended = [e for e in events if e["type"] == "end"]
+        check(gameOver[0], "game loop returned without setting the game-over flag")
+        check(len(ended) == 1, f"{len(ended)} end events")
+        results = sorted(p.get("result") or "" for p in (one.player, two.player))
+        check(results == ['loss', 'win'], f"results {results}")
+        reason = ended[0]["reason"]
+        loser = one.player if one.player["result"] == 'loss' else two.player
+        if reason == "sunk":
+            check(loser["board"].all_ships_sunk(), "winner declared but the loser still has ships")
+
+        if reason == "disconnect" and saved:
+            gone = one if one.player["readFile"].eof else two
+            if gone.rejoins:
+                # sometimes after their seat has been given up
+                gone.drop_at = None
+                sim_clock.call_later(rng.uniform(0, 1.5 * server.RECONNECT_WAIT_SECS), lambda: matchmaker.join(gone.connect()))
+            players = [one.player, two.player]
+            paused_at = sim_clock.time()
+            still_connected = server.hold_seat(players, saved)
+            if still_connected is None:
+                check(len(restarts) == 1, f"{len(restarts)} games restarted")
+                seated, (savedOne, savedTwo) = restarts[0]
+                check(gone.player in seated, "restarted without the player who came back")
+                check(sim_clock.time() - paused_at <= server.RECONNECT_WAIT_SECS, "seat held past the reconnect wait")
+                for p in seated:
+                    p.pop("result", None)
+                events.clear()
+                run_multi_player_round(seated[0], seated[1], [], False, savedOne, savedTwo, [False], timeout, onEvent=events.append, salvo=salvo)
+                matchmaker.finished(seated)
+                for snap in (savedOne, savedTwo):
+                    player = one.player if snap["owner"] == "one" else two.player
+                    check(player["board"].snapshot().layout == snap["board"].layout, "resumed game has the wrong ships")
+                reason = "resumed, then " + next(e["reason"] for e in events if e["type"] == "end")
+            elif still_connected:
+                check(not restarts, "game restarted but the seat was given up")
+                check(gone.player["result"] == 'loss', "player who didn't come back didn't forfeit")
+                # (give or take float rounding of the virtual time)
+                check(sim_clock.time() - paused_at > server.RECONNECT_WAIT_SECS - 1e-6, "seat given up before the reconnect wait was over")
+                reason = "disconnect, didn't come back in time"
+
+        answers = queue.Queue()
+        asked = [p for p in (one.player, two.player) if not p["connection"].closed and not p["readFile"].eof]
+        for p in asked:
+            server.prompt_replay(p, answers)
+        check(answers.qsize() == len(asked), f"{answers.qsize()} replay answers for {len(asked)} players")
+        return reason
+    finally:
+        clock.use(previous)
+        server.matchmaker = previous_matchmaker
+        for client in (one, two):
+            last_move_time.pop(client.player["connection"], None)
+
+
+def run(matches, seed=0, timeout=10, verbose=False, salvo=False):
+    rng = random.Random(seed)
+    # boards are placed with the random module
+    random.seed(seed)
+    outcomes = Counter()
+    failures = []
+    started = time.time()
+    for i in range(matches):
+        log = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log):
+                outcomes[play_match(rng, timeout, salvo)] += 1
+        except Exception as e:
+            failures.append((i, e))
+            if verbose:
+                print(log.getvalue()[-2000:])
+            print(f"[SIMULATION] Match {i} failed: {type(e).__name__}: {e}")
+    elapsed = time.time() - started
+    return outcomes, failures, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Battleship matches in memory")
+    parser.add_argument("--matches", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=10, help="turn timeout, in virtual seconds")
+    parser.add_argument("--salvo", action="store_true", help="play salvo rules")
+    parser.add_argument("--verbose", action="store_true", help="show the server output of failed matches")
+    args = parser.parse_args(argv)
+    outcomes, failures, elapsed = run(args.matches, args.seed, args.timeout, args.verbose, args.salvo)
+    print(f"[SIMULATION] {args.matches} matches in {elapsed:.1f}s ({args.matches / elapsed:.0f}/s), {len(failures)} failed.")
+    for outcome, count in outcomes.most_common():
+        print(f"  {count:6} {outcome}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
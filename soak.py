@@ -0,0 +1,326 @@
+"""
+soak.py
+
+Long-running soak test: runs a real server.py and keeps a crowd of clients churning through
+it, watching the server process for resources that grow with every connection (leaked
+threads, sockets, last_move_time entries, ...).
+
+Each simulated client connects, and then at random plays a whole game, quits part way,
+hangs up mid-game (sometimes coming straight back under the same name), goes silent until the
+turn timeout forfeits it, or just sits in the queue for a while and leaves. At the replay
+prompt it answers y (and carries on) or n. A client the server stops talking to for STALL_SECS
+gives up and is counted as a stall.
+
+Every --interval seconds it samples the server's RSS, thread count and open file descriptors
+from /proc, and the bytes traced by tracemalloc via the server's admin socket (the 'trace'
+command, which also writes the allocations that grew since the last sample under
+--profile-dir). Tracing is started before any client connects. The samples go to a CSV file.
+
+After --warmup seconds the first sample is taken as the baseline. The server's RSS climbs for
+the first several minutes whether or not anything leaks (the allocator's arenas and
+tracemalloc's own tables filling up) and then levels off, hence the long default warm-up; with
+a short one rss_kb fails on that climb alone. Growth is the least-squares slope of each
+resource against connections made, over every sample from the baseline on: any one sample
+can land in the middle of a post-game review or a burst of logins and read a few hundred KiB
+high, which measured from a single baseline looks like a leak. The test fails (exit status
+1) if, at any sample once --min-connections have been made since the baseline, that slope
+goes over the budget for any resource, e.g. more than 0.01 threads per connection means about
+1 in 100 connections leaks a thread. A run that never got --min-connections past the
+baseline hasn't checked anything, and says so (exit status 2) rather than passing.
+
+At the default 8 clients the server sees a new connection every 5 to 8 seconds, so the
+default --duration leaves time for --min-connections after the warm-up.
+
+    python soak.py --duration 3600 --clients 8
+"""
+
+import argparse
+import csv
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from battleship import Board, SHIPS, BOARD_SIZE
+
+PORT = 5402
+ADMIN_SOCKET = "/tmp/battleship-soak-admin.sock"
+# a client that hears nothing at all (not even a PING) for this long counts as stalled and leaves
+STALL_SECS = 30
+# allowed growth per connection made since the baseline
+BUDGETS = {
+    "rss_kb": 16.0,
+    "threads": 0.01,
+    "fds": 0.01,
+    "traced_kb": 2.0,
+}
+CELLS = [f"{chr(ord('A') + r)}{c + 1}" for r in range(BOARD_SIZE) for c in range(BOARD_SIZE)]
+# connections needed after the baseline before growth is judged, so warm-up noise isn't
+MIN_CONNECTIONS = 100
+BEHAVIOURS = ["play", "play", "play", "quit", "drop", "rejoin", "silent", "idle"]
+# every simulated client connects from 127.0.0.1, so the server's per-IP admission limits
+# (see admission.py) have to let a whole crowd in from one address
+LOOPBACK_ADMISSION = ["--max-per-ip", "1000", "--connect-rate", "1000", "--connect-burst", "1000"]
+
+
+class Churn:
+    """Runs the simulated clients and counts connections."""
+
+    def __init__(self, port, clients, seed, behaviours=BEHAVIOURS, unix_socket=None):
+        self.port = port
+        # connect through the server's Unix socket instead of TCP, if given
+        self.unix_socket = unix_socket
+        self.clients = clients
+        self.behaviours = behaviours
+        self.rng = random.Random(seed)
+        self.connections = 0
+        self.errors = 0
+        self.stalls = 0
+        # seconds from firing to hearing the result, for every shot
+        self.turn_latencies = []
+        # forfeits for inactivity by clients that weren't deliberately silent
+        self.forfeits = 0
+        # connections reset by the other end other than after answering 'n'
+        self.dropped = 0
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._names = 0
+
+    def start(self):
+        for i in range(self.clients):
+            threading.Thread(target=self.client_loop, args=(random.Random(self.rng.random()),), name=f"soak-client-{i}", daemon=True).start()
+
+    def next_name(self):
+        with self._lock:
+            self._names += 1
+            return f"soak{self._names}"
+
+    def client_loop(self, rng):
+        while not self.stopping.is_set():
+            name = self.next_name()
+            behaviour = rng.choice(self.behaviours)
+            try:
+                dropped = self.session(rng, name, behaviour)
+                if dropped and behaviour == "rejoin":
+                    # back within the server's reconnect window, under the same name
+                    self.session(rng, name, "play")
+            except socket.timeout:
+                with self._lock:
+                    self.stalls += 1
+            except (OSError, ValueError):
+                with self._lock:
+                    self.errors += 1
+            time.sleep(rng.uniform(0, 0.5))
+
+    def session(self, rng, name, behaviour):
+        """One connection. Returns True if it hung up in the middle of a game."""
+        with self._lock:
+            self.connections += 1
+        if self.unix_socket:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(STALL_SECS)
+            sock.connect(self.unix_socket)
+        else:
+            sock = socket.create_connection(("127.0.0.1", self.port), timeout=STALL_SECS)
+        rfile = sock.makefile("r")
+
+        def say(line):
+            sock.sendall((line + "\n").encode("utf-8"))
+
+        board = Board(BOARD_SIZE)
+        board.place_ships_randomly(SHIPS)
+        placements = [f"PLACE {chr(ord('A') + row)}{col + 1} {'H' if o == 0 else 'V'} {ship}" for ship, row, col, _, o in board.layout]
+        shots = rng.sample(CELLS, len(CELLS))
+        turns = 0
+        fired_at = None
+        said_no = False
+        stop_at = rng.randrange(1, 30)
+        leave_at = time.time() + rng.uniform(1, 10) if behaviour == "idle" else None
+        try:
+            for line in rfile:
+                line = line.strip()
+                if self.stopping.is_set() or (leave_at and time.time() > leave_at):
+                    return False
+                if fired_at and line.startswith(("HIT", "MISS", "You've already", "Invalid input")):
+                    with self._lock:
+                        self.turn_latencies.append(time.time() - fired_at)
+                    fired_at = None
+                if line == "PING":
+                    say("PONG")
+                elif line.startswith("[!] Timeout! You have forfeited") and behaviour != "silent":
+                    with self._lock:
+                        self.forfeits += 1
+                elif line.startswith("Enter your username"):
+                    say(name)
+                elif line.startswith("Enter placement"):
+                    say(placements.pop(0) if placements else "PLACE A1 H CARRIER")
+                elif line.startswith("It's your turn!") or line.startswith("Invalid input"):
+                    turns += line.startswith("It's")
+                    if turns >= stop_at and behaviour in ("drop", "rejoin"):
+                        return True
+                    if turns >= stop_at and behaviour == "silent":
+                        continue
+                    if turns >= stop_at and behaviour == "quit":
+                        say("quit")
+                    else:
+                        time.sleep(rng.uniform(0, 0.2))
+                        say(shots.pop() if shots else "A1")
+                        fired_at = time.time()
+                elif "Do you want to play again" in line:
+                    if rng.random() < 0.3:
+                        say("y")
+                        turns, shots, stop_at = 0, rng.sample(CELLS, len(CELLS)), rng.randrange(1, 30)
+                        board = Board(BOARD_SIZE)
+                        board.place_ships_randomly(SHIPS)
+                        placements = [f"PLACE {chr(ord('A') + row)}{col + 1} {'H' if o == 0 else 'V'} {ship}" for ship, row, col, _, o in board.layout]
+                    else:
+                        say("n")
+                        said_no = True
+            return False
+        except (BrokenPipeError, ConnectionResetError):
+            # the server hung up on us, fine after answering 'n'
+            if not said_no:
+                with self._lock:
+                    self.dropped += 1
+            return False
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+def sample(pid, admin):
+    """Resource use of the server process right now."""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                values["rss_kb"] = int(line.split()[1])
+            elif line.startswith("Threads:"):
+                values["threads"] = int(line.split()[1])
+    values["fds"] = len(os.listdir(f"/proc/{pid}/fd"))
+    admin.write("trace\n")
+    admin.flush()
+    values["traced_kb"] = int(admin.readline().split()[0]) / 1024
+    return values
+
+
+def check_budget(samples):
+    """Return a list of resources over budget, given (connections, values) for every sample since the baseline."""
+    over = []
+    xs = [connections for connections, _ in samples]
+    mean_x = sum(xs) / len(xs)
+    # growth with no new connections at all is measured as if there had been one
+    spread = max(sum((x - mean_x) ** 2 for x in xs), 1)
+    for key, budget in BUDGETS.items():
+        ys = [values[key] for _, values in samples]
+        mean_y = sum(ys) / len(ys)
+        per_connection = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+        if per_connection > budget:
+            over.append(f"{key} grew {per_connection:.4f} per connection (budget {budget})")
+    return over
+
+
+def percentile(values, pct):
+    """The pct'th percentile of values (None if there are none); also used by replay.py and impair.py."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def connect_admin(path, deadline):
+    while True:
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            return sock.makefile("rw")
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test server.py for resource leaks")
+    parser.add_argument("--duration", type=float, default=1800, help="seconds to run for")
+    parser.add_argument("--warmup", type=float, default=600, help="seconds before the baseline sample")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between samples")
+    parser.add_argument("--clients", type=int, default=8, help="simulated clients churning at once")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--min-connections", type=int, default=MIN_CONNECTIONS, help="connections after the baseline before budgets are checked")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", default="soak.csv", help="where to write the samples")
+    parser.add_argument("--profile-dir", default="profiles", help="where the server writes allocation diffs")
+    parser.add_argument("--unix-socket", help="have the server listen on this Unix socket too, and connect the clients through it")
+    parser.add_argument("--server-arg", action="append", default=[], help="extra argument for server.py (repeatable)")
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, os.path.join(here, "server.py"), "--port", str(args.port),
+                               "--admin-socket", ADMIN_SOCKET, "--profile-dir", args.profile_dir] + LOOPBACK_ADMISSION + args.server_arg
+                              + (["--unix-socket", args.unix_socket] if args.unix_socket else []),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    churn = Churn(args.port, args.clients, args.seed, unix_socket=args.unix_socket)
+    failures = []
+    try:
+        admin = connect_admin(ADMIN_SOCKET, time.time() + 15)
+        # tracing from the start, so tracemalloc's own overhead is in the baseline rather than
+        # counted as growth, and the baseline's traced_kb covers everything allocated since
+        sample(server.pid, admin)
+        churn.start()
+        started = time.time()
+        # (connections, values) for the baseline and every sample after it
+        samples = []
+        baseline_connections = 0
+        judged = False
+        with open(args.csv, "w", newline="") as f:
+            out = csv.writer(f)
+            out.writerow(["elapsed", "connections", "errors", "stalls"] + list(BUDGETS))
+            while time.time() - started < args.duration:
+                time.sleep(args.interval)
+                if server.poll() is not None:
+                    failures.append(f"server exited with status {server.returncode}")
+                    break
+                values = sample(server.pid, admin)
+                elapsed = time.time() - started
+                out.writerow([round(elapsed), churn.connections, churn.errors, churn.stalls] + [round(values[k], 2) for k in BUDGETS])
+                f.flush()
+                print(f"[SOAK] {elapsed:6.0f}s {churn.connections} connections, " + ", ".join(f"{k} {v:.0f}" for k, v in values.items()))
+                if not samples:
+                    if elapsed < args.warmup:
+                        continue
+                    baseline_connections = churn.connections
+                samples.append((churn.connections, values))
+                if churn.connections - baseline_connections < args.min_connections:
+                    continue
+                over = check_budget(samples)
+                judged = True
+                if over:
+                    failures.extend(over)
+                    break
+    finally:
+        churn.stopping.set()
+        server.terminate()
+        server.wait()
+
+    if churn.stalls:
+        print(f"[SOAK] {churn.stalls} sessions stalled, the server stopped talking to them for {STALL_SECS}s.")
+    if failures:
+        for failure in failures:
+            print(f"[SOAK] FAILED: {failure}")
+        return 1
+    if not judged:
+        print(f"[SOAK] Inconclusive: only {churn.connections - baseline_connections} connections after the baseline, "
+              f"budgets are checked after {args.min_connections}. Run for longer.")
+        return 2
+    print(f"[SOAK] Passed: {churn.connections} connections, {churn.errors} client errors, {churn.stalls} stalled sessions, all growth within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
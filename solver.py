@@ -0,0 +1,318 @@
+"""
+solver.py
+
+Exact endgame play: once few enough ship layouts are still possible, the move that sinks the
+rest of the fleet in the fewest shots on average, and what that average is.
+
+What the shooter knows is a knowledge state:
+    ships    sizes of the ships still afloat
+    hits     bitmask of hits on those ships (bit row * size + col, as in BoardSnapshot)
+    blocked  bitmask of cells no afloat ship can be on: misses, and the cells of sunk ships
+             (a sunk ship is taken to be revealed, as in the usual rules)
+Every layout of the afloat ships that avoids 'blocked', covers every hit and doesn't lie
+entirely on hits (that ship would be sunk) is equally likely. The expected number of shots
+left is then 0 with no ships afloat, otherwise the best over the cells to fire at of
+    1 + sum over outcomes (miss, hit, or sinking a ship that's then revealed) of
+        P(outcome) * expected shots from the state it leads to.
+
+States are cached by (ships, hits, blocked), which is all that decides the layouts still
+possible, so the same position reached by firing in a different order is only solved once.
+The key is the smallest of its images under the board's 8 rotations and reflections, so
+mirror-image positions share an entry too; a position that is its own mirror image only
+has one of each pair of mirrored cells tried.
+
+A cell stops being searched once it can't beat the best found so far, so a position may only
+be shown to cost at least some bound; that is cached too, and it's searched again only if a
+later search needs to know more than that.
+
+The search gives up (best_move() returns None) if more than max_configs layouts are still
+possible, or it runs past its time budget; callers fall back to a heuristic then. Whatever
+was solved before running out of time stays cached for the next move.
+
+The cache holds only finished results and the search keeps nothing else on the solver, so
+one EndgameSolver can be shared by every game thread: 'endgame' below is the one the bots
+(bots.py) and the server's post-game review use.
+"""
+
+import time
+
+from battleship import BOARD_SIZE
+
+# most layouts still possible for the solver to take a position on (many more rarely
+# finish on a 10x10 board within MOVE_BUDGET_SECS)
+MAX_CONFIGS = 12
+# seconds best_move() may take
+MOVE_BUDGET_SECS = 0.05
+# cached positions kept before the cache is emptied
+CACHE_SIZE = 100000
+
+
+class OutOfTime(Exception):
+    pass
+
+
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def placements(size, length, blocked):
+    """Bitmasks of every horizontal and vertical position of a ship that misses 'blocked'."""
+    masks = []
+    row = (1 << length) - 1
+    column = sum(1 << (i * size) for i in range(length))
+    for r in range(size):
+        for c in range(size):
+            cell = r * size + c
+            if c + length <= size and not (row << cell) & blocked:
+                masks.append(row << cell)
+            if length > 1 and r + length <= size and not (column << cell) & blocked:
+                masks.append(column << cell)
+    return masks
+
+
+def configurations(size, ships, hits, blocked, limit):
+    """Every layout consistent with the knowledge state, as tuples of masks in 'ships' order; None if over 'limit'."""
+    options = [[m for m in placements(size, length, blocked) if m & hits != m] for length in ships]
+    found = []
+
+    def place(i, used, layout):
+        if i == len(ships) - 1:
+            # the last ship has to cover whatever hits are left
+            uncovered = hits & ~used
+            for mask in options[i]:
+                if not mask & used and mask & uncovered == uncovered:
+                    found.append(layout + (mask,))
+                    if len(found) > limit:
+                        return False
+            return True
+        for mask in options[i]:
+            if not mask & used and not place(i + 1, used | mask, layout + (mask,)):
+                return False
+        return True
+
+    if not ships:
+        return [()] if not hits else []
+    if not place(0, 0, ()):
+        return None
+    return found
+
+
+class Symmetries:
+    """The 8 rotations and reflections of a square board, applied to bitmasks a row at a time."""
+
+    def __init__(self, size):
+        self.size = size
+        n = size - 1
+        maps = [
+            lambda r, c: (r, c), lambda r, c: (c, n - r), lambda r, c: (n - r, n - c), lambda r, c: (n - c, r),
+            lambda r, c: (r, n - c), lambda r, c: (n - r, c), lambda r, c: (c, r), lambda r, c: (n - c, n - r),
+        ]
+        self.cells = [[rc[0] * size + rc[1] for rc in (f(cell // size, cell % size) for cell in range(size * size))] for f in maps]
+        # tables[s][r][v]: the image under s of row r holding the bits v
+        self.tables = []
+        full = 1 << size
+        for cells in self.cells:
+            rows = []
+            for r in range(size):
+                table = [0] * full
+                for v in range(1, full):
+                    low = v & -v
+                    table[v] = table[v ^ low] | (1 << cells[r * size + low.bit_length() - 1])
+                rows.append(table)
+            self.tables.append(rows)
+        self.row_mask = full - 1
+
+    def apply(self, s, mask):
+        rows = self.tables[s]
+        out = 0
+        r = 0
+        while mask:
+            out |= rows[r][mask & self.row_mask]
+            mask >>= self.size
+            r += 1
+        return out
+
+
+class EndgameSolver:
+
+    def __init__(self, size=BOARD_SIZE, max_configs=MAX_CONFIGS, cache_size=CACHE_SIZE):
+        self.size = size
+        self.max_configs = max_configs
+        self.cache_size = cache_size
+        self.symmetries = Symmetries(size)
+        # canonical (ships, hits, blocked) -> (expected shots left, True), or (a lower bound, False)
+        self.cache = {}
+
+    def key(self, ships, hits, blocked):
+        # the same position seen from any rotation or reflection
+        apply = self.symmetries.apply
+        return (ships,) + min((apply(s, hits), apply(s, blocked)) for s in range(8))
+
+    def invariant(self, hits, blocked):
+        """The symmetries (other than the identity) that leave this position unchanged."""
+        apply = self.symmetries.apply
+        return [s for s in range(1, 8) if apply(s, hits) == hits and apply(s, blocked) == blocked]
+
+    def best_move(self, ships, hits, blocked, budget=MOVE_BUDGET_SECS):
+        """
+        (row, col) to fire at next and the expected shots it takes to sink everything from
+        here, or None if the position is too big to solve or it ran out of time.
+        """
+        ships = tuple(sorted(ships, reverse=True))
+        configs = ships and configurations(self.size, ships, hits, blocked, self.max_configs)
+        if not configs:
+            return None
+        try:
+            value, cell = self.solve(ships, hits, blocked, configs, time.monotonic() + budget, root=True)
+        except OutOfTime:
+            return None
+        return (cell // self.size, cell % self.size), value
+
+    def expected_shots(self, ships, hits, blocked, budget=MOVE_BUDGET_SECS):
+        """The expected shots left with perfect play, or None (as best_move())."""
+        move = self.best_move(ships, hits, blocked, budget)
+        return move and move[1]
+
+    def solve(self, ships, hits, blocked, configs, deadline, root=False, cutoff=float("inf")):
+        if not ships:
+            return 0.0, None
+        if len(configs) == 1:
+            # nothing left to find out: fire at its unhit cells
+            left = 0
+            for mask in configs[0]:
+                left |= mask
+            left &= ~hits
+            return float(bin(left).count("1")), (left & -left).bit_length() - 1
+        # every layout still needs all its unhit ship cells fired at
+        floor = float(sum(ships) - bin(hits).count("1"))
+        if floor >= cutoff:
+            return float("inf"), None
+        key = raw = None
+        if not root:
+            # most repeats are the same position, not a mirror image: try that first
+            raw = (ships, hits, blocked)
+            cached = self.cache.get(raw)
+            if cached is None:
+                key = self.key(ships, hits, blocked)
+                cached = self.cache.get(key)
+            if cached is not None:
+                value, exact = cached
+                if exact:
+                    return value, None
+                if value >= cutoff:
+                    # known from an earlier search not to beat this cutoff either
+                    return float("inf"), None
+        if time.monotonic() > deadline:
+            raise OutOfTime()
+
+        total = len(configs)
+        # how many layouts have a ship on each cell: try the likeliest hits first
+        cover = {}
+        for layout in configs:
+            for mask in layout:
+                for cell in bits(mask & ~hits):
+                    cover[cell] = cover.get(cell, 0) + 1
+        order = sorted(cover, key=cover.get, reverse=True)
+        same = self.invariant(hits, blocked)
+        tried = set()
+
+        best, best_cell = float("inf"), None
+        for cell in order:
+            if cell in tried:
+                continue
+            tried.update(self.symmetries.cells[s][cell] for s in same)
+            bit = 1 << cell
+            value = self.fire(ships, hits, blocked, configs, deadline, cell, bit, total, min(best, cutoff), floor)
+            if value < best:
+                best, best_cell = value, cell
+        if raw is not None:
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            # every cell cut off: all we know is that it's no better than 'cutoff'
+            entry = (best, True) if best < cutoff else (cutoff, False)
+            self.cache[raw] = entry
+            if key is not None:
+                self.cache[key] = entry
+        return best, best_cell
+
+    def fire(self, ships, hits, blocked, configs, deadline, cell, bit, total, bound, floor):
+        # split the layouts by what firing at 'cell' would show
+        misses = []
+        hit = []
+        sinks = {}
+        for layout in configs:
+            for i, mask in enumerate(layout):
+                if mask & bit:
+                    if mask & ~(hits | bit):
+                        hit.append(layout)
+                    else:
+                        sinks.setdefault((i, mask), []).append(layout[:i] + layout[i + 1:])
+                    break
+            else:
+                misses.append(layout)
+        outcomes = []
+        if misses:
+            outcomes.append((misses, ships, hits, blocked | bit))
+        if hit:
+            outcomes.append((hit, ships, hits | bit, blocked))
+        for (i, mask), layouts in sinks.items():
+            outcomes.append((layouts, ships[:i] + ships[i + 1:], (hits | bit) & ~mask, blocked | mask))
+
+        # 1 for this shot, then each outcome; stop once it can't beat 'bound'
+        value = 1.0
+        remaining = 1.0
+        for layouts, next_ships, next_hits, next_blocked in outcomes:
+            p = len(layouts) / total
+            remaining -= p
+            # the most this outcome may cost for the cell to still beat 'bound'
+            limit = (bound - value - remaining * max(0.0, floor - 1)) / p
+            result, _ = self.solve(next_ships, next_hits, next_blocked, layouts, deadline, cutoff=limit)
+            value += p * result
+            if value + remaining * max(0.0, floor - 1) >= bound:
+                return float("inf")
+        return value
+
+
+def knowledge(size, layout, shots):
+    """The knowledge state of whoever fired 'shots' at a board with this layout (BoardSnapshot.layout)."""
+    ships, hits, blocked = [], 0, shots
+    for ship in layout:
+        _, row, col, length, orientation = ship
+        step = 1 if orientation == 0 else size
+        mask = sum(1 << (row * size + col + i * step) for i in range(length))
+        if shots & mask == mask:
+            continue
+        ships.append(length)
+        hits |= shots & mask
+        blocked &= ~mask
+    return tuple(ships), hits, blocked
+
+
+def review(size, layout, shots, budget=0.5, solver=None):
+    """
+    Post-game: from the first shot after which the position could be solved, how many more
+    shots perfect play would have needed on average, against how many were taken. 'shots'
+    is the (row, col) of every shot in order. Returns (shots fired before that point,
+    expected, taken) or None if the endgame was never small enough or 'budget' ran out.
+    """
+    solver = solver or (endgame if size == endgame.size else EndgameSolver(size))
+    deadline = time.monotonic() + budget
+    fired = 0
+    for n, (row, col) in enumerate(shots):
+        ships, hits, blocked = knowledge(size, layout, fired)
+        if ships and configurations(size, tuple(sorted(ships, reverse=True)), hits, blocked, solver.max_configs) is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            # too slow to solve from here: a shot later there's less to solve
+            expected = solver.expected_shots(ships, hits, blocked, left)
+            if expected is not None:
+                return n, expected, len(shots) - n
+        fired |= 1 << (row * size + col)
+    return None
+
+
+endgame = EndgameSolver()
@@ -0,0 +1,247 @@
+"""
+spectate.py
+
+Watching a particular match.
+
+Every running game gets a MatchFeed with a small numeric id. A client who answers the
+username prompt with 'SPECTATE' gets the list of matches, and with 'SPECTATE <id>' subscribes
+to one. A subscriber is sent, as single lines:
+
+    [SNAPSHOT] {"match": id, "seq": n, "players": [..], "boards": [..], "turn": name}
+        once, on joining. boards are BoardSnapshot.public() for each player's board (shot and
+        hit cells as hex bitmasks of row * size + col, and the names of sunk ships), so someone
+        joining halfway through sees the game as it stands.
+    [EVENT] {"match": id, "seq": n, "type": ..., ...}
+        for every event after that: "turn" (player), "shot" (player, target, cell, result,
+        sunk) and "end" (winner, loser, reason). seq follows on from the snapshot's.
+
+Events are encoded once in publish() and the same bytes are queued for every subscriber;
+publish() runs on the game thread, so it never writes to a socket itself. Each subscriber has
+its own sender thread that writes their queue out, and a subscriber who falls more than
+MAX_QUEUED_EVENTS behind is dropped and disconnected rather than holding anyone else up.
+A sender only wakes up for something to send: a spectator who hangs up is noticed by the
+heartbeat monitor, whose eviction calls stop_watching().
+The snapshot is taken from the boards' immutable snapshots under the same lock as publish(),
+and queued ahead of any event, so it lines up with the event sequence. A shot landing just
+before a join may show up in both the snapshot and the next event; applying it twice changes
+nothing.
+"""
+
+import itertools
+import json
+import queue
+import socket
+import threading
+
+SNAPSHOT_PREFIX = "[SNAPSHOT] "
+EVENT_PREFIX = "[EVENT] "
+
+# events a spectator may fall behind by before they're dropped
+MAX_QUEUED_EVENTS = 256
+
+# match id -> MatchFeed for every game in progress
+matches = {}
+_matches_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+class MatchFeed:
+
+    def __init__(self, match_id, playerOne, playerTwo):
+        self.id = match_id
+        self.players = (playerOne, playerTwo)
+        self.seq = 0
+        self.turn = None
+        # spectator -> their Subscription
+        self.subscribers = {}
+        # listener(seq, event_json) callbacks for every event, e.g. the HTTP event streams
+        # in webfeed.py; called with event_json None once the match is over
+        self.listeners = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def describe(self):
+        return f"{self.id}: {self.players[0]['username']} vs {self.players[1]['username']}"
+
+    def snapshot(self):
+        """The current public state of the match, as a dict (caller holds no lock)."""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        boards = []
+        for player in self.players:
+            board = player.get("board")
+            boards.append(board.snapshot().public() if board is not None else None)
+        return {"match": self.id, "seq": self.seq, "players": [p["username"] for p in self.players],
+                "boards": boards, "turn": self.turn}
+
+    def subscribe(self, spectator):
+        """Send the spectator a snapshot and add them to the event stream. False if the match is over."""
+        with self._lock:
+            if self.closed:
+                return False
+            line = SNAPSHOT_PREFIX + json.dumps(self._snapshot(), separators=(",", ":")) + "\n"
+            subscription = Subscription(spectator)
+            subscription.send(line.encode("utf-8"))
+            self.subscribers[id(spectator)] = subscription
+            spectator["watching"] = self
+        subscription.start()
+        return True
+
+    def add_listener(self, listener):
+        """Add a listener and return the snapshot it starts from, or None if the match is over."""
+        with self._lock:
+            if self.closed:
+                return None
+            self.listeners.append(listener)
+            return self._snapshot()
+
+    def unsubscribe(self, spectator):
+        with self._lock:
+            subscription = self.subscribers.pop(id(spectator), None)
+        if subscription:
+            subscription.stop()
+
+    def publish(self, event):
+        """Queue an event for every subscriber. Used as run_multi_player_round's onEvent."""
+        with self._lock:
+            if self.closed:
+                return
+            self.seq += 1
+            if event.get("type") == "turn":
+                self.turn = event.get("player")
+            encoded = json.dumps(dict(event, match=self.id, seq=self.seq), separators=(",", ":"))
+            data = (EVENT_PREFIX + encoded + "\n").encode("utf-8")
+            for key, subscription in list(self.subscribers.items()):
+                if not subscription.send(data):
+                    # gone, or too far behind to catch up
+                    del self.subscribers[key]
+                    subscription.stop()
+            for listener in self.listeners:
+                listener(self.seq, encoded)
+
+    def close(self, msg):
+        """The match is over: tell the subscribers and hang up on them."""
+        with self._lock:
+            self.closed = True
+            subscribers, self.subscribers = self.subscribers, {}
+            listeners, self.listeners = self.listeners, []
+        for listener in listeners:
+            listener(self.seq, None)
+        data = (msg + "\n").encode("utf-8")
+        for subscription in subscribers.values():
+            subscription.send(data)
+            subscription.stop()
+
+
+class Subscription:
+    """
+    One spectator's queue of encoded lines, and the thread that sends them. The sender owns the
+    spectator's connection from here on, and closes it when it stops: after stop(), once the
+    spectator has gone, or once they can't keep up.
+    """
+
+    def __init__(self, spectator, max_queued=MAX_QUEUED_EVENTS):
+        self.spectator = spectator
+        self.queue = queue.Queue(max_queued)
+        self.gone = False
+
+    def start(self):
+        threading.Thread(target=self._run, name="spectator", daemon=True).start()
+
+    def send(self, data):
+        """Queue a line without blocking. False if the spectator has gone or is too far behind."""
+        if self.gone:
+            return False
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            print(f"[SERVERINFO] {self.spectator['username']} is {self.queue.maxsize} events behind, dropping them.")
+            self.gone = True
+            self._hang_up()
+            return False
+        return True
+
+    def stop(self):
+        # lets the sender finish what's queued, then hang up
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            self.gone = True
+            self._hang_up()
+
+    def _hang_up(self):
+        # wakes the sender if it's stuck writing to them
+        try:
+            self.spectator["connection"].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        writeFile = self.spectator["writeFile"]
+        try:
+            while not self.gone:
+                data = self.queue.get()
+                if data is None:
+                    break
+                writeFile.write_encoded(data)
+        except OSError:
+            pass
+        finally:
+            self.gone = True
+            try:
+                self.spectator["connection"].close()
+            except OSError:
+                pass
+
+
+def open_match(playerOne, playerTwo):
+    feed = MatchFeed(next(_ids), playerOne, playerTwo)
+    with _matches_lock:
+        matches[feed.id] = feed
+    return feed
+
+
+def close_match(feed):
+    with _matches_lock:
+        matches.pop(feed.id, None)
+    feed.close(f"[SERVERINFO] Match {feed.id} is over. Thanks for watching!")
+
+
+def find_match(match_id):
+    with _matches_lock:
+        return matches.get(match_id)
+
+
+def list_matches():
+    with _matches_lock:
+        return sorted(matches.values(), key=lambda feed: feed.id)
+
+
+def stop_watching(spectator):
+    """The spectator has gone (e.g. evicted by the heartbeat monitor): stop their sender."""
+    feed = spectator.get("watching")
+    if feed is not None:
+        feed.unsubscribe(spectator)
+
+
+def spectate(spectator, request):
+    """
+    Handle a 'SPECTATE [id]' handshake. Returns True if the spectator is now subscribed;
+    otherwise they've been sent the list of matches to pick from and should be disconnected.
+    """
+    parts = request.split()
+    feed = None
+    if len(parts) == 2 and parts[1].isdigit():
+        feed = find_match(int(parts[1]))
+    if feed is not None and feed.subscribe(spectator):
+        print(f"[SERVERINFO] {spectator['username']} is watching match {feed.describe()}")
+        return True
+    lines = ["[SERVERINFO] Matches you can watch (reconnect and enter 'SPECTATE <id>'):"]
+    lines += [f"  {feed.describe()}" for feed in list_matches()] or ["  none right now"]
+    try:
+        spectator["writeFile"].write_encoded(("\n".join(lines) + "\n").encode("utf-8"))
+    except OSError:
+        pass
+    return False
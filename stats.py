@@ -0,0 +1,189 @@
+"""
+stats.py
+
+Player statistics and the leaderboard, kept in a local SQLite file (server.py --stats-db).
+
+    players   one row per player: wins, losses, forfeits, shots, hits, rating
+              (indexed by rating, for the leaderboard)
+    results   one row per player per game: opponent, result, how it ended, shots, hits,
+              rating after it (indexed by player and time, for their history)
+
+Ratings are Elo, starting at DEFAULT_RATING. A forfeit is a loss by quitting, timing out or
+not coming back after a disconnect; it counts as a loss too.
+
+Game threads only call record(), which queues the result and returns, so a game never waits
+on the disk. A background thread commits everything queued every STATS_INTERVAL_SECS, in one
+transaction, and works out the new ratings as it goes (in the transaction, so several server
+processes can share one file).
+
+Reads (leaderboard(), player()) come from the handshake and play-again prompt threads, and
+go through a cache that's emptied whenever anything has been committed to the file since it
+was filled: our own writer or another server process's (PRAGMA data_version tells). So the
+same query doesn't reach SQLite twice in between games finishing, and a leaderboard is never
+older than the last commit by anyone. The cache keeps at most MAX_CACHED answers, since
+'STATS <name>' can ask about any name at all.
+"""
+
+import sqlite3
+import threading
+import time
+
+# seconds between commits of queued results
+STATS_INTERVAL_SECS = 1.0
+# players on the leaderboard, and games in a player's history
+TOP_PLAYERS = 10
+HISTORY = 5
+DEFAULT_RATING = 1500.0
+# how far one game moves a rating
+K_FACTOR = 32
+FORFEITS = ("quit", "timeout", "disconnect")
+# answers kept in the read cache before it's emptied
+MAX_CACHED = 256
+MISSING = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    forfeits INTEGER NOT NULL DEFAULT 0,
+    shots INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    rating REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_by_rating ON players (rating DESC);
+CREATE TABLE IF NOT EXISTS results (
+    player TEXT NOT NULL,
+    ended REAL NOT NULL,
+    opponent TEXT NOT NULL,
+    result TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    shots INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    rating REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_player ON results (player, ended DESC);
+"""
+
+PLAYER_COLUMNS = "name, wins, losses, forfeits, shots, hits, rating"
+
+
+def expected_score(rating, opponent):
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def player_dict(row):
+    name, wins, losses, forfeits, shots, hits, rating = row
+    return {"player": name, "wins": wins, "losses": losses, "forfeits": forfeits, "shots": shots,
+            "hits": hits, "accuracy": round(hits / shots, 3) if shots else None, "rating": round(rating)}
+
+
+class StatsStore:
+
+    def __init__(self, path, interval=STATS_INTERVAL_SECS):
+        self.path = path
+        self.interval = interval
+        # results waiting for the writer: (ended, winner, loser, reason, (shots, hits) each)
+        self._pending = []
+        self._lock = threading.Lock()
+        # reads share one connection (they're rare, thanks to the cache); the writer has its own
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._read_lock = threading.Lock()
+        # query -> answer, emptied on every commit (to the file, by anyone) and when it's full
+        self._cache = {}
+        # PRAGMA data_version the cache was filled at
+        self._version = None
+
+    def _connect(self):
+        # WAL: reads don't wait for the writer, or other processes' writers
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def record(self, winner, loser, reason, winner_fired, loser_fired):
+        """Queue a finished game. winner_fired and loser_fired are each player's (shots, hits)."""
+        with self._lock:
+            self._pending.append((time.time(), winner, loser, reason, winner_fired, loser_fired))
+
+    def start(self):
+        threading.Thread(target=self._run, name="stats", daemon=True).start()
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            time.sleep(self.interval)
+            self.write_pending(db)
+
+    def write_pending(self, db=None):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        if not pending:
+            return
+        try:
+            db = db or self._connect()
+            with db:
+                # take the write lock up front: the ratings read below must still be current when written
+                db.execute("BEGIN IMMEDIATE")
+                for ended, winner, loser, reason, winner_fired, loser_fired in pending:
+                    self._write(db, ended, winner, loser, reason, winner_fired, loser_fired)
+        except sqlite3.Error as e:
+            # rolled back: put them back ahead of anything recorded since, for the next try
+            print(f"[SERVERERROR] Could not save {len(pending)} game results, will retry: {e}")
+            with self._lock:
+                self._pending[:0] = pending
+
+    def _write(self, db, ended, winner, loser, reason, winner_fired, loser_fired):
+        ratings = {}
+        for name in (winner, loser):
+            db.execute("INSERT OR IGNORE INTO players (name, rating) VALUES (?, ?)", (name, DEFAULT_RATING))
+            ratings[name] = db.execute("SELECT rating FROM players WHERE name = ?", (name,)).fetchone()[0]
+        change = K_FACTOR * (1 - expected_score(ratings[winner], ratings[loser]))
+        forfeit = 1 if reason in FORFEITS else 0
+        for name, opponent, result, (shots, hits), delta in ((winner, loser, "win", winner_fired, change),
+                                                             (loser, winner, "loss", loser_fired, -change)):
+            won = result == "win"
+            db.execute("UPDATE players SET wins = wins + ?, losses = losses + ?, forfeits = forfeits + ?,"
+                       " shots = shots + ?, hits = hits + ?, rating = ? WHERE name = ?",
+                       (int(won), int(not won), 0 if won else forfeit, shots, hits, ratings[name] + delta, name))
+            db.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (name, ended, opponent, result, reason, shots, hits, ratings[name] + delta))
+
+    def _cached(self, key, query):
+        with self._read_lock:
+            # changes whenever another connection (our writer, or another process) commits
+            version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._version:
+                self._cache = {}
+                self._version = version
+            answer = self._cache.get(key, MISSING)
+            if answer is MISSING:
+                if len(self._cache) >= MAX_CACHED:
+                    self._cache = {}
+                answer = query(self._reader)
+                self._cache[key] = answer
+        return answer
+
+    def leaderboard(self, count=TOP_PLAYERS):
+        """The top players by rating, best first, as dicts (see player_dict)."""
+        def query(db):
+            rows = db.execute(f"SELECT {PLAYER_COLUMNS} FROM players ORDER BY rating DESC LIMIT ?", (count,))
+            return [player_dict(row) for row in rows]
+        return self._cached(("top", count), query)
+
+    def player(self, name, history=HISTORY):
+        """A player's stats, their place on the leaderboard and their latest games; None if they've never finished one."""
+        def query(db):
+            row = db.execute(f"SELECT {PLAYER_COLUMNS} FROM players WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            stats = player_dict(row)
+            stats["rank"] = db.execute("SELECT COUNT(*) + 1 FROM players WHERE rating > ?", (row[-1],)).fetchone()[0]
+            games = db.execute("SELECT opponent, result, reason, shots, hits, ended FROM results"
+                               " WHERE player = ? ORDER BY ended DESC LIMIT ?", (name, history))
+            stats["history"] = [{"opponent": opponent, "result": result, "reason": reason, "shots": shots,
+                                 "hits": hits, "ended": round(ended)} for opponent, result, reason, shots, hits, ended in games]
+            return stats
+        return self._cached(("player", name, history), query)
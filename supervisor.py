@@ -0,0 +1,59 @@
+"""
+supervisor.py
+
+Runs server.py as several processes so games aren't all sharing one GIL:
+ - one lobby process (lobby.py) that moves players between workers,
+ - N worker processes, each binding the same port with SO_REUSEPORT so the kernel spreads
+   new connections across them, and each hosting its own game.
+
+If a worker (or the lobby) dies it is restarted; games on the other workers carry on.
+"""
+
+import multiprocessing
+import time
+
+from lobby import run_lobby
+
+# don't restart a process more often than this, in case it's crashing on startup
+RESTART_DELAY_SECS = 1
+
+
+def run_supervisor(workers, lobby_path, worker_main):
+    """
+    Start the lobby and 'workers' copies of worker_main(worker_id, lobby_path), and keep them running.
+    worker_main must be a module-level function.
+    """
+    ctx = multiprocessing.get_context("fork")
+
+    def spawn_lobby():
+        proc = ctx.Process(target=run_lobby, args=(lobby_path,), name="lobby")
+        proc.start()
+        return proc
+
+    def spawn_worker(worker_id):
+        proc = ctx.Process(target=worker_main, args=(worker_id, lobby_path), name=f"worker-{worker_id}")
+        proc.start()
+        return proc
+
+    lobby = spawn_lobby()
+    # give the lobby a moment to bind before the workers try to connect to it
+    time.sleep(0.5)
+    procs = {worker_id: spawn_worker(worker_id) for worker_id in range(workers)}
+    print(f"[SUPERVISOR] Started lobby and {workers} workers.")
+
+    try:
+        while True:
+            time.sleep(RESTART_DELAY_SECS)
+            if not lobby.is_alive():
+                print(f"[SUPERVISOR] Lobby exited ({lobby.exitcode}), restarting it.")
+                lobby = spawn_lobby()
+            for worker_id, proc in procs.items():
+                if not proc.is_alive():
+                    print(f"[SUPERVISOR] Worker {worker_id} exited ({proc.exitcode}), restarting it.")
+                    procs[worker_id] = spawn_worker(worker_id)
+    except KeyboardInterrupt:
+        print("[SUPERVISOR] Shutting down.")
+        for proc in list(procs.values()) + [lobby]:
+            proc.terminate()
+        for proc in list(procs.values()) + [lobby]:
+            proc.join()
@@ -0,0 +1,70 @@
+import random
+import unittest
+
+from battleship import Board
+
+FLEET = [("CARRIER", 5), ("BATTLESHIP", 4), ("CRUISER", 3), ("DESTROYER", 2)]
+
+
+def random_board(rng, size, ships=FLEET, shots=0):
+    random.seed(rng.random())
+    board = Board(size)
+    board.place_ships_randomly(ships)
+    for cell in rng.sample(range(size * size), shots):
+        board.fire_at(cell // size, cell % size)
+    return board
+
+
+class FireManyTest(unittest.TestCase):
+    """A salvo has to come out exactly as firing the same shots one at a time would."""
+
+    def check(self, rng, size, salvos):
+        one = random_board(rng, size)
+        many = Board(size)
+        for name, row, col, length, orientation in one.layout:
+            positions = many.do_place_ship(row, col, length, orientation, name)
+            many.placed_ships.append({'name': name, 'positions': positions})
+        for salvo in salvos:
+            expected = [one.fire_at(row, col) for row, col in salvo]
+            self.assertEqual(many.fire_many(salvo), expected, salvo)
+            self.assertEqual(many.display_grid, one.display_grid)
+            self.assertEqual(many.hidden_grid, one.hidden_grid)
+            self.assertEqual(many.shots, one.shots)
+            self.assertEqual(many.ships_afloat(), one.ships_afloat())
+
+    def test_random_salvos(self):
+        rng = random.Random(1)
+        for size in (5, 10, 17):
+            for _ in range(50):
+                cells = [(r, c) for r in range(size) for c in range(size)]
+                salvos = []
+                while cells:
+                    n = min(len(cells), rng.randint(1, 5))
+                    salvos.append([cells.pop(rng.randrange(len(cells))) for _ in range(n)])
+                self.check(rng, size, salvos)
+
+    def test_repeated_cells(self):
+        rng = random.Random(2)
+        for _ in range(50):
+            salvos = []
+            for _ in range(40):
+                cells = [(rng.randrange(10), rng.randrange(10)) for _ in range(rng.randint(1, 5))]
+                # the same cell twice in one salvo, and cells fired at in earlier salvos
+                cells.append(cells[0])
+                salvos.append(cells)
+            self.check(rng, 10, salvos)
+
+    def test_sinking_shot_is_named(self):
+        board = Board(10)
+        board.placed_ships.append({'name': "DESTROYER", 'positions': board.do_place_ship(0, 0, 2, 0, "DESTROYER")})
+        board.placed_ships.append({'name': "CRUISER", 'positions': board.do_place_ship(2, 0, 3, 1, "CRUISER")})
+        # the second destroyer cell comes first on the board but last in the salvo
+        self.assertEqual(board.fire_many([(0, 1), (5, 5), (0, 0), (2, 0)]),
+                         [('hit', None), ('miss', None), ('hit', "DESTROYER"), ('hit', None)])
+        self.assertEqual(board.fire_many([(4, 0), (3, 0), (0, 0)]),
+                         [('hit', None), ('hit', "CRUISER"), ('already_shot', None)])
+        self.assertEqual(board.ships_afloat(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
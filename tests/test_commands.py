@@ -0,0 +1,109 @@
+import unittest
+
+from commands import (CommandParser, CommandError, Fire, Place, Stats, FLEET, QUIT, YES, NO,
+                      BAD_FORMAT, OFF_GRID, DUPLICATE_SHOT, BAD_PLACEMENT, BAD_ORIENTATION, BAD_ANSWER)
+
+SHIP_NAMES = ["CARRIER", "BATTLESHIP"]
+
+
+class FireTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = CommandParser(10, SHIP_NAMES)
+
+    def test_single_shot_either_case(self):
+        self.assertEqual(self.parser.fire("B5"), Fire(((1, 4),)))
+        self.assertEqual(self.parser.fire(" b5 \n"), Fire(((1, 4),)))
+        self.assertEqual(self.parser.fire("J10"), Fire(((9, 9),)))
+
+    def test_single_shot_is_built_up_front(self):
+        self.assertIs(self.parser.fire("C3"), self.parser.fire("C3"))
+
+    def test_quit_and_fleet(self):
+        self.assertIs(self.parser.fire("quit"), QUIT)
+        self.assertIs(self.parser.fire("QUIT"), QUIT)
+        self.assertIs(self.parser.fire("Fleet"), FLEET)
+
+    def test_bad_cells(self):
+        self.assertEqual(self.parser.fire("K1"), OFF_GRID)
+        self.assertEqual(self.parser.fire("A11"), OFF_GRID)
+        self.assertEqual(self.parser.fire("A0"), OFF_GRID)
+        self.assertEqual(self.parser.fire("5B"), BAD_FORMAT)
+        self.assertEqual(self.parser.fire(""), BAD_FORMAT)
+        self.assertEqual(self.parser.fire("B5 C6"), BAD_FORMAT)
+
+    def test_salvo(self):
+        self.assertEqual(self.parser.fire("B5 C6", shots=2), Fire(((1, 4), (2, 5))))
+        self.assertEqual(self.parser.fire("B5,c6", shots=2), Fire(((1, 4), (2, 5))))
+        self.assertEqual(self.parser.fire("B5", shots=2).code, "count")
+        self.assertEqual(self.parser.fire("B5 B5", shots=2), DUPLICATE_SHOT)
+        self.assertEqual(self.parser.fire("B5 Z9", shots=2), OFF_GRID)
+
+    def test_board_size(self):
+        parser = CommandParser(20, SHIP_NAMES)
+        self.assertEqual(parser.fire("T20"), Fire(((19, 19),)))
+        self.assertEqual(self.parser.fire("T20"), OFF_GRID)
+
+
+class PlaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = CommandParser(10, SHIP_NAMES)
+
+    def test_place(self):
+        self.assertEqual(self.parser.place("PLACE A1 H CARRIER"), Place(0, 0, 0, "CARRIER"))
+        self.assertEqual(self.parser.place("place c2 v battleship"), Place(2, 1, 1, "BATTLESHIP"))
+        self.assertIs(self.parser.place("fleet"), FLEET)
+
+    def test_bad_placements(self):
+        self.assertEqual(self.parser.place("PLACE A1 H"), BAD_PLACEMENT)
+        self.assertEqual(self.parser.place("PUT A1 H CARRIER"), BAD_PLACEMENT)
+        self.assertEqual(self.parser.place("PLACE A1 D CARRIER"), BAD_ORIENTATION)
+        self.assertEqual(self.parser.place("PLACE K1 H CARRIER"), OFF_GRID)
+        error = self.parser.place("PLACE A1 H SUBMARINE")
+        self.assertIsInstance(error, CommandError)
+        self.assertEqual(error.code, "ship")
+        self.assertIn("CARRIER, BATTLESHIP", error.message)
+
+
+class AnswerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = CommandParser(10, SHIP_NAMES)
+
+    def test_answers(self):
+        self.assertIs(self.parser.answer("y\n"), YES)
+        self.assertIs(self.parser.answer("N"), NO)
+        self.assertEqual(self.parser.answer("yes"), BAD_ANSWER)
+
+    def test_stats(self):
+        self.assertEqual(self.parser.stats("STATS"), Stats(None))
+        self.assertEqual(self.parser.stats("stats alice\n"), Stats("alice"))
+        self.assertIsNone(self.parser.stats("STATS alice bob"))
+        self.assertIsNone(self.parser.stats("alice"))
+        self.assertIsNone(self.parser.stats(""))
+        self.assertIsNone(self.parser.stats("STATISTICS"))
+
+
+class KindOfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = CommandParser(10, SHIP_NAMES)
+
+    def test_stale_commands(self):
+        self.assertEqual(self.parser.kind_of("B5"), "a shot")
+        self.assertEqual(self.parser.kind_of("b5, C6 D7"), "a shot")
+        self.assertEqual(self.parser.kind_of("PLACE A1 H CARRIER"), "a ship placement")
+        self.assertEqual(self.parser.kind_of("y"), "a play-again answer")
+        self.assertEqual(self.parser.kind_of(" n \n"), "a play-again answer")
+
+    def test_not_commands(self):
+        self.assertIsNone(self.parser.kind_of(""))
+        self.assertIsNone(self.parser.kind_of("hello"))
+        self.assertIsNone(self.parser.kind_of("K1"))
+        self.assertIsNone(self.parser.kind_of("B5 hello"))
+        self.assertIsNone(self.parser.kind_of("PLACE A1 H SUBMARINE"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import random
+import unittest
+
+from battleship import Board, BoardSnapshot, SHIPS, CUSTOM_SHIP
+
+SIZES = (5, 10, 16, 17, 20, 40)
+FLEET = [("CARRIER", 5), ("BATTLESHIP", 4), ("CRUISER", 3), ("DESTROYER", 2)]
+
+
+def random_board(rng, size, ships=FLEET, shots=0):
+    random.seed(rng.random())
+    board = Board(size)
+    board.place_ships_randomly(ships)
+    for cell in rng.sample(range(size * size), shots):
+        board.fire_at(cell // size, cell % size)
+    return board
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(3)
+        for size in SIZES:
+            for _ in range(20):
+                board = random_board(rng, size, shots=rng.randrange(size * size))
+                snapshot = board.snapshot()
+                decoded = BoardSnapshot.from_bytes(snapshot.to_bytes())
+                self.assertEqual(decoded, snapshot)
+                restored = decoded.to_board()
+                self.assertEqual(restored.display_grid, board.display_grid)
+                self.assertEqual(restored.hidden_grid, board.hidden_grid)
+                self.assertEqual(restored.ships_afloat(), board.ships_afloat())
+
+    def test_encoded_size(self):
+        rng = random.Random(4)
+        board = random_board(rng, 10, ships=SHIPS)
+        self.assertEqual(len(board.to_bytes()), 3 + 4 * len(SHIPS) + 13)
+
+    def test_custom_ship_names(self):
+        board = Board(10)
+        for name, row in (("SUB", 0), ("", 2), (None, 4)):
+            board.placed_ships.append({'name': name, 'positions': board.do_place_ship(row, 0, 3, 0, name)})
+        data = board.to_bytes()
+        self.assertIn(CUSTOM_SHIP, data)
+        decoded = BoardSnapshot.from_bytes(data)
+        self.assertEqual([ship[0] for ship in decoded.layout], ["SUB", "", ""])
+        self.assertEqual(decoded.shots, board.shots)
+
+    def test_reads_version_1(self):
+        rng = random.Random(5)
+        names = [name for name, _ in SHIPS]
+        board = random_board(rng, 10, ships=SHIPS, shots=30)
+        snapshot = board.snapshot()
+        # version 1 stored the start cell as row * size + col in one byte
+        data = bytearray([1, 10, len(snapshot.layout)])
+        for name, row, col, length, orientation in snapshot.layout:
+            data += bytes([names.index(name), row * 10 + col, orientation << 7 | length])
+        data += snapshot.shots.to_bytes(13, "little")
+        self.assertEqual(BoardSnapshot.from_bytes(bytes(data)), snapshot)
+
+    def test_unknown_version(self):
+        data = bytearray(Board(10).to_bytes())
+        data[0] = 99
+        with self.assertRaises(ValueError):
+            BoardSnapshot.from_bytes(bytes(data))
+
+    def test_too_big(self):
+        with self.assertRaises(ValueError):
+            BoardSnapshot(256, (), 0).to_bytes()
+        with self.assertRaises(ValueError):
+            BoardSnapshot(10, (("LONG", 0, 0, 128, 0),), 0).to_bytes()
+
+
+if __name__ == "__main__":
+    unittest.main()
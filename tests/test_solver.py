@@ -0,0 +1,199 @@
+import itertools
+import random
+import unittest
+
+from battleship import Board
+from solver import EndgameSolver, configurations, knowledge, review
+
+SIZE = 4
+FLEETS = ([("DESTROYER", 2)], [("CRUISER", 3), ("DESTROYER", 2)], [("DESTROYER", 2), ("PATROL", 2)])
+# plenty of room and time: these are checked against the reference, not against the clock
+SOLVER = dict(max_configs=10000, cache_size=1000000)
+BUDGET = 60
+# most layouts a position may have for the reference to get through it quickly
+MAX_LAYOUTS = 12
+
+
+def ship_masks(size, length):
+    masks = []
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in ((0, 1), (1, 0)):
+                cells = [(r + dr * i, c + dc * i) for i in range(length)]
+                if all(row < size and col < size for row, col in cells):
+                    masks.append(sum(1 << (row * size + col) for row, col in cells))
+    return sorted(set(masks))
+
+
+def layouts(size, ships, hits, blocked):
+    """Every layout the solver should think possible, found the slow way."""
+    found = []
+    for layout in itertools.product(*(ship_masks(size, length) for length in ships)):
+        used = 0
+        for mask in layout:
+            if mask & used or mask & blocked or mask & hits == mask:
+                break
+            used |= mask
+        else:
+            if used & hits == hits:
+                found.append(layout)
+    return found
+
+
+class Reference:
+    """Expected shots left with perfect play, by trying every cell a ship could be on in every position."""
+
+    def __init__(self, size):
+        self.size = size
+        self.memo = {}
+
+    def value(self, ships, hits, blocked, possible=None):
+        if not ships:
+            return 0.0
+        key = (ships, hits, blocked)
+        if key not in self.memo:
+            if possible is None:
+                possible = layouts(self.size, ships, hits, blocked)
+            # a cell no layout has a ship on is a sure miss that shows nothing, never worth a shot
+            cover = 0
+            for layout in possible:
+                for mask in layout:
+                    cover |= mask
+            self.memo[key] = min(self.fire(ships, hits, blocked, possible, cell)
+                                 for cell in range(self.size * self.size) if (cover & ~hits) >> cell & 1)
+        return self.memo[key]
+
+    def fire(self, ships, hits, blocked, possible, cell):
+        bit = 1 << cell
+        outcomes = {}
+        for layout in possible:
+            state, rest = (ships, hits, blocked | bit), layout
+            for i, mask in enumerate(layout):
+                if mask & bit:
+                    if mask & ~(hits | bit):
+                        state = (ships, hits | bit, blocked)
+                    else:
+                        state = (ships[:i] + ships[i + 1:], (hits | bit) & ~mask, blocked | mask)
+                        rest = layout[:i] + layout[i + 1:]
+                    break
+            outcomes.setdefault(state, []).append(rest)
+        return 1 + sum(len(rest) / len(possible) * self.value(*state, rest) for state, rest in outcomes.items())
+
+
+def positions(seed, count):
+    """Knowledge states from random games on a small board, with their layouts and shots."""
+    rng = random.Random(seed)
+    random.seed(seed)
+    for _ in range(count):
+        fleet = rng.choice(FLEETS)
+        board = Board(SIZE)
+        board.place_ships_randomly(fleet)
+        layout = board.snapshot().layout
+        shots = [divmod(cell, SIZE) for cell in rng.sample(range(SIZE * SIZE), SIZE * SIZE)]
+        yield layout, shots
+
+
+class ConfigurationsTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        for layout, shots in positions(1, 60):
+            for n in range(0, len(shots), 3):
+                fired = sum(1 << (r * SIZE + c) for r, c in shots[:n])
+                ships, hits, blocked = knowledge(SIZE, layout, fired)
+                ships = tuple(sorted(ships, reverse=True))
+                if not ships:
+                    break
+                expected = layouts(SIZE, ships, hits, blocked)
+                self.assertEqual(sorted(configurations(SIZE, ships, hits, blocked, 10000)), sorted(expected))
+                if len(expected) > 1:
+                    self.assertIsNone(configurations(SIZE, ships, hits, blocked, len(expected) - 1))
+
+    def test_knowledge(self):
+        layout = (("CRUISER", 0, 0, 3, 0), ("DESTROYER", 1, 3, 2, 1))
+        # the cruiser sunk, a hit and a miss on column 3
+        fired = 0b111 | 1 << 7 | 1 << 3
+        ships, hits, blocked = knowledge(SIZE, layout, fired)
+        self.assertEqual(ships, (2,))
+        self.assertEqual(hits, 1 << 7)
+        self.assertEqual(blocked, 0b111 | 1 << 3)
+
+
+class SolverTest(unittest.TestCase):
+
+    def test_against_reference(self):
+        reference = Reference(SIZE)
+        solver = EndgameSolver(SIZE, **SOLVER)
+        checked = 0
+        for layout, shots in positions(2, 30):
+            for n in range(len(shots)):
+                fired = sum(1 << (r * SIZE + c) for r, c in shots[:n])
+                ships, hits, blocked = knowledge(SIZE, layout, fired)
+                ships = tuple(sorted(ships, reverse=True))
+                if not ships:
+                    break
+                if len(layouts(SIZE, ships, hits, blocked)) > MAX_LAYOUTS:
+                    continue
+                move = solver.best_move(ships, hits, blocked, BUDGET)
+                self.assertIsNotNone(move)
+                (row, col), value = move
+                best = reference.value(ships, hits, blocked)
+                self.assertAlmostEqual(value, best, places=9)
+                # and the cell it picked is one that gets there
+                cell = row * SIZE + col
+                self.assertFalse((hits | blocked) >> cell & 1)
+                possible = layouts(SIZE, ships, hits, blocked)
+                self.assertAlmostEqual(reference.fire(ships, hits, blocked, possible, cell), best, places=9)
+                checked += 1
+        self.assertGreater(checked, 50)
+
+    def test_cache_shared_across_searches(self):
+        # a second solver with a warm cache has to agree with a fresh one on every position
+        warm = EndgameSolver(SIZE, **SOLVER)
+        for layout, shots in positions(3, 20):
+            for n in range(len(shots)):
+                fired = sum(1 << (r * SIZE + c) for r, c in shots[:n])
+                ships, hits, blocked = knowledge(SIZE, layout, fired)
+                if not ships:
+                    break
+                if len(layouts(SIZE, ships, hits, blocked)) > MAX_LAYOUTS:
+                    continue
+                fresh = EndgameSolver(SIZE, **SOLVER)
+                expected = fresh.expected_shots(ships, hits, blocked, BUDGET)
+                self.assertAlmostEqual(warm.expected_shots(ships, hits, blocked, BUDGET), expected, places=9)
+
+    def test_gives_up(self):
+        solver = EndgameSolver(SIZE, max_configs=5)
+        self.assertIsNone(solver.best_move((3, 2), 0, 0))
+        self.assertIsNone(solver.best_move((), 0, 0))
+
+
+class ReviewTest(unittest.TestCase):
+
+    def test_against_reference(self):
+        reference = Reference(SIZE)
+        for max_configs in (1, 4, MAX_LAYOUTS):
+            solver = EndgameSolver(SIZE, max_configs=max_configs)
+            for layout, shots in positions(4, 20):
+                # the game ends with the last ship cell hit
+                cells = {(row + i * orientation, col + i * (1 - orientation))
+                         for _, row, col, length, orientation in layout for i in range(length)}
+                shots = shots[:max(shots.index(cell) for cell in cells) + 1]
+                # the first position with few enough layouts left to solve
+                first = None
+                for n in range(len(shots)):
+                    fired = sum(1 << (r * SIZE + c) for r, c in shots[:n])
+                    ships, hits, blocked = knowledge(SIZE, layout, fired)
+                    ships = tuple(sorted(ships, reverse=True))
+                    if len(layouts(SIZE, ships, hits, blocked)) <= max_configs:
+                        first = n
+                        break
+                result = review(SIZE, layout, shots, budget=BUDGET, solver=solver)
+                if first is None:
+                    self.assertIsNone(result)
+                    continue
+                self.assertEqual(result[:1] + result[2:], (first, len(shots) - first))
+                self.assertAlmostEqual(result[1], reference.value(ships, hits, blocked), places=9)
+
+
+if __name__ == "__main__":
+    unittest.main()
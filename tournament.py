@@ -0,0 +1,152 @@
+"""
+tournament.py
+
+Bracketed events for many players at once.
+
+ - Tournament works out the pairings for each round and keeps the scores, for either a
+   single-elimination bracket or a Swiss event (everyone plays every round, paired against
+   players on the same score).
+ - run_tournament() plays every match of a round at the same time, each in its own thread,
+   then advances to the next round. The number of rounds is the bracket depth (log2 of the
+   number of entrants, rounded up), however many people enter.
+
+The matches themselves are played by the play_match(playerOne, playerTwo) callback given to
+run_tournament(), which returns the winning player (server.py plays a normal networked game).
+Players are the usual player dicts; each one's position in the entrant list is its seed.
+"""
+
+import math
+import threading
+
+SINGLE_ELIMINATION = "single"
+SWISS = "swiss"
+FORMATS = (SINGLE_ELIMINATION, SWISS)
+
+
+class Tournament:
+
+    def __init__(self, entrants, fmt=SINGLE_ELIMINATION):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown tournament format '{fmt}', should be one of {', '.join(FORMATS)}")
+        if len(entrants) < 2:
+            raise ValueError("A tournament needs at least 2 entrants.")
+        self.entrants = list(entrants)
+        self.format = fmt
+        self.round = 0
+        self.total_rounds = math.ceil(math.log2(len(self.entrants)))
+        # seed -> points (1 per win or bye)
+        self.points = {seed: 0 for seed in range(len(self.entrants))}
+        # frozenset({seedA, seedB}) for every match already played, so Swiss avoids rematches
+        self.played = set()
+        self.byes = set()
+        # single elimination: seeds still in, in bracket order
+        self.alive = self._bracket_order(len(self.entrants))
+
+    @staticmethod
+    def _bracket_order(count):
+        # Standard seeding: 1 plays the lowest seed, and the top two seeds can only meet in the final.
+        # Slots past the last entrant are byes (None).
+        size = 1
+        order = [0]
+        while size < count:
+            size *= 2
+            order = [s for seed in order for s in (seed, size - 1 - seed)]
+        return [seed if seed < count else None for seed in order]
+
+    def finished(self):
+        if self.format == SINGLE_ELIMINATION:
+            return len([s for s in self.alive if s is not None]) <= 1
+        return self.round >= self.total_rounds
+
+    def pairings(self):
+        """
+        Start the next round. Returns a list of (seedA, seedB) matches; seedB is None for a bye.
+        """
+        self.round += 1
+        if self.format == SINGLE_ELIMINATION:
+            return [(a, b) if a is not None else (b, a) for a, b in zip(self.alive[::2], self.alive[1::2])]
+
+        # Swiss: go down the standings, pairing each player with the next one they haven't met.
+        ranked = sorted(self.points, key=lambda seed: (-self.points[seed], seed))
+        pairs = []
+        if len(ranked) % 2:
+            # lowest ranked player who hasn't had a bye yet sits this round out
+            bye = next((seed for seed in reversed(ranked) if seed not in self.byes), ranked[-1])
+            ranked.remove(bye)
+            pairs.append((bye, None))
+        while ranked:
+            a = ranked.pop(0)
+            b = next((seed for seed in ranked if frozenset((a, seed)) not in self.played), ranked[0])
+            ranked.remove(b)
+            pairs.append((a, b))
+        return pairs
+
+    def record(self, results):
+        """Record a finished round, given a list of (seedA, seedB, winnerSeed)."""
+        winners = set()
+        for a, b, winner in results:
+            if b is None:
+                self.byes.add(a)
+            else:
+                self.played.add(frozenset((a, b)))
+            self.points[winner] += 1
+            winners.add(winner)
+        if self.format == SINGLE_ELIMINATION:
+            # keep bracket order, so the next round pairs neighbouring winners
+            self.alive = [seed for seed in self.alive if seed in winners]
+
+    def standings(self):
+        """List of (player, points), best first. Ties keep seed order."""
+        ranked = sorted(self.points, key=lambda seed: (-self.points[seed], seed))
+        return [(self.entrants[seed], self.points[seed]) for seed in ranked]
+
+
+def run_tournament(entrants, play_match, fmt=SINGLE_ELIMINATION, announce=print):
+    """
+    Play a whole event and return the final standings.
+    play_match(playerOne, playerTwo) plays a single game and returns the winning player dict,
+    or None if it couldn't be decided (the higher seed then goes through).
+    announce(msg) is used for round-by-round progress.
+    """
+    tournament = Tournament(entrants, fmt)
+    announce(f"[TOURNAMENT] {len(entrants)} players, {fmt} format, {tournament.total_rounds} rounds.")
+
+    while not tournament.finished():
+        pairs = tournament.pairings()
+        announce(f"[TOURNAMENT] Round {tournament.round}: {len(pairs)} matches.")
+        results = [None] * len(pairs)
+
+        def play(i, a, b):
+            playerOne, playerTwo = entrants[a], entrants[b]
+            try:
+                winner = play_match(playerOne, playerTwo)
+            except Exception as e:
+                print(f"[SERVERERROR] Tournament match failed: {e}")
+                winner = None
+            # a match that couldn't be decided goes to the higher seed
+            results[i] = (a, b, b if winner is playerTwo else a)
+
+        threads = []
+        for i, (a, b) in enumerate(pairs):
+            if b is None:
+                results[i] = (a, None, a)
+                continue
+            t = threading.Thread(target=play, args=(i, a, b), name=f"tournament-r{tournament.round}-m{i}")
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+        tournament.record(results)
+        for a, b, winner in results:
+            if b is None:
+                announce(f"[TOURNAMENT] {entrants[a]['username']} has a bye.")
+            else:
+                loser = b if winner == a else a
+                announce(f"[TOURNAMENT] {entrants[winner]['username']} beat {entrants[loser]['username']}.")
+
+    standings = tournament.standings()
+    announce("[TOURNAMENT] Final standings:")
+    for place, (player, points) in enumerate(standings, start=1):
+        announce(f"  {place}. {player['username']} ({points} pts)")
+    return standings
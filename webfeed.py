@@ -0,0 +1,154 @@
+"""
+webfeed.py
+
+Read-only HTTP view of the matches being played, for dashboards. Started by server.py when
+it's given --http-port. Serves:
+
+    GET /matches               JSON list of matches in progress
+    GET /matches/<id>          JSON snapshot of one match (same as a spectator's [SNAPSHOT])
+    GET /matches/<id>/events   Server-Sent Events stream for one match:
+                                 event: snapshot   the match as it stands when you connect
+                                 (default event)   every event after that, "id:" is its seq
+                                 event: closed     the match is over, the stream ends
+
+Everything runs on one asyncio event loop in a background thread, so a viewer costs a socket
+and a small buffer rather than a thread. Game threads never write to viewers themselves: each
+match's MatchFeed (spectate.py) has one listener from here, which hands the already-encoded
+event to the loop; the loop builds the SSE frame once and writes the same bytes to every
+viewer. A viewer that stops reading is dropped once MAX_BUFFERED_BYTES are queued for it.
+
+Try it with e.g.
+    curl http://127.0.0.1:8080/matches
+    curl -N http://127.0.0.1:8080/matches/1/events
+"""
+
+import asyncio
+import json
+import threading
+
+from spectate import find_match, list_matches
+
+HTTP_PORT = 8080
+# drop a viewer with more than this much unsent data
+MAX_BUFFERED_BYTES = 64 * 1024
+# seconds between SSE comments sent to idle viewers, so dead connections get noticed
+KEEPALIVE_SECS = 15
+REQUEST_TIMEOUT_SECS = 10
+MAX_REQUEST_BYTES = 8192
+
+
+class WebFeed:
+
+    def __init__(self):
+        self.loop = None
+        # match id -> {viewer StreamWriter: seq of the snapshot they were sent}
+        self.viewers = {}
+
+    def start(self, host, port):
+        """Start serving on a background thread. Returns once the port is open."""
+        ready = threading.Event()
+        failed = []
+
+        def run():
+            try:
+                asyncio.run(self._serve(host, port, ready))
+            except OSError as e:
+                failed.append(e)
+                ready.set()
+
+        threading.Thread(target=run, name="webfeed", daemon=True).start()
+        ready.wait()
+        if failed:
+            raise failed[0]
+
+    async def _serve(self, host, port, ready):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"[SERVERINFO] Match feed on http://{host}:{port}/matches")
+        ready.set()
+        async with server:
+            while True:
+                await asyncio.sleep(KEEPALIVE_SECS)
+                for viewers in self.viewers.values():
+                    for writer in list(viewers):
+                        self._write(viewers, writer, b": keepalive\n\n")
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT_SECS)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        parts = request.split(b"\r\n", 1)[0].decode("latin-1").split()
+        if len(parts) != 3 or parts[0] != "GET":
+            return self._respond(writer, 405, {"error": "only GET is supported"})
+        path = parts[1].split("?", 1)[0].strip("/").split("/")
+
+        if path == ["matches"]:
+            return self._respond(writer, 200, [{"match": feed.id, "players": [p["username"] for p in feed.players],
+                                                "turn": feed.turn, "seq": feed.seq} for feed in list_matches()])
+        if len(path) in (2, 3) and path[0] == "matches" and path[1].isdigit():
+            feed = find_match(int(path[1]))
+            if feed is None:
+                return self._respond(writer, 404, {"error": "no such match"})
+            if len(path) == 2:
+                return self._respond(writer, 200, feed.snapshot())
+            if path[2] == "events":
+                return await self.stream(feed, reader, writer)
+        self._respond(writer, 404, {"error": "not found"})
+
+    def _respond(self, writer, status, body):
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        reason = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        writer.close()
+
+    async def stream(self, feed, reader, writer):
+        viewers = self.viewers.get(feed.id)
+        if viewers is None:
+            # first viewer of this match, start listening to it
+            snapshot = feed.add_listener(lambda seq, event: self.loop.call_soon_threadsafe(self._fan_out, feed.id, seq, event))
+            if snapshot is None:
+                return self._respond(writer, 404, {"error": "match is over"})
+            viewers = self.viewers[feed.id] = {}
+        else:
+            snapshot = feed.snapshot()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        writer.write(f"event: snapshot\nid: {snapshot['seq']}\ndata: {json.dumps(snapshot, separators=(',', ':'))}\n\n".encode("utf-8"))
+        viewers[writer] = snapshot["seq"]
+        try:
+            # nothing more is expected from the viewer, this just waits for them to hang up
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            viewers.pop(writer, None)
+            writer.close()
+
+    def _fan_out(self, match_id, seq, event):
+        # runs on the event loop, one call per event however many viewers there are
+        viewers = self.viewers.get(match_id)
+        if viewers is None:
+            return
+        if event is None:
+            frame = b"event: closed\ndata: {}\n\n"
+            del self.viewers[match_id]
+        else:
+            frame = f"id: {seq}\ndata: {event}\n\n".encode("utf-8")
+        for writer, after in list(viewers.items()):
+            # skip events already covered by the snapshot this viewer was sent
+            if seq > after or event is None:
+                self._write(viewers, writer, frame)
+            if event is None:
+                writer.close()
+
+    def _write(self, viewers, writer, frame):
+        if writer.transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+            print("[SERVERINFO] Dropping a match feed viewer that stopped reading.")
+            viewers.pop(writer, None)
+            writer.transport.abort()
+            return
+        writer.write(frame)